@@ -2,30 +2,40 @@
 """
 @author: aw03
 
+Build the route-keyed subway MultiGraph from a GTFS feed.
 
+Importing this module has no side effects; call ``build_graph(feed_dir)``
+to get the graph and index tables in memory, or run it as a script:
 
-inspired by 
+    python GTFS_MTA_with_routes.py datasets --output-dir generated_graphs --plot
+
+cartopy / matplotlib are only imported when a map is requested.
 """
 
-import networkx as nx
-# import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
-from csv import DictReader
-from itertools import groupby
-import cartopy.feature as cfeature
-import matplotlib
-matplotlib.use("Agg")   # or "SVG", "PDF", etc.
-import matplotlib.pyplot as plt
-
-import csv
-import numpy as np
+import argparse
+import os
 
+import numpy as np
 
-DATA_ROOT = "C:\\Users\\Administrator\\GTFS-NetworkX\\datasets\\"
-TRIPS_FILE = f'{DATA_ROOT}trips.txt'
-ROUTES_FILE = f'{DATA_ROOT}routes.txt'
-STOPS_FILE = f'{DATA_ROOT}stops.txt'
-TRANSFERS_FILE = f'{DATA_ROOT}transfers.txt'   # <-- add this
+import graph_cache
+from csr_graph import CSRGraph
+from departures_index import build_departures_index
+from gtfs_loader import (open_feed_file, load_routes, load_trips, load_stops,
+                         load_transfers, load_calendar, load_stop_times,
+                         load_stop_times_parallel)
+from gtfs_patterns import trip_patterns, pattern_segments
+from gtfs_graph import (route_name_codes, graph_nodes, aggregate_edges,
+                        index_routes, add_edge_times, build_multigraph, build_transfer_edges,
+                        write_nodes_csv, write_routes_csv,
+                        write_edges_by_route_csv, write_transfer_edges_csv,
+                        write_stop_routes_csv, export_tables, plot_graph)
+from graph_bundle import BUNDLE_FILE, write_bundle
+from walking_transfers import add_walking_transfers
+from station_complexes import STATIONS_FILE, merge_complexes, write_node_complexes_csv
+
+
+DATA_ROOT = 'datasets'
+OUTPUT_DIR = 'generated_graphs'
 
 INCLUDE_AGENCIES = ['MTA NYCT']
 
@@ -33,345 +43,230 @@ IGNORE_ROUTE = [
     'SI' # Staten Island Railway, not part of subway network
 ]
 
-# MultiGraph so we can have multiple edges (routes) between same stations
-G = nx.MultiGraph()
-
-
-def get_stop_id(stop_id):
-    """Translate stop_id to parent_stop_id if available."""
-    if STOPS[stop_id]['parent_station'] == '':
-        return stop_id
-    else:
-        return STOPS[stop_id]['parent_station']
-
-
-def add_stop_to_graph(G, stop_id):
-    """Add stop as new node to graph (using parent stop if available)."""
-    node = STOPS[get_stop_id(stop_id)]
-
-    if node['stop_id'] not in G.nodes:
-        G.add_node(
-            node['stop_id'],
-            stop_name=node['stop_name'],
-            stop_lon=node['stop_lon'],
-            stop_lat=node['stop_lat'],
-        )
-    return G
 
-
-def add_edge_to_graph(G, from_id, to_id, route_short_name):
+def load_feed(feed_dir, include_agencies=INCLUDE_AGENCIES, ignore_route=IGNORE_ROUTE,
+              processes=1):
     """
-    Add edge to graph between from_id and to_id for a given route_short_name.
-    Uses route_short_name as the edge key in the MultiGraph.
+    Load the GTFS tables the graph build needs.
 
-    If an edge with this key already exists, increment the 'count' attribute.
+    ``feed_dir`` may be a directory of .txt files or a zipped GTFS feed,
+    which is streamed member by member without extracting it. With
+    ``processes`` > 1, stop_times.txt of a feed directory is parsed in
+    parallel (same result as the serial loader).
     """
-    u = get_stop_id(from_id)
-    v = get_stop_id(to_id)
-
-    edge_data = G.get_edge_data(u, v, route_short_name, default=None)
-    if edge_data is None:
-        # first time we see this (u, v, route) combo
-        G.add_edge(u, v, key=route_short_name, count=1)
+    with open_feed_file(feed_dir, 'routes.txt') as f:
+        routes = load_routes(f, include_agencies, ignore_route)
+    with open_feed_file(feed_dir, 'trips.txt') as f:
+        trips = load_trips(f, routes=routes)
+    with open_feed_file(feed_dir, 'stops.txt') as f:
+        stops = load_stops(f)
+    with open_feed_file(feed_dir, 'transfers.txt') as f:
+        transfers = load_transfers(f, stops=stops)
+    try:
+        with open_feed_file(feed_dir, 'calendar.txt') as f:
+            calendar = load_calendar(f)
+    except FileNotFoundError:
+        print('no calendar.txt; departures index will use every service')
+        calendar = None
+    if processes > 1 and os.path.isdir(feed_dir):
+        stop_times = load_stop_times_parallel(os.path.join(feed_dir, 'stop_times.txt'),
+                                              stops=stops, trips=trips,
+                                              processes=processes)
     else:
-        # already saw this route between these two stops; increment count
-        G.add_edge(u, v, key=route_short_name, count=edge_data['count'] + 1)
-
-
-def load_routes(filename):
-    """Include only routes from agencies we are interested in."""
-    routes_csv = DictReader(open(filename, 'r'))
-    routes_dict = dict()
-    for route in routes_csv:
-        if (route['agency_id'] in INCLUDE_AGENCIES and
-                route['route_id'] not in IGNORE_ROUTE):
-
-            routes_dict[route['route_id']] = route
-    print('routes', len(routes_dict))
-    return routes_dict
-
-
-def load_trips(filename, routes_dict):
-    """
-    Load trips from file, only include trips on routes we are interested in.
+        with open_feed_file(feed_dir, 'stop_times.txt') as f:
+            stop_times = load_stop_times(f, stops=stops, trips=trips)
+    return {
+        'routes': routes,
+        'trips': trips,
+        'stops': stops,
+        'transfers': transfers,
+        'calendar': calendar,
+        'stop_times': stop_times,
+    }
+
+
+def build_tables(feed):
+    """Trip patterns plus the node / edge / route / transfer index tables."""
+    # Trips sharing a stop sequence are walked once, weighted by trip count
+    patterns = trip_patterns(feed['stop_times'], feed['trips'])
+
+    # IMPORTANT: store ALL (from, to, route) combinations, not just one per pair
+    from_codes, to_codes, pattern_codes = pattern_segments(patterns)
+    route_names, route_name_code = route_name_codes(feed['routes'])
+    segment_routes = route_name_code[patterns['route_code'][pattern_codes]]
+    segment_trips = patterns['trip_count'][pattern_codes]
+
+    print('edges (pattern segments)', len(from_codes),
+          'covering', segment_trips.sum(), 'trip segments')
+
+    # Collapse to parent stations and count trips per (u, v, route) in one pass
+    nodes = graph_nodes(feed['stops'], from_codes, to_codes)
+    edges = aggregate_edges(nodes, from_codes, to_codes,
+                            segment_routes, weights=segment_trips)
+    routes_in_graph = index_routes(edges, route_names)
+
+    # Scheduled run times per edge, from the stop_time columns already loaded
+    trip_route_code = route_name_code[feed['trips'].columns['route_code']]
+    add_edge_times(edges, nodes, feed['stop_times'], trip_route_code)
+
+    # Weekday departures per route and directed edge for trains-per-hour queries
+    graph_route_idx = np.searchsorted(routes_in_graph, route_names)
+    in_graph = routes_in_graph[np.minimum(graph_route_idx, len(routes_in_graph) - 1)] == route_names
+    trip_route_idx = np.where(in_graph, graph_route_idx, -1)[trip_route_code]
+    departures = build_departures_index(feed['stop_times'], feed['trips'],
+                                        feed['calendar'], nodes, trip_route_idx)
+
+    transfer_edges = build_transfer_edges(feed['stops'], feed['transfers'], nodes)
+
+    return {
+        'patterns': patterns,
+        'nodes': nodes,
+        'edges': edges,
+        'route_names': routes_in_graph,
+        'transfer_edges': transfer_edges,
+        'departures': departures,
+    }
+
+
+def build_graph(feed_dir, include_agencies=INCLUDE_AGENCIES,
+                ignore_route=IGNORE_ROUTE, build_networkx=True, cache_dir=None,
+                processes=1, walk_radius=None, stations_file=None):
     """
-    trips_csv = DictReader(open(filename, 'r'))
-    trips_dict = dict()
-    for trip in trips_csv:
-        if trip['route_id'] in routes_dict:
-            trip['color'] = routes_dict[trip['route_id']]['route_color']
-            trip['route_short_name'] = routes_dict[trip['route_id']]['route_short_name']
-            trips_dict[trip['trip_id']] = trip
-    print('trips', len(trips_dict))
-    return trips_dict
-
-
-def load_stops(filename):
-    stops_csv = DictReader(open(filename, 'r'))
-    stops_dict = dict()
-    for stop in stops_csv:
-        stops_dict[stop['stop_id']] = stop
-    print('stops', len(stops_dict))
-    return stops_dict
-
-def load_transfers(filename):
+    Build the subway graph for the feed in ``feed_dir``.
+
+    Returns a dict with the loaded ``feed`` tables, the trip ``patterns``,
+    the ``nodes`` / ``edges`` / ``transfer_edges`` index tables, the
+    ``route_names`` per route_idx, the weekday ``departures`` index (see
+    departures_index.py), ``csr`` (the array-backed CSRGraph, see
+    csr_graph.py) and ``G`` (the nx.MultiGraph, or None when
+    ``build_networkx`` is False).
+
+    With ``cache_dir`` set, the tables are looked up in the graph_cache under
+    the hash of the feed files and options first; on a hit ``feed`` is None.
+    ``processes`` > 1 parses stop_times.txt over a process pool.
+
+    With ``stations_file`` (MTA_Subway_Stations_*.csv) stations linked by
+    transfers or a shared Complex ID are merged into one node each (see
+    station_complexes.py); ``station_nodes`` / ``node_complex`` keep the
+    mapping back to GTFS stations. The cache always holds station-level tables.
+
+    With ``walk_radius`` (meters), walking transfers between nearby nodes
+    (complexes, when merged) are added to ``transfer_edges`` (see
+    walking_transfers.py).
     """
-    Load transfers from transfers.txt.
-
-    Expected columns (standard GTFS):
-      from_stop_id, to_stop_id, transfer_type, min_transfer_time (optional)
-
-    We keep all rows, but you could filter on transfer_type if desired.
-    """
-    transfers_csv = DictReader(open(filename, 'r'))
-    transfers = []
-    for row in transfers_csv:
-        # you can filter here if you want, e.g. only recommended transfers:
-        # if row.get('transfer_type', '0') not in ('0', '1'):
-        #     continue
-        transfers.append(row)
-    print('transfers', len(transfers))
-    return transfers
-
-# ==============================================
-
-ROUTES = load_routes(filename=ROUTES_FILE)
-TRIPS = load_trips(filename=TRIPS_FILE, routes_dict=ROUTES)
-STOPS = load_stops(filename=STOPS_FILE)
-TRANSFERS = load_transfers(filename=TRANSFERS_FILE)
-
-# ==============================================
-
-stop_times_csv = DictReader(open(f'{DATA_ROOT}stop_times.txt', 'r'))
-
-stops = set()
-# IMPORTANT: store ALL (from, to, route) combinations, not just one per pair
-edges = []
-
-for trip_id, stop_time_iter in groupby(stop_times_csv, lambda st: st['trip_id']):
-    if trip_id in TRIPS:
-        trip = TRIPS[trip_id]
-        route_short_name = trip['route_short_name']
-
-        # groupby yields an iterator; materialize it so we can safely walk it
-        stop_times = list(stop_time_iter)
-        if len(stop_times) < 2:
-            continue
-
-        prev_stop = stop_times[0]['stop_id']
-        stops.add(prev_stop)
-
-        for stop_time in stop_times[1:]:
-            stop = stop_time['stop_id']
-            stops.add(stop)
-            edges.append((prev_stop, stop, route_short_name))
-            prev_stop = stop
-
-print('stops', len(stops))
-print('edges (trip segments)', len(edges))
-
-# Add nodes
-for stop_id in STOPS:
-    if stop_id in stops:
-        add_stop_to_graph(G, stop_id)
-print('Nodes:', G.number_of_nodes())
-
-# Add edges to MultiGraph, preserving route dimension
-for start_stop_id, end_stop_id, route_short_name in edges:
-    add_edge_to_graph(
-        G,
-        from_id=start_stop_id,
-        to_id=end_stop_id,
-        route_short_name=route_short_name
-    )
-print('Edges (MultiGraph):', G.number_of_edges())
-
-
-# ================================
-# Build indices + CSV exports
-# ================================
-
-# Node indices
-nodes = list(G.nodes())
-node_index = {node: i for i, node in enumerate(nodes)}
-
-# Route indices (one index per route_short_name actually in the graph)
-routes_in_graph = sorted({key for _, _, key in G.edges(keys=True)})
-route_index = {r: k for k, r in enumerate(routes_in_graph)}
-
-print("Num nodes:", len(nodes))
-print("Num routes:", len(routes_in_graph))
-
-# --- NODES TABLE ---
-with open('generated_graphs\\nodes.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow(['node_idx', 'stop_id', 'stop_name', 'stop_lon', 'stop_lat'])
-    for stop_id in nodes:
-        attrs = G.nodes[stop_id]
-        writer.writerow([
-            node_index[stop_id],
-            stop_id,
-            attrs.get('stop_name', ''),
-            attrs.get('stop_lon', ''),
-            attrs.get('stop_lat', '')
-        ])
-
-# --- ROUTES TABLE ---
-with open('generated_graphs\\routes.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow(['route_idx', 'route_short_name'])
-    for r, k in route_index.items():
-        writer.writerow([k, r])
-
-# --- EDGES TABLE WITH ROUTE DIMENSION (for x_i_j_r) ---
-with open('generated_graphs\\edges_by_route.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow([
-        'edge_idx',
-        'from_idx', 'to_idx',
-        'route_idx',
-        'from_stop_id', 'to_stop_id',
-        'route_short_name',
-        'count'
-    ])
-
-    for edge_idx, (u, v, r, data) in enumerate(G.edges(keys=True, data=True)):
-        i = node_index[u]
-        j = node_index[v]
-        k = route_index[r]
-        cnt = data.get('count', 1)
-        writer.writerow([
-            edge_idx,
-            i, j,
-            k,
-            u, v,
-            r,
-            cnt
-        ])
-
-print("Wrote nodes.csv, routes.csv, edges_by_route.csv")
-
-# ================================================
-# Build TRANSFER EDGES CSV from GTFS transfers.txt
-# ================================================
-
-transfer_edges = []  # list of (from_node, to_node, transfer_type, min_time)
-
-for row in TRANSFERS:
-    raw_from = row['from_stop_id']
-    raw_to = row['to_stop_id']
-
-    # Map GTFS stop_ids to the parent-station node ids used in G
-    u = get_stop_id(raw_from)
-    v = get_stop_id(raw_to)
-
-    # Ignore self-transfers after collapsing to parent stations
-    if u == v:
-        continue
-
-    # Only keep transfers where both endpoints exist in our graph
-    if u not in node_index or v not in node_index:
-        continue
-
-    transfer_type = row.get('transfer_type', '')
-    min_transfer_time = row.get('min_transfer_time', '')
-
-    transfer_edges.append((u, v, transfer_type, min_transfer_time))
-
-print(f"Transfer edges (after mapping to graph nodes): {len(transfer_edges)}")
-
-# Write CSV
-with open('generated_graphs\\transfer_edges.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow([
-        'transfer_edge_id',
-        'from_stop_id', 'to_stop_id',
-        'from_idx', 'to_idx',
-        'transfer_type',
-        'min_transfer_time',
-        'cost'
-    ])
-
-    for edge_id, (u, v, ttype, min_time) in enumerate(transfer_edges):
-        # cost: you said you want same cost as any other station-to-station move
-        # so we just set cost = 1. Change here if you later want to use min_time.
-        writer.writerow([
-            edge_id,
-            u, v,
-            node_index[u], node_index[v],
-            ttype,
-            min_time,
-            1   # constant traversal cost
-        ])
-
-print("Wrote transfer_edges.csv")
-
-
-# ================================
-# Plotting (same as before)
-# ================================
-
-deg = nx.degree(G)
-labels = {
-    stop_id: G.nodes[stop_id].get('stop_name', '') if deg[stop_id] >= 0 else ''
-    for stop_id in G.nodes
-}
-
-# Build pos dict with numeric lon/lat
-pos = {}
-for stop_id in G.nodes:
-    try:
-        lon = float(G.nodes[stop_id]['stop_lon'])
-        lat = float(G.nodes[stop_id]['stop_lat'])
-        pos[stop_id] = (lon, lat)
-    except (KeyError, TypeError, ValueError):
-        # Skip nodes without valid numeric coordinates
-        continue
-
-# lon/lat data is in PlateCarree projection
-data_crs = ccrs.PlateCarree()
-
-fig = plt.figure(figsize=(20, 20))
-ax = plt.axes(projection=ccrs.PlateCarree())
-
-nx.draw_networkx(
-    G,
-    ax=ax,
-    # labels=labels,  # optional: labels clutter the map
-    pos=pos,
-    node_size=2,
-    # transform=data_crs,  # NetworkX doesn't take this; see earlier notes if needed
-)
-
-# ax.set_axis_off()
-
-plt.show(block=True)
-fig.savefig('gtfs_networkx_map_with_routes.png', dpi=300)
-
-import csv
-
-# ================================
-# For each stop: which routes stop there?
-# ================================
-
-with open('generated_graphs\\stop_routes.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow(['stop_id', 'stop_name', 'routes_at_stop'])
-
-    for stop_id in G.nodes():
-        attrs = G.nodes[stop_id]
-        stop_name = attrs.get('stop_name', '')
-
-        # Collect all route_short_name keys for edges incident to this stop
-        routes_here = set()
-
-        # edges attached to this node: (u, v, key, data)
-        for u, v, r, data in G.edges(stop_id, keys=True, data=True):
-            routes_here.add(r)
-
-        routes_list = sorted(routes_here)  # nice and ordered for readability
-        routes_str = ",".join(routes_list)
-
-        writer.writerow([stop_id, stop_name, routes_str])
-
-print("Wrote stop_routes.csv")
+    key = None
+    graph = None
+    if cache_dir is not None:
+        key = graph_cache.cache_key(feed_dir, cache_dir=cache_dir,
+                                    include_agencies=list(include_agencies),
+                                    ignore_route=list(ignore_route))
+        graph = graph_cache.load(cache_dir, key)
+        if graph is not None:
+            print('loaded graph tables from cache', key)
+            graph['feed'] = None
+
+    if graph is None:
+        feed = load_feed(feed_dir, include_agencies, ignore_route, processes)
+        graph = build_tables(feed)
+        if key is not None:
+            graph_cache.store(cache_dir, key, graph)
+        graph['feed'] = feed
+
+    if stations_file is not None:
+        graph = merge_complexes(graph, stations_file)
+    if walk_radius is not None:
+        graph['transfer_edges'] = add_walking_transfers(graph['nodes'], graph['transfer_edges'],
+                                                        walk_radius)
+
+    print('Nodes:', len(graph['nodes']['stop_id']))
+    print('Edges (MultiGraph):', len(graph['edges']['count']))
+    print("Num routes:", len(graph['route_names']))
+
+    graph['csr'] = CSRGraph.from_tables(graph['nodes'], graph['edges'], graph['route_names'])
+
+    graph['G'] = None
+    if build_networkx:
+        # MultiGraph so we can have multiple edges (routes) between same stations
+        graph['G'] = build_multigraph(graph['nodes'], graph['edges'],
+                                      graph['route_names'])
+    return graph
+
+
+def write_graph_csvs(graph, output_dir=OUTPUT_DIR):
+    """Write nodes / routes / edges_by_route / transfer_edges / stop_routes CSVs."""
+    write_nodes_csv(os.path.join(output_dir, 'nodes.csv'), graph['nodes'])
+    write_routes_csv(os.path.join(output_dir, 'routes.csv'), graph['route_names'])
+    # --- EDGES TABLE WITH ROUTE DIMENSION (for x_i_j_r) ---
+    write_edges_by_route_csv(os.path.join(output_dir, 'edges_by_route.csv'),
+                             graph['nodes'], graph['edges'], graph['route_names'])
+    print("Wrote nodes.csv, routes.csv, edges_by_route.csv")
+
+    write_transfer_edges_csv(os.path.join(output_dir, 'transfer_edges.csv'),
+                             graph['nodes'], graph['transfer_edges'])
+    print("Wrote transfer_edges.csv")
+
+    if 'node_complex' in graph:
+        write_node_complexes_csv(os.path.join(output_dir, 'node_complexes.csv'),
+                                 graph['station_nodes'], graph['node_complex'])
+        print("Wrote node_complexes.csv")
+
+    write_stop_routes_csv(os.path.join(output_dir, 'stop_routes.csv'), graph['csr'])
+    print("Wrote stop_routes.csv")
+
+
+def write_graph_bundle(graph, output_dir=OUTPUT_DIR):
+    """Write the CSV tables (plus node_complexes when merged) as one graph.bundle, and graph_csr.npz."""
+    tables = export_tables(graph['nodes'], graph['edges'], graph['route_names'],
+                           graph['transfer_edges'])
+    if 'node_complex' in graph:
+        tables['node_complexes'] = {
+            'stop_id': graph['station_nodes']['stop_id'],
+            'stop_name': graph['station_nodes']['stop_name'],
+            'station_idx': np.arange(len(graph['node_complex']), dtype=np.int32),
+            'node_idx': graph['node_complex'],
+        }
+    write_bundle(os.path.join(output_dir, BUNDLE_FILE), tables)
+    graph['csr'].save(os.path.join(output_dir, 'graph_csr.npz'))
+    print("Wrote", BUNDLE_FILE + ", graph_csr.npz")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('feed_dir', nargs='?', default=DATA_ROOT,
+                        help='GTFS feed: directory of .txt files or .zip archive')
+    parser.add_argument('--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--no-networkx', action='store_true',
+                        help='skip the nx.MultiGraph and only write the CSV tables')
+    parser.add_argument('--plot', action='store_true',
+                        help='render gtfs_networkx_map_with_routes.png (needs cartopy)')
+    parser.add_argument('--cache-dir', default=graph_cache.CACHE_DIR,
+                        help='graph table cache (see graph_cache.py)')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--no-csv', action='store_true',
+                        help='only write the binary graph.bundle (see graph_bundle.py)')
+    parser.add_argument('--processes', type=int, default=1,
+                        help='parse stop_times.txt over this many processes')
+    parser.add_argument('--walk-radius', type=float, default=None, metavar='METERS',
+                        help='add walking transfers between stations this close')
+    parser.add_argument('--merge-complexes', nargs='?', const=STATIONS_FILE, default=None,
+                        metavar='STATIONS_CSV',
+                        help='merge station complexes (default list: %(const)s)')
+    args = parser.parse_args(argv)
+    if args.plot and args.no_networkx:
+        parser.error('--plot needs the networkx graph; drop --no-networkx')
+
+    graph = build_graph(args.feed_dir, build_networkx=not args.no_networkx,
+                        cache_dir=None if args.no_cache else args.cache_dir,
+                        processes=args.processes, walk_radius=args.walk_radius,
+                        stations_file=args.merge_complexes)
+    write_graph_bundle(graph, args.output_dir)
+    if not args.no_csv:
+        write_graph_csvs(graph, args.output_dir)
+
+    if args.plot:
+        plot_graph(graph['G'],
+                   os.path.join(args.output_dir, 'gtfs_networkx_map_with_routes.png'))
+
+
+if __name__ == '__main__':
+    main()
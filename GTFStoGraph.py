@@ -7,22 +7,16 @@ Created on Tue May  8 17:48:55 2018
 inspired by https://github.com/paulgb/gtfs-gexf/blob/master/transform.py
 """
 
-import networkx as nx
-# import matplotlib.pyplot as plt
-import cartopy.crs as ccrs
+import argparse
+import csv
+import os
 from csv import DictReader
 from itertools import groupby
-import cartopy.feature as cfeature
-import matplotlib
-matplotlib.use("Agg")   # or "SVG", "PDF", etc.
-import matplotlib.pyplot as plt
+
+import networkx as nx
 
 
-    
-DATA_ROOT="C:\\Users\\Administrator\\GTFS-NetworkX\datasets\\"
-TRIPS_FILE = f'{DATA_ROOT}trips.txt'
-ROUTES_FILE = f'{DATA_ROOT}routes.txt'
-STOPS_FILE = f'{DATA_ROOT}stops.txt'
+DATA_ROOT = 'datasets'
 
 INCLUDE_AGENCIES=['MTA NYCT']
 
@@ -30,8 +24,6 @@ IGNORE_ROUTE=['RTTA_DEF', #out of service
               'RTTA_REV',  #revenue train (charter)
               'BL_1b','BL_1c','BL_1d','BL_1e']
 
-G = nx.MultiGraph()
-
 #trips_csv = DictReader(open(f'{DATA_ROOT}trips.txt','r'))
 #stops_csv = DictReader(open(f'{DATA_ROOT}stops.txt','r'))
 #stop_times_csv = DictReader(open(f'{DATA_ROOT}stop_times.txt','r'))
@@ -115,158 +107,157 @@ def load_stops(filename):
     return stops_dict
 
 
-# ==============================================
-
-
-ROUTES = load_routes(filename=ROUTES_FILE)
-TRIPS = load_trips(filename=TRIPS_FILE, routes_dict=ROUTES)
-STOPS = load_stops(filename=STOPS_FILE)
-
-stop_times_csv = DictReader(open(f'{DATA_ROOT}stop_times.txt','r'))
-
-stops = set()
-edges = dict()
-for trip_id, stop_time_iter in groupby(stop_times_csv, lambda stop_time: stop_time['trip_id']):
-    if trip_id in TRIPS:
-        trip = TRIPS[trip_id]
-        prev_stop = next(stop_time_iter)['stop_id']
-        stops.add(prev_stop)
-        for stop_time in stop_time_iter:
-            stop = stop_time['stop_id']
-            edge = (prev_stop, stop)
-            edges[edge] = trip['route_short_name']
-            stops.add(stop)
-            prev_stop = stop
-print ('stops', len(stops))
-print ('edges', len(edges))
-
-for stop_id in STOPS:
-    if stop_id in stops:
-       add_stop_to_graph(G, stop_id)
-print('Nodes:', G.number_of_nodes() )
-        
-for (start_stop_id, end_stop_id), route_short_name in edges.items():
-    add_edge_to_graph(G, 
-                      from_id = start_stop_id, 
-                      to_id = end_stop_id, 
-                      route_short_name=route_short_name)
-print('Edges:', G.number_of_edges() )
-
-
-
-
-
-
-
-
-deg = nx.degree(G)
-labels = {
-    stop_id: G.nodes[stop_id].get('stop_name', '') if deg[stop_id] >= 0 else ''
-    for stop_id in G.nodes
-}
-
-
-pos = {
-    stop_id: (
-        G.nodes[stop_id].get('stop_lon'),
-        G.nodes[stop_id].get('stop_lat')
-    )
-    for stop_id in G.nodes
-}
-
-pos = {}
-for stop_id in G.nodes:
-    try:
-        lon = float(G.nodes[stop_id]['stop_lon'])
-        lat = float(G.nodes[stop_id]['stop_lat'])
-        pos[stop_id] = (lon, lat)
-    except (KeyError, TypeError, ValueError):
-        # Skip nodes without valid numeric coordinates
-        continue
-
-# lon/lat data is in PlateCarree projection
-data_crs = ccrs.PlateCarree()
-
-fig = plt.figure(figsize=(20,20))
-ax = plt.axes(projection=ccrs.PlateCarree()) #central_longitude=151
-#ax.set_extent((150, 155, -35, -32))
-
-nx.draw_networkx(G
-                 ,ax=ax
-#                 ,labels=labels
-                 ,pos=pos
-                 ,node_size=2
-                # ,transform=data_crs
-                )
-#ax.set_axis_off()
-
-plt.show(block=True)
-fig.savefig('gtfs_networkx_map.png', dpi=300)
-
-
-# =============================
-
-# Make node csv
-import csv
-import numpy as np
-
-# Collapse MultiGraph to simple graph with weights (as before)
-G_simple = nx.Graph()
-for u, v, data in G.edges(data=True):
-    w = data.get('count', 1)
-    if G_simple.has_edge(u, v):
-        G_simple[u][v]['weight'] += w
-    else:
-        G_simple.add_edge(u, v, weight=w)
-
-# Consistent node ordering + index
-nodes = list(G_simple.nodes())
-node_index = {node: i for i, node in enumerate(nodes)}
-
-# --- NODES TABLE ---
-with open('nodes.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow(['node_idx', 'stop_id', 'stop_name', 'stop_lon', 'stop_lat'])
-    for stop_id in nodes:
-        attrs = G.nodes[stop_id]
-        writer.writerow([
-            node_index[stop_id],
-            stop_id,
-            attrs.get('stop_name', ''),
-            attrs.get('stop_lon', ''),
-            attrs.get('stop_lat', '')
-        ])
-
-
-# --- EDGES TABLE ---
+def build_graph(feed_dir):
+    """ load the feed in feed_dir and build the MultiGraph
+        (one edge per stop pair, keyed by the last route seen on it)
+    """
+    global ROUTES, TRIPS, STOPS
+
+    ROUTES = load_routes(filename=os.path.join(feed_dir, 'routes.txt'))
+    TRIPS = load_trips(filename=os.path.join(feed_dir, 'trips.txt'), routes_dict=ROUTES)
+    STOPS = load_stops(filename=os.path.join(feed_dir, 'stops.txt'))
+
+    stop_times_csv = DictReader(open(os.path.join(feed_dir, 'stop_times.txt'),'r'))
+
+    stops = set()
+    edges = dict()
+    for trip_id, stop_time_iter in groupby(stop_times_csv, lambda stop_time: stop_time['trip_id']):
+        if trip_id in TRIPS:
+            trip = TRIPS[trip_id]
+            prev_stop = next(stop_time_iter)['stop_id']
+            stops.add(prev_stop)
+            for stop_time in stop_time_iter:
+                stop = stop_time['stop_id']
+                edge = (prev_stop, stop)
+                edges[edge] = trip['route_short_name']
+                stops.add(stop)
+                prev_stop = stop
+    print ('stops', len(stops))
+    print ('edges', len(edges))
+
+    G = nx.MultiGraph()
+    for stop_id in STOPS:
+        if stop_id in stops:
+           add_stop_to_graph(G, stop_id)
+    print('Nodes:', G.number_of_nodes() )
+
+    for (start_stop_id, end_stop_id), route_short_name in edges.items():
+        add_edge_to_graph(G, 
+                          from_id = start_stop_id, 
+                          to_id = end_stop_id, 
+                          route_short_name=route_short_name)
+    print('Edges:', G.number_of_edges() )
+    return G
 
-with open('edges.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    writer.writerow([
-        'edge_idx',
-        'from_idx', 'to_idx',
-        'from_stop_id', 'to_stop_id',
-        'route_short_name', 'count'
-    ])
 
-    for edge_idx, (u, v, key, data) in enumerate(G.edges(keys=True, data=True)):
+def plot_graph(G, filename):
+    """ draw the graph on a map
+        cartopy / matplotlib are only imported when a map is requested
+    """
+    import cartopy.crs as ccrs
+    import matplotlib
+    matplotlib.use("Agg")   # or "SVG", "PDF", etc.
+    import matplotlib.pyplot as plt
+
+    pos = {}
+    for stop_id in G.nodes:
+        try:
+            lon = float(G.nodes[stop_id]['stop_lon'])
+            lat = float(G.nodes[stop_id]['stop_lat'])
+            pos[stop_id] = (lon, lat)
+        except (KeyError, TypeError, ValueError):
+            # Skip nodes without valid numeric coordinates
+            continue
+
+    # lon/lat data is in PlateCarree projection
+    fig = plt.figure(figsize=(20,20))
+    ax = plt.axes(projection=ccrs.PlateCarree()) #central_longitude=151
+    #ax.set_extent((150, 155, -35, -32))
+
+    nx.draw_networkx(G
+                     ,ax=ax
+    #                 ,labels=labels
+                     ,pos=pos
+                     ,node_size=2
+                    # ,transform=data_crs
+                    )
+    #ax.set_axis_off()
+
+    fig.savefig(filename, dpi=300)
+    plt.close(fig)
+
+
+def write_csvs(G, output_dir='.'):
+    """ write nodes.csv, edges.csv and adjacency_matrix.csv
+    """
+    # Collapse MultiGraph to simple graph with weights (as before)
+    G_simple = nx.Graph()
+    for u, v, data in G.edges(data=True):
+        w = data.get('count', 1)
+        if G_simple.has_edge(u, v):
+            G_simple[u][v]['weight'] += w
+        else:
+            G_simple.add_edge(u, v, weight=w)
+
+    # Consistent node ordering + index
+    nodes = list(G_simple.nodes())
+    node_index = {node: i for i, node in enumerate(nodes)}
+
+    # --- NODES TABLE ---
+    with open(os.path.join(output_dir, 'nodes.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['node_idx', 'stop_id', 'stop_name', 'stop_lon', 'stop_lat'])
+        for stop_id in nodes:
+            attrs = G.nodes[stop_id]
+            writer.writerow([
+                node_index[stop_id],
+                stop_id,
+                attrs.get('stop_name', ''),
+                attrs.get('stop_lon', ''),
+                attrs.get('stop_lat', '')
+            ])
+
+    # --- EDGES TABLE ---
+    with open(os.path.join(output_dir, 'edges.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
         writer.writerow([
-            edge_idx,
-            node_index[u],
-            node_index[v],
-            u,
-            v,
-            key,                     # this is route_short_name (your edge key)
-            data.get('count', 1)
+            'edge_idx',
+            'from_idx', 'to_idx',
+            'from_stop_id', 'to_stop_id',
+            'route_short_name', 'count'
         ])
 
-
-# --- ADJACENCY MATRIX ---
-A = nx.to_numpy_array(G_simple, nodelist=nodes, weight='weight')
-
-with open('adjacency_matrix.csv', 'w', newline='', encoding='utf-8') as f:
-    writer = csv.writer(f)
-    # header row with stop_id; you could also use node_idx instead
-    writer.writerow(['stop_id'] + nodes)
-    for i, stop_id in enumerate(nodes):
-        writer.writerow([stop_id] + list(A[i, :]))
\ No newline at end of file
+        for edge_idx, (u, v, key, data) in enumerate(G.edges(keys=True, data=True)):
+            writer.writerow([
+                edge_idx,
+                node_index[u],
+                node_index[v],
+                u,
+                v,
+                key,                     # this is route_short_name (your edge key)
+                data.get('count', 1)
+            ])
+
+    # --- ADJACENCY MATRIX ---
+    A = nx.to_numpy_array(G_simple, nodelist=nodes, weight='weight')
+
+    with open(os.path.join(output_dir, 'adjacency_matrix.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        # header row with stop_id; you could also use node_idx instead
+        writer.writerow(['stop_id'] + nodes)
+        for i, stop_id in enumerate(nodes):
+            writer.writerow([stop_id] + list(A[i, :]))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('feed_dir', nargs='?', default=DATA_ROOT)
+    parser.add_argument('--output-dir', default='.')
+    parser.add_argument('--plot', action='store_true',
+                        help='render gtfs_networkx_map.png (needs cartopy)')
+    args = parser.parse_args()
+
+    G = build_graph(args.feed_dir)
+    if args.plot:
+        plot_graph(G, os.path.join(args.output_dir, 'gtfs_networkx_map.png'))
+    write_csvs(G, args.output_dir)
@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark: DictReader GTFS loading vs the columnar gtfs_loader.
+
+Each variant runs in its own process so peak memory is not shared. Memory
+is reported in two parts: the growth of the benchmark process's own peak
+resident set size (resource.getrusage) while the loader runs, which
+includes numpy / pandas buffers, and for the parallel variant the sum of
+the pool workers' peak RSS, each worker reporting its own ru_maxrss (an
+upper bound, as pages shared with the forked parent count in every
+worker). Where the resource module is missing (Windows) the tracemalloc
+peak of the benchmark process is printed instead, which covers the Python
+heap only, and worker memory is not measured:
+
+    python bench_gtfs_loader.py path/to/gtfs/feed [processes]
+
+With ``processes`` the parallel stop_times parser is timed as well.
+
+@author: aw03
+"""
+
+import multiprocessing as mp
+import os
+import sys
+import time
+import tracemalloc
+from csv import DictReader
+from itertools import groupby
+
+import numpy as np
+
+import gtfs_loader
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+INCLUDE_AGENCIES = ['MTA NYCT']
+IGNORE_ROUTE = ['SI']
+
+
+def dictreader_load(feed_dir):
+    """The per-row dict loading the graph script used before gtfs_loader."""
+    routes = {}
+    for route in DictReader(open(os.path.join(feed_dir, 'routes.txt'), 'r')):
+        if route['agency_id'] in INCLUDE_AGENCIES and route['route_id'] not in IGNORE_ROUTE:
+            routes[route['route_id']] = route
+    trips = {}
+    for trip in DictReader(open(os.path.join(feed_dir, 'trips.txt'), 'r')):
+        if trip['route_id'] in routes:
+            trip['color'] = routes[trip['route_id']]['route_color']
+            trip['route_short_name'] = routes[trip['route_id']]['route_short_name']
+            trips[trip['trip_id']] = trip
+    stops = {}
+    for stop in DictReader(open(os.path.join(feed_dir, 'stops.txt'), 'r')):
+        stops[stop['stop_id']] = stop
+    edges = []
+    stop_times_csv = DictReader(open(os.path.join(feed_dir, 'stop_times.txt'), 'r'))
+    for trip_id, stop_time_iter in groupby(stop_times_csv, lambda st: st['trip_id']):
+        if trip_id in trips:
+            stop_times = list(stop_time_iter)
+            for prev, cur in zip(stop_times, stop_times[1:]):
+                edges.append((prev['stop_id'], cur['stop_id'],
+                              trips[trip_id]['route_short_name']))
+    return len(edges)
+
+
+def _peak_rss():
+    """Peak RSS of this process in bytes (None without the resource module)."""
+    if resource is None:
+        return None
+    scale = 1 if sys.platform == 'darwin' else 1024   # ru_maxrss is KiB on Linux
+    return scale * resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _parse_range(task):
+    """gtfs_loader's worker task plus (worker pid, worker peak RSS)."""
+    return gtfs_loader._load_stop_times_range(task), os.getpid(), _peak_rss()
+
+
+def _parallel_stop_times(filename, stops, trips, processes, chunks_per_process=4):
+    """
+    load_stop_times_parallel, with the summed peak RSS of the pool workers
+    (None if not measured).
+    """
+    header, ranges = gtfs_loader.trip_aligned_ranges(filename, processes * chunks_per_process)
+    tasks = [(filename, header, start, end) for start, end in ranges]
+    with mp.Pool(processes, initializer=gtfs_loader._init_worker,
+                 initargs=(stops, trips)) as pool:
+        results = pool.map(_parse_range, tasks)
+
+    parts = [part for part, _, _ in results]
+    worker_peak = {pid: peak for _, pid, peak in results}
+    stop_times = {column: np.concatenate([part[column] for part in parts])
+                  for column in parts[0]}
+    if None in worker_peak.values():
+        return stop_times, None
+    return stop_times, sum(worker_peak.values())
+
+
+def columnar_load(feed_dir, processes=1):
+    """Segment count and the workers' summed peak RSS (0 for the serial loader)."""
+    routes = gtfs_loader.load_routes(os.path.join(feed_dir, 'routes.txt'),
+                                     INCLUDE_AGENCIES, IGNORE_ROUTE)
+    trips = gtfs_loader.load_trips(os.path.join(feed_dir, 'trips.txt'), routes)
+    stops = gtfs_loader.load_stops(os.path.join(feed_dir, 'stops.txt'))
+    stop_times_file = os.path.join(feed_dir, 'stop_times.txt')
+    workers = 0
+    if processes > 1:
+        stop_times, workers = _parallel_stop_times(stop_times_file, stops, trips, processes)
+    else:
+        stop_times = gtfs_loader.load_stop_times(stop_times_file, stops=stops, trips=trips)
+    from_codes, _, _ = gtfs_loader.trip_segments(stop_times)
+    return len(from_codes), workers
+
+
+def _measure(func, args, queue):
+    sys.stdout = open(os.devnull, 'w')
+    if resource is None:
+        tracemalloc.start()
+    else:
+        baseline = _peak_rss()
+    start = time.perf_counter()
+    result = func(*args)
+    elapsed = time.perf_counter() - start
+    n_segments, workers = result if isinstance(result, tuple) else (result, 0)
+    if resource is None:
+        _, own = tracemalloc.get_traced_memory()
+    else:
+        own = _peak_rss() - baseline
+    queue.put((n_segments, elapsed, own, workers))
+
+
+def run(func, *args):
+    queue = mp.Queue()
+    proc = mp.Process(target=_measure, args=(func, args, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+if __name__ == '__main__':
+    feed_dir = sys.argv[1] if len(sys.argv) > 1 else 'datasets'
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+
+    variants = [('dictreader', dictreader_load, ()), ('columnar', columnar_load, ())]
+    if processes > 1:
+        variants.append((f'parallel/{processes}', columnar_load, (processes,)))
+
+    memory = 'peak RSS' if resource is not None else 'Python heap'
+    results = {}
+    for name, func, extra in variants:
+        results[name] = run(func, feed_dir, *extra)
+        n_segments, elapsed, own, workers = results[name]
+        line = f'{name:>10}: {elapsed:8.2f} s  {memory} {own / 2**20:9.1f} MiB'
+        if workers is None:
+            line += ' + workers n/a'
+        elif workers:
+            line += f' + workers {workers / 2**20:.1f} MiB'
+        print(f'{line}  segments {n_segments}')
+
+    old, new = results['dictreader'], results['columnar']
+    assert old[0] == new[0], 'segment counts differ'
+    print(f'speedup {old[1] / new[1]:.1f}x, {memory} dictreader / columnar '
+          f'{old[2] / max(new[2], 1):.2f}x')
+    if processes > 1:
+        par = results[f'parallel/{processes}']
+        assert par[0] == new[0], 'parallel segment count differs'
+        print(f'parallel speedup over columnar {new[1] / par[1]:.1f}x')
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+Compact array-backed subway graph in CSR layout.
+
+Every undirected (from, to, route) edge is stored once per direction, so
+the entries of node ``i`` are the slice ``offsets[i]:offsets[i + 1]`` of
+flat arrays:
+
+  * ``indices``    int32 node index at the other end
+  * ``route_idx``  int32 route per entry
+  * ``edge_idx``   int32 row of the undirected edge in ``edges``
+  * ``count``      int32 trips over the edge (both directions together)
+  * ``time``       float32 median run time in this direction (NaN if unknown)
+
+That is 20 bytes per directed entry instead of the nested dicts of an
+nx.MultiGraph. The object converts to / from networkx on demand and is
+saved as a single ``.npz``:
+
+    csr = CSRGraph.from_tables(graph['nodes'], graph['edges'], graph['route_names'])
+    csr.save('generated_graphs/graph_csr.npz')
+    for j, r in zip(csr.neighbors(i), csr.routes(i)): ...
+
+@author: aw03
+"""
+
+import numpy as np
+
+
+class CSRGraph:
+    """Undirected route-keyed multigraph over node indices 0..n_nodes-1."""
+
+    ARRAYS = ['stop_ids', 'stop_names', 'route_names', 'offsets', 'indices',
+              'route_idx', 'edge_idx', 'count', 'time']
+
+    def __init__(self, stop_ids, stop_names, route_names, offsets, indices,
+                 route_idx, edge_idx, count, time):
+        self.stop_ids = stop_ids
+        self.stop_names = stop_names
+        self.route_names = route_names
+        self.offsets = offsets
+        self.indices = indices
+        self.route_idx = route_idx
+        self.edge_idx = edge_idx
+        self.count = count
+        self.time = time
+
+    @classmethod
+    def from_tables(cls, nodes, edges, route_names):
+        """Build from the ``nodes`` / ``edges`` tables of build_graph."""
+        n_nodes = len(nodes['stop_id'])
+        u = edges['from_idx']
+        v = edges['to_idx']
+        n_edges = len(u)
+        forward_time = edges.get('time_median', np.full(n_edges, np.nan))
+        reverse_time = edges.get('rev_time_median', np.full(n_edges, np.nan))
+
+        # self-loops only get one entry
+        back = u != v
+        src = np.concatenate((u, v[back]))
+        dst = np.concatenate((v, u[back]))
+        edge_idx = np.concatenate((np.arange(n_edges), np.flatnonzero(back)))
+        time = np.concatenate((forward_time, reverse_time[back]))
+
+        order = np.lexsort((edge_idx, dst, src))
+        offsets = np.zeros(n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n_nodes), out=offsets[1:])
+        edge_idx = edge_idx[order]
+        return cls(
+            stop_ids=np.asarray(nodes['stop_id']).astype(str),
+            stop_names=np.asarray(nodes['stop_name']).astype(str),
+            route_names=np.asarray(route_names).astype(str),
+            offsets=offsets,
+            indices=dst[order].astype(np.int32),
+            route_idx=edges['route_idx'][edge_idx].astype(np.int32),
+            edge_idx=edge_idx.astype(np.int32),
+            count=edges['count'][edge_idx].astype(np.int32),
+            time=time[order].astype(np.float32),
+        )
+
+    @classmethod
+    def from_networkx(cls, G):
+        """
+        Build from an nx.MultiGraph as made by build_multigraph.
+
+        Edge keys are route names; ``count`` and ``time_median`` edge
+        attributes are used when present.
+        """
+        stop_ids = np.array(list(G.nodes()), dtype=str)
+        node_index = {stop_id: i for i, stop_id in enumerate(stop_ids)}
+        edges = list(G.edges(keys=True, data=True))
+        u = np.array([node_index[e[0]] for e in edges], dtype=np.int64)
+        v = np.array([node_index[e[1]] for e in edges], dtype=np.int64)
+        r = np.array([e[2] for e in edges], dtype=str)
+        count = np.array([e[3].get('count', 1) for e in edges], dtype=np.int64)
+        time = np.array([e[3].get('time_median', np.nan) for e in edges], dtype=np.float64)
+        route_names, route_idx = np.unique(r, return_inverse=True)
+        flip = u > v
+        nodes = {
+            'stop_id': stop_ids,
+            'stop_name': np.array([G.nodes[s].get('stop_name', '') for s in stop_ids], dtype=str),
+        }
+        edges = {
+            'from_idx': np.where(flip, v, u),
+            'to_idx': np.where(flip, u, v),
+            'route_idx': route_idx,
+            'count': count,
+            'time_median': np.where(flip, np.nan, time),
+            'rev_time_median': np.where(flip, time, np.nan),
+        }
+        return cls.from_tables(nodes, edges, route_names)
+
+    @property
+    def n_nodes(self):
+        return len(self.offsets) - 1
+
+    @property
+    def n_edges(self):
+        """Number of undirected (from, to, route) edges."""
+        return int(self.edge_idx.max()) + 1 if len(self.edge_idx) else 0
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in
+                   ['offsets', 'indices', 'route_idx', 'edge_idx', 'count', 'time'])
+
+    def degree(self):
+        return np.diff(self.offsets)
+
+    def span(self, i):
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def neighbors(self, i):
+        return self.indices[self.span(i)]
+
+    def routes(self, i):
+        return self.route_idx[self.span(i)]
+
+    def routes_at(self, i):
+        """Sorted unique route_idx of the edges at node ``i``."""
+        return np.unique(self.routes(i))
+
+    def node_routes(self):
+        """(node, route_idx) pairs for every route touching a node, sorted."""
+        node = np.repeat(np.arange(self.n_nodes, dtype=np.int64), self.degree())
+        n_routes = max(len(self.route_names), 1)
+        pairs = np.unique(node * n_routes + self.route_idx)
+        return (pairs // n_routes).astype(np.int32), (pairs % n_routes).astype(np.int32)
+
+    def to_networkx(self):
+        """nx.MultiGraph keyed by stop_id / route name with edge ``count``s."""
+        import networkx as nx
+
+        G = nx.MultiGraph()
+        G.add_nodes_from((stop_id, {'stop_name': name})
+                         for stop_id, name in zip(self.stop_ids, self.stop_names))
+        node = np.repeat(np.arange(self.n_nodes), self.degree())
+        once = node <= self.indices
+        G.add_edges_from(
+            (u, v, r, {'count': int(c)})
+            for u, v, r, c in zip(
+                self.stop_ids[node[once]],
+                self.stop_ids[self.indices[once]],
+                self.route_names[self.route_idx[once]],
+                self.count[once],
+            )
+        )
+        return G
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            np.savez(f, **{name: getattr(self, name) for name in self.ARRAYS})
+
+    @classmethod
+    def load(cls, filename):
+        with np.load(filename, allow_pickle=False) as arrays:
+            return cls(*(arrays[name] for name in cls.ARRAYS))
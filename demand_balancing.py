@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+Balanced integer node supplies for many demand scenarios at once.
+
+The same two steps create_nodes_with_ridership_info.py applies to the
+Oct 21 nodes, vectorized over a (scenarios x stations) matrix:
+
+  1. scale positive net ridership so it sums to the scenario's morning total
+     M, and negative net ridership so its magnitude sums to M as well;
+  2. integerize each side with the largest-remainder method, so positives sum
+     to exactly floor(M) and negatives to exactly -floor(M) in every row.
+
+Both are plain array ops (no per-scenario Python loop), so thousands of
+perturbed scenarios take about as long as a handful.
+
+    supplies = balanced_integer_demand(net, morning_totals)   # (S, N) int64
+
+@author: aw03
+"""
+
+import numpy as np
+
+
+def _as_matrix(net, total):
+    net = np.nan_to_num(np.atleast_2d(np.asarray(net, dtype=np.float64)))
+    total = np.broadcast_to(np.asarray(total, dtype=np.float64), net.shape[:1])
+    return net, total
+
+
+def balance_net(net, total):
+    """
+    Real-valued balanced demand: positive nets scaled to sum to ``total``,
+    negative nets to sum to ``-total``, per row. NaN counts as 0.
+    """
+    net, total = _as_matrix(net, total)
+    pos = np.clip(net, 0, None)
+    neg = np.clip(net, None, 0)
+    pos_sum = pos.sum(axis=1)
+    neg_sum = -neg.sum(axis=1)
+    alpha_pos = np.divide(total, pos_sum, out=np.zeros_like(total), where=pos_sum > 0)
+    alpha_neg = np.divide(total, neg_sum, out=np.zeros_like(total), where=neg_sum > 0)
+    return alpha_pos[:, None] * pos + alpha_neg[:, None] * neg
+
+
+def _largest_remainder(values, total):
+    """
+    Round non-negative ``values`` (rows) down, then hand the units still
+    missing to floor(total) to the largest fractional parts. Only entries
+    with ``values`` > 0 take part.
+    """
+    floor = np.floor(values)
+    frac = np.where(values > 0, values - floor, -1.0)
+    needed = np.maximum(np.floor(total) - floor.sum(axis=1), 0)
+
+    # rank of every entry by descending fractional part within its row; ties
+    # go to the later station, as pandas' sort_values(ascending=False) did
+    order = np.argsort(frac, axis=1, kind='stable')[:, ::-1]
+    rank = np.empty_like(order)
+    np.put_along_axis(rank, order, np.arange(values.shape[1])[None, :], axis=1)
+    return (floor + ((rank < needed[:, None]) & (values > 0))).astype(np.int64)
+
+
+def integerize_balanced(balanced, total):
+    """Integer supplies from balance_net output, each side summing to floor(total)."""
+    balanced, total = _as_matrix(balanced, total)
+    pos = _largest_remainder(np.clip(balanced, 0, None), total)
+    neg = _largest_remainder(np.clip(-balanced, 0, None), total)
+    return pos - neg
+
+
+def balanced_integer_demand(net, total):
+    """balance_net followed by integerize_balanced; returns (scenarios, stations) int64."""
+    return integerize_balanced(balance_net(net, total), total)
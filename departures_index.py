@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Departures index for trains-per-hour queries over any time window.
+
+Built once with the graph from the stop_time columns already in memory,
+for weekday service only:
+
+  * per directed (from node, to node, route) edge, the sorted departure
+    seconds of every trip over that edge;
+  * per (route, direction), the sorted first-departure and last-arrival
+    seconds of every trip, so "trips running at some point in [H1, H2)"
+    (what the notebook's ``calculate_actual_tph`` counts) is
+    #(start < H2) - #(end < H1).
+
+Groups are laid out CSR style and every group's times are also stored as
+``group * TIME_SPAN + seconds`` in one globally sorted int64 array, so a
+query for all groups (and many windows) at once is two ``np.searchsorted``
+calls.
+
+    python departures_index.py datasets 8 9
+
+@author: aw03
+"""
+
+import argparse
+
+import numpy as np
+
+from gtfs_loader import segment_rows, weekday_trips
+
+
+# Larger than any GTFS time of day (service days run past 24:00:00)
+TIME_SPAN = 1 << 20
+
+
+def _csr(group, times):
+    """Sort ``times`` within ``group``; return (groups, offsets, times, search keys)."""
+    order = np.lexsort((times, group))
+    group = group[order]
+    times = times[order].astype(np.int32)
+    groups, start = np.unique(group, return_index=True)
+    offsets = np.concatenate((start, [len(group)])).astype(np.int64)
+    search = np.repeat(np.arange(len(groups), dtype=np.int64), np.diff(offsets))
+    return groups, offsets, times, search * TIME_SPAN + times
+
+
+def build_departures_index(stop_times, trips, calendar, nodes, trip_route_idx):
+    """
+    Build the index for trips running on every weekday.
+
+    ``trip_route_idx`` gives the graph route_idx of each trips.txt row (-1 for
+    routes outside the graph). Without a calendar every trip is used.
+    """
+    trip_ok = trip_route_idx >= 0
+    if calendar is not None:
+        trip_ok &= weekday_trips(trips, calendar)
+
+    rows = segment_rows(stop_times)
+    trip = stop_times['trip'][rows]
+    depart = stop_times['departure'][rows]
+    rows = rows[trip_ok[trip] & (depart >= 0)]
+    trip = stop_times['trip'][rows]
+    depart = stop_times['departure'][rows].astype(np.int64)
+
+    # --- per directed edge ---
+    node_of_stop = nodes['node_of_stop']
+    n_nodes = len(nodes['stop_code'])
+    i = node_of_stop[stop_times['stop'][rows]].astype(np.int64)
+    j = node_of_stop[stop_times['stop'][rows + 1]].astype(np.int64)
+    route = trip_route_idx[trip].astype(np.int64)
+    edge_key, edge_offsets, edge_times, edge_search = _csr((route * n_nodes + i) * n_nodes + j,
+                                                           depart)
+
+    # --- per (route, direction): span of each trip ---
+    n_trips = len(trip_route_idx)
+    trip_start = np.full(n_trips, np.iinfo(np.int64).max)
+    trip_end = np.full(n_trips, -1, dtype=np.int64)
+    np.minimum.at(trip_start, trip, depart)
+    arrive = stop_times['arrival'][rows + 1].astype(np.int64)
+    np.maximum.at(trip_end, trip, np.where(arrive >= 0, arrive, depart))
+    ran = np.flatnonzero(trip_end >= 0)
+    direction = (trips.columns['direction_id'][ran] == '1').astype(np.int64)
+    group = trip_route_idx[ran].astype(np.int64) * 2 + direction
+    route_key, trip_offsets, start_times, start_search = _csr(group, trip_start[ran])
+    _, _, end_times, end_search = _csr(group, trip_end[ran])
+
+    index = {
+        'edge_route_idx': (edge_key // n_nodes // n_nodes).astype(np.int32),
+        'edge_from_idx': (edge_key // n_nodes % n_nodes).astype(np.int32),
+        'edge_to_idx': (edge_key % n_nodes).astype(np.int32),
+        'edge_offsets': edge_offsets,
+        'edge_times': edge_times,
+        'edge_search': edge_search,
+        'route_idx': (route_key // 2).astype(np.int32),
+        'direction_id': (route_key % 2).astype(np.int32),
+        'trip_offsets': trip_offsets,
+        'trip_start': start_times,
+        'trip_end': end_times,
+        'trip_start_search': start_search,
+        'trip_end_search': end_search,
+    }
+    print('departures index', len(edge_times), 'departures on',
+          len(edge_key), 'directed edges')
+    return index
+
+
+def _window_seconds(start_hour, end_hour):
+    start = np.atleast_1d(np.asarray(start_hour, dtype=np.float64)) * 3600
+    end = np.atleast_1d(np.asarray(end_hour, dtype=np.float64)) * 3600
+    return start.astype(np.int64)[:, None], end.astype(np.int64)[:, None], (end - start) / 3600
+
+
+def _count_between(search, n_groups, lo, hi):
+    """Entries of each group with lo <= t < hi; lo / hi are (windows, 1)."""
+    base = np.arange(n_groups, dtype=np.int64) * TIME_SPAN
+    return np.searchsorted(search, base + hi) - np.searchsorted(search, base + lo)
+
+
+def edge_trains_per_hour(index, start_hour, end_hour):
+    """
+    Departures per hour over every directed edge in [start_hour, end_hour).
+
+    Hours may be scalars or equal-length arrays of windows; the result has
+    shape (windows, directed edges), aligned with ``index['edge_*_idx']``.
+    """
+    lo, hi, hours = _window_seconds(start_hour, end_hour)
+    n_groups = len(index['edge_offsets']) - 1
+    return _count_between(index['edge_search'], n_groups, lo, hi) / hours[:, None]
+
+
+def route_trains_per_hour(index, start_hour, end_hour, n_routes):
+    """
+    Trains per hour per route_idx, busiest direction, for each window.
+
+    A trip counts for a window if it runs at some point inside it. Returns
+    shape (windows, n_routes); routes without weekday trips get 0.
+    """
+    lo, hi, hours = _window_seconds(start_hour, end_hour)
+    first = index['trip_offsets'][:-1]
+    base = np.arange(len(first), dtype=np.int64) * TIME_SPAN
+    started = np.searchsorted(index['trip_start_search'], base + hi) - first
+    ended = np.searchsorted(index['trip_end_search'], base + lo) - first
+    running = (started - ended) / hours[:, None]
+
+    # (route, direction) groups are sorted by route, so take the max per run
+    tph = np.zeros((len(hours), n_routes))
+    routes, route_first = np.unique(index['route_idx'], return_index=True)
+    if len(routes):
+        tph[:, routes] = np.maximum.reduceat(running, route_first, axis=1)
+    return tph
+
+
+if __name__ == '__main__':
+    from GTFS_MTA_with_routes import build_graph
+
+    parser = argparse.ArgumentParser(description='Weekday trains per hour per route.')
+    parser.add_argument('feed_dir')
+    parser.add_argument('start_hour', type=float)
+    parser.add_argument('end_hour', type=float)
+    args = parser.parse_args()
+
+    graph = build_graph(args.feed_dir, build_networkx=False)
+    tph = route_trains_per_hour(graph['departures'], args.start_hour, args.end_hour,
+                                len(graph['route_names']))[0]
+    print('route_name,actual_tph')
+    for name, value in zip(graph['route_names'], tph):
+        print(f'{name},{value:g}')
@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+"""
+Line frequency optimization model as a sparse LP, solved with HiGHS.
+
+Python port of ``build_subway_model`` from model.ipynb. Variables, in this
+column order:
+
+    x[k]         flow on directed track triplet k = (i, j, line)   (both directions)
+    y[e]         flow on transfer edge e = (i, j)
+    f[l]         trains per hour of line l                          (>= MIN_FREQUENCY)
+    overflow[k]  flow on triplet k above its line capacity
+
+and constraints
+
+    (1) flow conservation   out(i) - in(i) = s_i                    for every station
+    (2) capacity            x - overflow <= C_l * f_l * delta       for every triplet
+    (3) shared track        sum over lines of (2)                   for every directed segment
+    (4) fleet               sum tau_l * f_l <= T_max
+
+minimizing (1 - lam) * (t.x + t_tr.y + beta * sum overflow) + lam * gamma * energy.f.
+
+Each block is assembled from index arrays in one COO construction, so the
+build is linear in the number of edges, and the LP goes to HiGHS through
+scipy.optimize.linprog (no Gurobi license needed):
+
+    data = load_model_data()
+    model = build_frequency_model(data, lam=0.5)
+    solution = solve_frequency_model(model)
+    print(frequency_table(data, solution))
+
+@author: aw03
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.optimize import linprog
+
+
+GRAPH_DIR = 'generated_graphs'
+DATASETS_DIR = 'datasets'
+
+AVG_SPEED_MPM = 0.29        # miles per minute, for round-trip times
+DEFAULT_CAPACITY = 1000.0   # passengers per train when linecapacity.csv has no entry
+MIN_FREQUENCY = 2.0         # trains per hour on every line
+
+# Parameter values used in model.ipynb
+DEFAULTS = {
+    'delta': 1.0,       # horizon in hours
+    'T_max': 43500.0,   # train hours limit
+    'beta': 50000.0,    # overflow penalty
+    'gamma': 16.0,      # energy / operating cost weight
+    'lam': 0.5,         # 0 = passengers only, 1 = operating cost only
+}
+
+
+def _route_keys(route_short_name):
+    return route_short_name.astype(str).str.strip().to_numpy()
+
+
+def load_model_data(graph_dir=GRAPH_DIR, datasets_dir=DATASETS_DIR):
+    """
+    Sets and parameters of the model from the generated_graphs tables,
+    linecapacity.csv and linelength.csv, as arrays:
+
+    V, L          sorted station (node_idx) and line (route_idx) ids
+    route_names   route_short_name per line
+    s             balanced integer net supply per station
+    triplets      (T, 3) unique (i, j, route_idx), each edge in both directions
+    transfers     (E, 2) unique transfer edges (i, j)
+    capacity      C_train per line (passengers per train)
+    tau, energy   round-trip minutes and route length (miles) per line
+    """
+    nodes = pd.read_csv(os.path.join(graph_dir, 'nodes_with_balanced_integer_net_ridership.csv'))
+    routes = pd.read_csv(os.path.join(graph_dir, 'routes.csv'))
+    edges = pd.read_csv(os.path.join(graph_dir, 'edges_by_route.csv'),
+                        usecols=['from_idx', 'to_idx', 'route_idx'])
+    transfers = pd.read_csv(os.path.join(graph_dir, 'transfer_edges.csv'),
+                            usecols=['from_idx', 'to_idx'])
+    line_capacity = pd.read_csv(os.path.join(datasets_dir, 'linecapacity.csv'))
+    line_length = pd.read_csv(os.path.join(datasets_dir, 'linelength.csv'))
+
+    V = np.unique(nodes['node_idx'].to_numpy(dtype=np.int64))
+    L = np.unique(routes['route_idx'].to_numpy(dtype=np.int64))
+
+    s = np.zeros(len(V))
+    s[np.searchsorted(V, nodes['node_idx'].to_numpy(dtype=np.int64))] = \
+        nodes['balanced_net_ridership_int'].fillna(0).to_numpy(dtype=np.float64)
+
+    forward = edges[['from_idx', 'to_idx', 'route_idx']].to_numpy(dtype=np.int64)
+    triplets = np.unique(np.concatenate([forward, forward[:, [1, 0, 2]]]), axis=0)
+    transfer_pairs = np.unique(transfers[['from_idx', 'to_idx']].to_numpy(dtype=np.int64)
+                               .reshape(-1, 2), axis=0)
+
+    route_names = pd.Series(_route_keys(routes['route_short_name']),
+                            index=routes['route_idx'].to_numpy(dtype=np.int64))
+    route_names = route_names[~route_names.index.duplicated()].reindex(L).to_numpy()
+
+    capacity = np.full(len(L), np.nan)
+    line_of_name = dict(zip(route_names, range(len(L))))
+    for name, total in zip(_route_keys(line_capacity['route_short_name']),
+                           line_capacity['total_rush_hour_capacity'].to_numpy(dtype=np.float64)):
+        if name in line_of_name:
+            capacity[line_of_name[name]] = total
+        else:
+            print(f"Capacity data found for route '{name}' but it is not in the graph.")
+    for line in np.flatnonzero(np.isnan(capacity)):
+        print(f'No capacity defined for route index {L[line]}. '
+              f'Defaulting to {DEFAULT_CAPACITY:g}.')
+    capacity[np.isnan(capacity)] = DEFAULT_CAPACITY
+
+    # Round-trip time: (length / speed) both ways plus a 10% layover buffer;
+    # energy proxy: route length. Lines missing from linelength.csv get the mean.
+    length_idx = line_length['route_idx'].to_numpy(dtype=np.int64)
+    miles = line_length['route_length(mi)'].to_numpy(dtype=np.float64)
+    known = np.isin(length_idx, L)
+    tau = np.full(len(L), np.nan)
+    energy = np.full(len(L), np.nan)
+    tau[np.searchsorted(L, length_idx[known])] = miles[known] / AVG_SPEED_MPM * 2.0 * 1.1
+    energy[np.searchsorted(L, length_idx[known])] = miles[known]
+    tau[np.isnan(tau)] = np.nanmean(tau) if known.any() else 60.0
+    energy[np.isnan(energy)] = np.nanmean(energy) if known.any() else 10.0
+
+    return {
+        'V': V,
+        'L': L,
+        'route_names': route_names,
+        's': s,
+        'triplets': triplets,
+        'transfers': transfer_pairs,
+        'capacity': capacity,
+        'tau': tau,
+        'energy': energy,
+    }
+
+
+def build_frequency_model(data, t=None, t_tr=None, delta=DEFAULTS['delta'],
+                          T_max=DEFAULTS['T_max'], beta=DEFAULTS['beta'],
+                          gamma=DEFAULTS['gamma'], lam=DEFAULTS['lam'],
+                          shared_track=True, min_frequency=MIN_FREQUENCY):
+    """
+    LP arrays for one parameter setting. ``t`` (per triplet) and ``t_tr``
+    (per transfer edge) default to the notebook's unit costs. Optional
+    per-triplet arrays in ``data``: 'base_load' (fixed flow counted against
+    capacity) and 'overflow_weight' (multiplies beta; default 1).
+
+    Returns a dict with c, A_ub, b_ub, A_eq, b_eq, lower, upper, the column
+    slices 'x', 'y', 'f', 'overflow', the A_ub row of the fleet limit
+    ('fleet_row') and the parameters used.
+    """
+    V, L = data['V'], data['L']
+    triplets, transfers = data['triplets'], data['transfers']
+    n_trip, n_transfer, n_lines = len(triplets), len(transfers), len(L)
+    t = np.ones(n_trip) if t is None else np.asarray(t, dtype=np.float64)
+    t_tr = np.ones(n_transfer) if t_tr is None else np.asarray(t_tr, dtype=np.float64)
+
+    x = slice(0, n_trip)
+    y = slice(x.stop, x.stop + n_transfer)
+    f = slice(y.stop, y.stop + n_lines)
+    overflow = slice(f.stop, f.stop + n_trip)
+    n_cols = overflow.stop
+    trip_cols = np.arange(n_trip)
+    line = np.searchsorted(L, triplets[:, 2])
+
+    # (1) flow conservation: +1 where an edge leaves i, -1 where it enters
+    A_eq = sp.coo_matrix((
+        np.repeat([1.0, -1.0, 1.0, -1.0], [n_trip, n_trip, n_transfer, n_transfer]),
+        (np.concatenate([np.searchsorted(V, triplets[:, 0]), np.searchsorted(V, triplets[:, 1]),
+                         np.searchsorted(V, transfers[:, 0]), np.searchsorted(V, transfers[:, 1])]),
+         np.concatenate([x.start + trip_cols, x.start + trip_cols,
+                         y.start + np.arange(n_transfer), y.start + np.arange(n_transfer)]))),
+        shape=(len(V), n_cols)).tocsr()
+
+    # (2) capacity, one row per triplet, and (3) the same terms summed per
+    # directed segment
+    row_blocks = [trip_cols]
+    if shared_track:
+        _, segment = np.unique(triplets[:, :2], axis=0, return_inverse=True)
+        row_blocks.append(n_trip + segment.ravel())
+    n_segment_rows = int(row_blocks[-1].max()) + 1 - n_trip if shared_track and n_trip else 0
+    fleet_row = n_trip + n_segment_rows
+
+    rows, cols, vals = [], [], []
+    line_capacity = data['capacity'][line] * delta
+    for block in row_blocks:
+        rows += [block, block, block]
+        cols += [x.start + trip_cols, overflow.start + trip_cols, f.start + line]
+        vals += [np.ones(n_trip), -np.ones(n_trip), -line_capacity]
+    # (4) fleet limit
+    rows.append(np.full(n_lines, fleet_row))
+    cols.append(f.start + np.arange(n_lines))
+    vals.append(data['tau'])
+    A_ub = sp.coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                         shape=(fleet_row + 1, n_cols)).tocsr()
+    b_ub = np.zeros(fleet_row + 1)
+    b_ub[fleet_row] = T_max
+    if 'base_load' in data:
+        # flow carried on a triplet besides x (see chain_contraction.py)
+        b_ub[:n_trip] -= data['base_load']
+        if shared_track:
+            b_ub[n_trip:fleet_row] -= np.bincount(segment.ravel(), weights=data['base_load'],
+                                                  minlength=n_segment_rows)
+
+    lower = np.zeros(n_cols)
+    lower[f] = min_frequency
+
+    model = {
+        'A_ub': A_ub,
+        'b_ub': b_ub,
+        'A_eq': A_eq,
+        'b_eq': data['s'].copy(),
+        'lower': lower,
+        'upper': np.full(n_cols, np.inf),
+        'x': x,
+        'y': y,
+        'f': f,
+        'overflow': overflow,
+        'fleet_row': fleet_row,
+        't': t,
+        'overflow_weight': data.get('overflow_weight', np.ones(n_trip)),
+        't_tr': t_tr,
+        'params': {'delta': delta, 'T_max': T_max, 'beta': beta, 'gamma': gamma, 'lam': lam},
+        'data': data,
+    }
+    model['c'] = objective_coefficients(model, beta, gamma, lam)
+    return model
+
+
+def objective_coefficients(model, beta, gamma, lam):
+    """Cost vector of ``model``'s columns for the given weights."""
+    c = np.empty(model['A_ub'].shape[1])
+    c[model['x']] = (1 - lam) * model['t']
+    c[model['y']] = (1 - lam) * model['t_tr']
+    c[model['f']] = lam * gamma * model['data']['energy']
+    c[model['overflow']] = (1 - lam) * beta * model['overflow_weight']
+    return c
+
+
+def split_solution(model, values):
+    """Variable blocks and objective components for a full column vector."""
+    data, params = model['data'], model['params']
+    x, y = values[model['x']], values[model['y']]
+    f, overflow = values[model['f']], values[model['overflow']]
+    return {
+        'x': x,
+        'y': y,
+        'f': f,
+        'overflow': overflow,
+        'passenger_time': float(model['t'] @ x + model['t_tr'] @ y),
+        'overflow_penalty': float(params['beta'] * model['overflow_weight'] @ overflow),
+        'energy_cost': float(params['gamma'] * data['energy'] @ f),
+        'fleet_used': float(data['tau'] @ f),
+    }
+
+
+def solve_frequency_model(model, **options):
+    """
+    Solve with HiGHS (scipy.optimize.linprog); ``options`` go to linprog's
+    ``options``. Returns split_solution's dict plus status, message and
+    objective (None values when no optimum was found).
+    """
+    result = linprog(model['c'], A_ub=model['A_ub'], b_ub=model['b_ub'],
+                     A_eq=model['A_eq'], b_eq=model['b_eq'],
+                     bounds=np.column_stack([model['lower'], model['upper']]),
+                     method='highs', options=options or None)
+    if result.x is None:
+        return {'status': result.status, 'message': result.message, 'objective': None}
+    solution = split_solution(model, result.x)
+    solution.update(status=result.status, message=result.message, objective=float(result.fun))
+    return solution
+
+
+def frequency_table(data, solution):
+    """Trains per hour and headway per line, sorted by route name."""
+    f = solution['f']
+    with np.errstate(divide='ignore'):
+        headway = np.where(f > 1e-6, 60.0 / f, np.inf)
+    table = pd.DataFrame({
+        'route_idx': data['L'],
+        'route_name': data['route_names'],
+        'trains_per_hour': np.round(f, 2),
+        'headway_mins': np.round(headway, 1),
+    })
+    return table.sort_values('route_name', kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Solve the line frequency LP with HiGHS.')
+    parser.add_argument('--graph-dir', default=GRAPH_DIR)
+    parser.add_argument('--datasets-dir', default=DATASETS_DIR)
+    parser.add_argument('--lambda', dest='lam', type=float, default=DEFAULTS['lam'])
+    parser.add_argument('--beta', type=float, default=DEFAULTS['beta'])
+    parser.add_argument('--gamma', type=float, default=DEFAULTS['gamma'])
+    parser.add_argument('--t-max', dest='T_max', type=float, default=DEFAULTS['T_max'])
+    parser.add_argument('--delta', type=float, default=DEFAULTS['delta'])
+    parser.add_argument('--no-shared-track', action='store_true',
+                        help='leave out the shared-track constraints')
+    parser.add_argument('--output', help='write the frequency table to this CSV')
+    args = parser.parse_args()
+
+    data = load_model_data(args.graph_dir, args.datasets_dir)
+    start = time.perf_counter()
+    model = build_frequency_model(data, delta=args.delta, T_max=args.T_max, beta=args.beta,
+                                  gamma=args.gamma, lam=args.lam,
+                                  shared_track=not args.no_shared_track)
+    built = time.perf_counter()
+    print(f'Built LP: {model["A_ub"].shape[1]} variables, '
+          f'{model["A_eq"].shape[0] + model["A_ub"].shape[0]} constraints '
+          f'in {built - start:.3f} s')
+    solution = solve_frequency_model(model)
+    print(f'Solved in {time.perf_counter() - built:.3f} s: {solution["message"]}')
+    if solution['objective'] is None:
+        raise SystemExit(1)
+
+    table = frequency_table(data, solution)
+    print(table.to_string(index=False))
+    print(f'Objective value: {solution["objective"]:.2f}')
+    print(f'Fleet used: {solution["fleet_used"]:.1f} / {args.T_max:g} '
+          f'({100 * solution["fleet_used"] / args.T_max:.1f}%)')
+    if args.output:
+        table.to_csv(args.output, index=False)
+        print(f'Saved: {args.output}')
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Parameter sweeps of the line frequency LP (frequency_model.py).
+
+The constraint matrix does not depend on lam, beta or gamma (objective only)
+or on T_max (right-hand side of the fleet row), so a FrequencySweep builds
+the LP once, hands it to one HiGHS instance, and per point only changes the
+affected costs / the fleet bound before re-solving. HiGHS keeps the optimal
+basis of the previous point, so each solve is a warm start that usually
+needs a handful of simplex iterations.
+
+    frontier = sweep(load_model_data(), grid(lam=np.linspace(0, 1, 101)))
+
+returns one row per point with the Pareto metrics of model.ipynb:
+service_cost (passenger time + overflow penalty) and operating_cost
+(gamma * energy . f). With ``processes`` the points are split into
+contiguous chunks, one warm-started HiGHS instance per worker.
+
+    python frequency_sweep.py --lambda 0:1:0.01 --t-max 30000 43500 --output frontier.csv
+
+Requires highspy (pip install highspy), the HiGHS Python bindings; the
+single-solve scripts only need SciPy.
+
+@author: aw03
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from frequency_model import (DATASETS_DIR, DEFAULTS, GRAPH_DIR, build_frequency_model,
+                             load_model_data, objective_coefficients, split_solution)
+
+
+SWEEP_PARAMS = ('lam', 'beta', 'gamma', 'T_max')
+
+
+def _highs():
+    """(module, Highs class) of highspy."""
+    try:
+        import highspy
+    except ImportError:
+        raise ImportError('frequency_sweep needs the HiGHS Python bindings: pip install highspy') \
+            from None
+    return highspy, highspy.Highs
+
+
+class FrequencySweep:
+    """One built frequency LP, re-solved for changing lam / beta / gamma / T_max."""
+
+    def __init__(self, data, t=None, t_tr=None, delta=DEFAULTS['delta'], shared_track=True,
+                 warm_start=True, **build_options):
+        self.model = build_frequency_model(data, t, t_tr, delta=delta,
+                                           shared_track=shared_track, **build_options)
+        self.params = {name: self.model['params'][name] for name in SWEEP_PARAMS}
+        self.warm_start = warm_start
+        self.cost = self.model['c'].copy()
+
+        model = self.model
+        self.n_eq = model['A_eq'].shape[0]
+        A = sp.vstack([model['A_eq'], model['A_ub']]).tocsc()
+        self.highspy, Highs = _highs()
+        lp = self.highspy.HighsLp()
+        lp.num_col_, lp.num_row_ = A.shape[1], A.shape[0]
+        lp.col_cost_ = self.cost
+        lp.col_lower_ = model['lower']
+        lp.col_upper_ = model['upper']
+        lp.row_lower_ = np.concatenate([model['b_eq'], np.full(len(model['b_ub']), -np.inf)])
+        lp.row_upper_ = np.concatenate([model['b_eq'], model['b_ub']])
+        lp.a_matrix_.format_ = self.highspy.MatrixFormat.kColwise
+        lp.a_matrix_.num_col_, lp.a_matrix_.num_row_ = A.shape[1], A.shape[0]
+        lp.a_matrix_.start_ = A.indptr
+        lp.a_matrix_.index_ = A.indices
+        lp.a_matrix_.value_ = A.data
+
+        self.highs = Highs()
+        self.highs.setOptionValue('output_flag', False)
+        self.highs.passModel(lp)
+
+    def solve(self, **params):
+        """
+        Solve at ``params`` (any of lam, beta, gamma, T_max; the rest keep
+        their last values). Returns a flat dict of parameters and metrics,
+        plus the split_solution arrays under 'solution'.
+        """
+        unknown = set(params) - set(SWEEP_PARAMS)
+        if unknown:
+            raise ValueError(f'cannot sweep {sorted(unknown)}; rebuild the model instead')
+        self.params.update(params)
+        lam, beta, gamma, T_max = (self.params[name] for name in SWEEP_PARAMS)
+
+        cost = objective_coefficients(self.model, beta, gamma, lam)
+        changed = np.flatnonzero(cost != self.cost)
+        if len(changed):
+            self.highs.changeColsCost(len(changed), changed.astype(np.int32), cost[changed])
+            self.cost = cost
+        self.highs.changeRowBounds(self.n_eq + self.model['fleet_row'], -np.inf, T_max)
+        if not self.warm_start:
+            self.highs.clearSolver()
+
+        start = time.perf_counter()
+        self.highs.run()
+        seconds = time.perf_counter() - start
+        status = self.highs.getModelStatus()
+        row = dict(self.params, status=self.highs.modelStatusToString(status),
+                   iterations=self.highs.getInfo().simplex_iteration_count, seconds=seconds)
+        if status != self.highspy.HighsModelStatus.kOptimal:
+            return row
+
+        values = np.asarray(self.highs.getSolution().col_value)
+        solution = split_solution(dict(self.model, params=dict(self.params)), values)
+        row.update(objective=float(cost @ values),
+                   service_cost=solution['passenger_time'] + solution['overflow_penalty'],
+                   operating_cost=solution['energy_cost'],
+                   passenger_time=solution['passenger_time'],
+                   overflow_penalty=solution['overflow_penalty'],
+                   fleet_used=solution['fleet_used'],
+                   solution=solution)
+        return row
+
+
+def _snake(lengths):
+    """Index tuples of a grid in boustrophedon order (see grid)."""
+    if not lengths:
+        return [()]
+    inner = _snake(lengths[1:])
+    return [(k,) + rest for k in range(lengths[0])
+            for rest in (inner if k % 2 == 0 else inner[::-1])]
+
+
+def grid(**axes):
+    """
+    Cartesian product of parameter values in boustrophedon (snake) order:
+    the last axis varies fastest and reverses direction whenever an earlier
+    axis steps, so consecutive points differ in exactly one parameter by
+    one grid step and every warm start begins from a neighbouring basis.
+    """
+    names = list(axes)
+    values = [np.atleast_1d(axes[name]).tolist() for name in names]
+    return [{name: values[axis][k] for axis, (name, k) in enumerate(zip(names, index))}
+            for index in _snake([len(v) for v in values])]
+
+
+def _frontier_rows(rows, route_names, with_frequencies):
+    for row in rows:
+        solution = row.pop('solution', None)
+        if with_frequencies:
+            f = solution['f'] if solution is not None else np.full(len(route_names), np.nan)
+            row.update(zip((f'tph_{name}' for name in route_names), f))
+    return rows
+
+
+def _sweep_chunk(args):
+    data, points, with_frequencies, options = args
+    solver = FrequencySweep(data, **options)
+    return _frontier_rows([solver.solve(**point) for point in points],
+                          data['route_names'], with_frequencies)
+
+
+def sweep(data, points, processes=None, with_frequencies=False, **options):
+    """
+    Solve every point (dicts of SWEEP_PARAMS; unset values come from
+    DEFAULTS) and return the frontier table, one row per point in input
+    order. ``options`` go to FrequencySweep (t, t_tr, delta, shared_track,
+    warm_start, ...); ``with_frequencies`` adds a trains-per-hour column
+    per line.
+    """
+    points = [dict({name: DEFAULTS[name] for name in SWEEP_PARAMS}, **point) for point in points]
+    processes = max(1, min(processes or 1, len(points)))
+    # contiguous chunks keep neighbouring (similar) points on the same warm solver
+    chunks = [(data, [points[i] for i in chunk], with_frequencies, options)
+              for chunk in np.array_split(np.arange(len(points)), processes)]
+    if processes > 1:
+        with mp.Pool(processes) as pool:
+            parts = pool.map(_sweep_chunk, chunks)
+    else:
+        parts = [_sweep_chunk(chunk) for chunk in chunks]
+    return pd.DataFrame([row for part in parts for row in part])
+
+
+def _values(specs):
+    """Parameter values from 'start:stop:step' ranges (stop included) or numbers."""
+    values = []
+    for spec in specs:
+        if ':' in spec:
+            start, stop, step = (float(part) for part in spec.split(':'))
+            values.extend(np.round(np.arange(start, stop + step / 2, step), 12).tolist())
+        else:
+            values.append(float(spec))
+    return values
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweep the frequency LP over parameter grids.')
+    parser.add_argument('--graph-dir', default=GRAPH_DIR)
+    parser.add_argument('--datasets-dir', default=DATASETS_DIR)
+    parser.add_argument('--lambda', dest='lam', nargs='+', default=['0:1:0.1'],
+                        help="values or start:stop:step ranges (default 0:1:0.1)")
+    parser.add_argument('--beta', nargs='+', default=[str(DEFAULTS['beta'])])
+    parser.add_argument('--gamma', nargs='+', default=[str(DEFAULTS['gamma'])])
+    parser.add_argument('--t-max', dest='T_max', nargs='+', default=[str(DEFAULTS['T_max'])])
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--frequencies', action='store_true',
+                        help='add trains per hour of every line to the table')
+    parser.add_argument('--output', help='write the frontier table to this CSV')
+    args = parser.parse_args()
+
+    data = load_model_data(args.graph_dir, args.datasets_dir)
+    points = grid(**{name: _values(getattr(args, name)) for name in SWEEP_PARAMS})
+    start = time.perf_counter()
+    frontier = sweep(data, points, args.processes or os.cpu_count(), args.frequencies)
+    print(f'{len(points)} points in {time.perf_counter() - start:.2f} s '
+          f'({frontier["iterations"].sum()} simplex iterations)')
+    if args.output:
+        frontier.to_csv(args.output, index=False)
+        print(f'Saved: {args.output}')
+    else:
+        print(frontier.to_string(index=False))
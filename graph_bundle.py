@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned single-file binary bundle of the generated graph tables.
+
+Instead of re-parsing nodes.csv / routes.csv / edges_by_route.csv /
+transfer_edges.csv / nodes_with_balanced_integer_net_ridership.csv on every
+load, the same tables go into one file:
+
+    MAGIC (8 bytes) | header length (uint64 LE) | JSON schema header | columns
+
+The header lists every table with its row count and, per column, the NumPy
+dtype string, shape and byte offset. Columns are raw little-endian arrays
+aligned to 64 bytes (strings as fixed-width unicode), so a reader maps the
+file and pulls out only the columns it needs without copying or parsing:
+
+    tables = read_bundle('generated_graphs/graph.bundle',
+                         tables=['edges_by_route'], columns=['from_idx', 'to_idx'])
+
+    python graph_bundle.py generated_graphs/graph.bundle   # print the schema
+
+@author: aw03
+"""
+
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+
+MAGIC = b'NYCGRAPH'
+BUNDLE_VERSION = 1
+ALIGN = 64
+
+BUNDLE_FILE = 'graph.bundle'
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def _column_array(values):
+    """Plain fixed-dtype array; object / string columns become unicode."""
+    values = np.asarray(values)
+    if values.dtype == object:
+        values = np.array(['' if v is None or v != v else str(v) for v in values], dtype=str)
+    if values.dtype.byteorder == '>':
+        values = values.astype(values.dtype.newbyteorder('<'))
+    return np.ascontiguousarray(values)
+
+
+def _table_columns(table):
+    """Column dict from a dict of arrays or a pandas DataFrame."""
+    if hasattr(table, 'columns') and hasattr(table, 'to_numpy'):
+        return {str(name): table[name].to_numpy() for name in table.columns}
+    return table
+
+
+def write_bundle(filename, tables):
+    """
+    Write ``{table name: {column: array} or DataFrame}`` as one bundle.
+
+    The file is written next to ``filename`` and moved into place, so
+    readers never see a partial bundle.
+    """
+    arrays = {name: {column: _column_array(values)
+                     for column, values in _table_columns(table).items()}
+              for name, table in tables.items()}
+
+    # offsets are relative to the start of the data section
+    schema = {'version': BUNDLE_VERSION, 'tables': {}}
+    offset = 0
+    for name, columns in arrays.items():
+        n_rows = len(next(iter(columns.values()))) if columns else 0
+        entries = []
+        for column, values in columns.items():
+            entries.append({'name': column, 'dtype': values.dtype.str,
+                            'shape': list(values.shape), 'offset': offset})
+            offset = _aligned(offset + values.nbytes)
+        schema['tables'][name] = {'n_rows': n_rows, 'columns': entries}
+
+    header = json.dumps(schema).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 8 + len(header))
+    tmp_path = f'{filename}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name, columns in arrays.items():
+            for entry, values in zip(schema['tables'][name]['columns'], columns.values()):
+                f.seek(data_start + entry['offset'])
+                f.write(values.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, filename)
+
+
+def read_schema(filename):
+    """(schema dict, byte offset of the data section)."""
+    with open(filename, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{filename} is not a graph bundle')
+        (header_len,) = struct.unpack('<Q', f.read(8))
+        schema = json.loads(f.read(header_len).decode('utf-8'))
+    if schema['version'] != BUNDLE_VERSION:
+        raise ValueError(f'{filename}: bundle version {schema["version"]}, '
+                         f'expected {BUNDLE_VERSION}')
+    return schema, _aligned(len(MAGIC) + 8 + header_len)
+
+
+def read_bundle(filename, tables=None, columns=None, mmap=True):
+    """
+    ``{table: {column: array}}`` for the requested tables / columns.
+
+    Arrays are read-only memory maps into the file (copies with ``mmap``
+    False); ``columns`` applies to every requested table and missing
+    columns are skipped.
+    """
+    schema, data_start = read_schema(filename)
+    wanted = schema['tables'] if tables is None else tables
+    result = {}
+    for name in wanted:
+        if name not in schema['tables']:
+            raise KeyError(f'{filename} has no table {name!r}')
+        result[name] = {}
+        for entry in schema['tables'][name]['columns']:
+            if columns is not None and entry['name'] not in columns:
+                continue
+            dtype = np.dtype(entry['dtype'])
+            shape = tuple(entry['shape'])
+            offset = data_start + entry['offset']
+            if not mmap or 0 in shape:
+                with open(filename, 'rb') as f:
+                    f.seek(offset)
+                    values = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+            else:
+                values = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape)
+            result[name][entry['name']] = values
+    return result
+
+
+def read_table(filename, name, columns=None):
+    """One table as a pandas DataFrame (columns copied out of the map)."""
+    import pandas as pd
+
+    return pd.DataFrame({column: np.asarray(values) for column, values in
+                         read_bundle(filename, [name], columns)[name].items()})
+
+
+def update_bundle(filename, tables):
+    """Add or replace ``tables`` in an existing bundle (creates it if missing)."""
+    merged = {}
+    if os.path.exists(filename):
+        merged = {name: {column: np.array(values) for column, values in columns.items()}
+                  for name, columns in read_bundle(filename).items()}
+    merged.update(tables)
+    write_bundle(filename, merged)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print the schema of a graph bundle.')
+    parser.add_argument('bundle')
+    args = parser.parse_args()
+
+    schema, _ = read_schema(args.bundle)
+    print('bundle version', schema['version'])
+    for name, table in schema['tables'].items():
+        print(f"{name}: {table['n_rows']} rows")
+        for entry in table['columns']:
+            print(f"  {entry['name']:<28} {entry['dtype']}")
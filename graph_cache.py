@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed cache of built graph tables.
+
+Entries are keyed on a hash of the GTFS input files plus the build options
+(INCLUDE_AGENCIES, IGNORE_ROUTE, ...) and hold the node / route / edge /
+transfer tables as one uncompressed ``.npz``, so a rerun on an unchanged
+feed is a single file read. The per-file SHA-256 digests are kept in
+DIGEST_FILE in the cache directory under (path, size, mtime_ns), so only
+files whose size or modification time changed are read again and a lookup
+on an unchanged feed is a few stat calls. The cache is size bounded (least
+recently used entries are evicted first) and can be invalidated explicitly:
+
+    python graph_cache.py list
+    python graph_cache.py invalidate datasets
+    python graph_cache.py clear
+
+@author: aw03
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+CACHE_DIR = '.graph_cache'
+MAX_CACHE_BYTES = 1 << 30   # 1 GiB
+DIGEST_FILE = 'file_digests.json'
+
+# Bump when the layout of the cached tables changes
+CACHE_VERSION = 4
+
+FEED_FILES = ['routes.txt', 'trips.txt', 'stops.txt', 'transfers.txt', 'calendar.txt',
+              'stop_times.txt']
+
+# graph dict entries that are (dicts of) arrays and get cached
+CACHED_TABLES = ['patterns', 'nodes', 'edges', 'route_names', 'transfer_edges',
+                 'departures']
+
+
+def _hash_file(h, path, chunk_size):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+
+
+def _load_digests(cache_dir):
+    path = os.path.join(cache_dir, DIGEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except ValueError:
+        return {}
+
+
+def _save_digests(cache_dir, digests):
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, DIGEST_FILE)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(digests, f, indent=1)
+    os.replace(tmp_path, path)
+
+
+def file_digest(path, digests, chunk_size=1 << 20):
+    """
+    SHA-256 of one file, reused from ``digests`` (absolute path -> [size,
+    mtime_ns, digest]) while the file's size and mtime are unchanged.
+    Returns (digest, True if it was recomputed).
+    """
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    known = digests.get(key)
+    if known is not None and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+        return known[2], False
+    h = hashlib.sha256()
+    _hash_file(h, path, chunk_size)
+    digests[key] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+    return digests[key][2], True
+
+
+def feed_hash(feed_dir, chunk_size=1 << 20, cache_dir=CACHE_DIR):
+    """
+    SHA-256 over the digests of the feed files the graph build reads.
+
+    A zipped feed (or any single file) is hashed as the file itself. File
+    digests are remembered in ``cache_dir`` (see DIGEST_FILE); with
+    ``cache_dir`` None every file is read.
+    """
+    digests = _load_digests(cache_dir) if cache_dir is not None else {}
+    if not os.path.isdir(feed_dir):
+        paths = [(None, feed_dir)]
+    else:
+        paths = [(name, os.path.join(feed_dir, name)) for name in FEED_FILES]
+    h = hashlib.sha256()
+    changed = False
+    for name, path in paths:
+        if not os.path.exists(path):
+            continue
+        digest, rehashed = file_digest(path, digests, chunk_size)
+        changed |= rehashed
+        if name is not None:
+            h.update(name.encode())
+        h.update(digest.encode())
+    if changed and cache_dir is not None:
+        _save_digests(cache_dir, digests)
+    return h.hexdigest()
+
+
+def options_hash(**options):
+    payload = json.dumps({'version': CACHE_VERSION, **options}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def cache_key(feed_dir, cache_dir=CACHE_DIR, **options):
+    """``<feed hash>-<options hash>``; all entries of one feed share the prefix."""
+    return f'{feed_hash(feed_dir, cache_dir=cache_dir)[:32]}-{options_hash(**options)[:16]}'
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, f'{key}.npz')
+
+
+def _flatten(graph):
+    arrays = {}
+    for name in CACHED_TABLES:
+        table = graph[name]
+        if isinstance(table, dict):
+            for column, values in table.items():
+                arrays[f'{name}/{column}'] = values
+        else:
+            arrays[name] = table
+    # .npz must load without pickle, so string columns become fixed-width str
+    return {k: (v.astype(str) if v.dtype == object else v) for k, v in arrays.items()}
+
+
+def _unflatten(arrays):
+    graph = {}
+    for key in arrays.files:
+        name, _, column = key.partition('/')
+        if column:
+            graph.setdefault(name, {})[column] = arrays[key]
+        else:
+            graph[name] = arrays[key]
+    return graph
+
+
+def load(cache_dir, key):
+    """Cached graph tables for ``key``, or None on a miss."""
+    path = _entry_path(cache_dir, key)
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as arrays:
+        graph = _unflatten(arrays)
+    os.utime(path)   # mark as recently used for eviction
+    return graph
+
+
+def store(cache_dir, key, graph, max_bytes=MAX_CACHE_BYTES):
+    """Write the graph tables under ``key`` and evict down to ``max_bytes``."""
+    os.makedirs(cache_dir, exist_ok=True)
+    path = _entry_path(cache_dir, key)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **_flatten(graph))
+    os.replace(tmp_path, path)
+    evict(cache_dir, max_bytes, keep=path)
+
+
+def entries(cache_dir):
+    """(path, size, mtime) of every cache entry, least recently used first."""
+    if not os.path.isdir(cache_dir):
+        return []
+    found = []
+    for name in os.listdir(cache_dir):
+        if name.endswith('.npz'):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            found.append((path, stat.st_size, stat.st_mtime))
+    return sorted(found, key=lambda e: e[2])
+
+
+def evict(cache_dir, max_bytes=MAX_CACHE_BYTES, keep=None):
+    """Delete least recently used entries until the cache fits in ``max_bytes``."""
+    cached = entries(cache_dir)
+    total = sum(size for _, size, _ in cached)
+    for path, size, _ in cached:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
+        print('evicted', os.path.basename(path))
+
+
+def invalidate(cache_dir, feed_dir=None):
+    """Drop every entry built from ``feed_dir`` (all entries if None)."""
+    prefix = feed_hash(feed_dir, cache_dir=cache_dir)[:32] if feed_dir is not None else ''
+    removed = 0
+    for path, _, _ in entries(cache_dir):
+        if os.path.basename(path).startswith(prefix):
+            os.remove(path)
+            removed += 1
+    print('removed', removed, 'cache entries')
+    return removed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the graph build cache.')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list', help='show cache entries, least recently used first')
+    invalidate_cmd = commands.add_parser('invalidate', help='drop entries for one feed')
+    invalidate_cmd.add_argument('feed_dir')
+    commands.add_parser('clear', help='drop every entry')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        for path, size, _ in entries(args.cache_dir):
+            print(f'{os.path.basename(path)}  {size / 2**20:8.2f} MiB')
+    elif args.command == 'invalidate':
+        invalidate(args.cache_dir, args.feed_dir)
+    else:
+        invalidate(args.cache_dir)
@@ -0,0 +1,419 @@
+# -*- coding: utf-8 -*-
+"""
+Vectorized subway graph construction on top of gtfs_loader codes.
+
+Trip segments are collapsed to parent stations and aggregated into
+(from_idx, to_idx, route_idx, count) rows with one group-by on integer keys,
+so the work scales with the number of unique edges rather than with the
+number of stop_time rows. The nx.MultiGraph is optional and is created with
+a single bulk ``add_edges_from``.
+
+@author: aw03
+"""
+
+import csv
+
+import numpy as np
+import pandas as pd
+
+from gtfs_loader import segment_rows
+from walking_transfers import node_walk_seconds
+
+
+# Run-time statistics attached to every edge, in seconds
+TIME_QUANTILES = {'time_p10': 0.1, 'time_median': 0.5, 'time_p90': 0.9}
+TIME_COLUMNS = ['time_median', 'time_p10', 'time_p90', 'time_samples']
+
+
+def route_name_codes(routes):
+    """
+    Encode each route by its route_short_name.
+
+    Several route_ids can share a short name (the three 'S' shuttles), and the
+    graph keys edges by short name, so codes index the sorted unique names.
+    Returns (route_names, name_code) with one name code per routes.txt row.
+    """
+    route_names, name_code = np.unique(routes.columns['route_short_name'],
+                                       return_inverse=True)
+    return route_names, name_code.astype(np.int32)
+
+
+def graph_nodes(stops, from_codes, to_codes):
+    """
+    Node table for every parent station touched by a trip segment.
+
+    Nodes keep the order in which their first used stop appears in stops.txt
+    (the order the old per-stop ``add_stop_to_graph`` loop produced).
+    ``node_of_stop`` maps any stop code to its node index, -1 if unused.
+    Station name and coordinates are copied in so the table stands alone.
+    """
+    parent_code = stops.columns['parent_code']
+    used = np.union1d(from_codes, to_codes)
+    parents = parent_code[used]
+    _, first = np.unique(parents, return_index=True)
+    node_stop = parents[np.sort(first)]
+
+    node_of_parent = np.full(len(stops), -1, dtype=np.int32)
+    node_of_parent[node_stop] = np.arange(len(node_stop), dtype=np.int32)
+    return {
+        'stop_code': node_stop,
+        'stop_id': stops.keys_array[node_stop],
+        'stop_name': stops.columns['stop_name'][node_stop],
+        'stop_lon': stops.columns['stop_lon'][node_stop],
+        'stop_lat': stops.columns['stop_lat'][node_stop],
+        'node_of_stop': node_of_parent[parent_code],
+    }
+
+
+def aggregate_edges(nodes, from_codes, to_codes, route_codes, weights=None):
+    """
+    Count trips per undirected (node, node, route) edge in one pass.
+
+    Matches the MultiGraph semantics of the old ``add_edge_to_graph`` loop:
+    (u, v, r) and (v, u, r) are the same edge and the lower node index is
+    reported as ``from_idx``. Rows come back sorted by (from, to, route).
+    ``weights`` is the number of trips behind each segment (the pattern
+    multiplicity when segments come from gtfs_patterns); defaults to 1.
+    """
+    node_of_stop = nodes['node_of_stop']
+    i = node_of_stop[from_codes].astype(np.int64)
+    j = node_of_stop[to_codes].astype(np.int64)
+    u = np.minimum(i, j)
+    v = np.maximum(i, j)
+
+    n_nodes = len(nodes['stop_code'])
+    n_routes = int(route_codes.max()) + 1 if len(route_codes) else 1
+    key = (u * n_nodes + v) * n_routes + route_codes
+    if weights is None:
+        key, count = np.unique(key, return_counts=True)
+    else:
+        key, inverse = np.unique(key, return_inverse=True)
+        count = np.bincount(inverse, weights=weights, minlength=len(key))
+
+    return {
+        'from_idx': (key // n_routes // n_nodes).astype(np.int32),
+        'to_idx': (key // n_routes % n_nodes).astype(np.int32),
+        'route_code': (key % n_routes).astype(np.int32),
+        'count': count.astype(np.int64),
+    }
+
+
+def index_routes(edges, route_names):
+    """
+    Re-number route codes to the dense route_idx of routes actually in the graph.
+
+    Adds ``route_idx`` to ``edges`` and returns the route_short_name per
+    route_idx (sorted, as routes.csv always was).
+    """
+    used, route_idx = np.unique(edges['route_code'], return_inverse=True)
+    edges['route_idx'] = route_idx.astype(np.int32)
+    return route_names[used]
+
+
+def _group_quantiles(keys, values, quantiles):
+    """
+    Per-key quantiles (linear interpolation, as np.percentile) of ``values``.
+
+    One lexsort puts every group's samples in order, so each quantile is a
+    gather at ``start + q * (count - 1)``. Returns (unique_keys, count, {name: q}).
+    """
+    order = np.lexsort((values, keys))
+    keys = keys[order]
+    values = values[order].astype(np.float64)
+    unique, start, count = np.unique(keys, return_index=True, return_counts=True)
+
+    stats = {}
+    for name, q in quantiles.items():
+        pos = q * (count - 1)
+        lo = np.floor(pos).astype(np.int64)
+        hi = np.minimum(lo + 1, count - 1)
+        frac = pos - lo
+        stats[name] = values[start + lo] * (1 - frac) + values[start + hi] * frac
+    return unique, count, stats
+
+
+def add_edge_times(edges, nodes, stop_times, trip_route_code):
+    """
+    Attach scheduled run-time statistics (seconds) to the edge table.
+
+    Each trip segment runs from the departure at one stop to the arrival at
+    the next; samples are grouped per directed (from node, to node, route)
+    using the stop_time columns already in memory, so there is no second
+    scan of stop_times.txt. Edge rows are undirected, so the stats for
+    from_idx -> to_idx go in TIME_COLUMNS and those for to_idx -> from_idx
+    in the same columns prefixed ``rev_``. Directions without a timed trip
+    get NaN and 0 samples.
+    """
+    rows = segment_rows(stop_times)
+    depart = stop_times['departure'][rows]
+    arrive = stop_times['arrival'][rows + 1]
+    run_time = arrive - depart
+    timed = (depart >= 0) & (arrive >= 0) & (run_time >= 0)
+    rows = rows[timed]
+    run_time = run_time[timed]
+
+    node_of_stop = nodes['node_of_stop']
+    i = node_of_stop[stop_times['stop'][rows]].astype(np.int64)
+    j = node_of_stop[stop_times['stop'][rows + 1]].astype(np.int64)
+    r = trip_route_code[stop_times['trip'][rows]].astype(np.int64)
+
+    n_nodes = len(nodes['stop_code'])
+    n_routes = int(max(r.max(initial=0), edges['route_code'].max(initial=0))) + 1
+    keys, samples, stats = _group_quantiles((i * n_nodes + j) * n_routes + r,
+                                            run_time, TIME_QUANTILES)
+
+    u = edges['from_idx'].astype(np.int64)
+    v = edges['to_idx'].astype(np.int64)
+    route = edges['route_code'].astype(np.int64)
+    for prefix, a, b in [('', u, v), ('rev_', v, u)]:
+        wanted = (a * n_nodes + b) * n_routes + route
+        pos = np.minimum(np.searchsorted(keys, wanted), max(len(keys) - 1, 0))
+        found = keys[pos] == wanted if len(keys) else np.zeros(len(wanted), bool)
+        for name, values in stats.items():
+            edges[prefix + name] = np.where(found, values[pos], np.nan)
+        edges[prefix + 'time_samples'] = np.where(found, samples[pos], 0)
+
+
+def build_multigraph(nodes, edges, route_names):
+    """Create the nx.MultiGraph with bulk add_nodes_from / add_edges_from."""
+    import networkx as nx
+
+    stop_ids = nodes['stop_id']
+    G = nx.MultiGraph()
+    G.add_nodes_from(
+        (stop_id, {'stop_name': name, 'stop_lon': lon, 'stop_lat': lat})
+        for stop_id, name, lon, lat in zip(
+            stop_ids, nodes['stop_name'], nodes['stop_lon'], nodes['stop_lat'],
+        )
+    )
+    G.add_edges_from(
+        (u, v, r, {'count': int(c)})
+        for u, v, r, c in zip(
+            stop_ids[edges['from_idx']],
+            stop_ids[edges['to_idx']],
+            route_names[edges['route_idx']],
+            edges['count'],
+        )
+    )
+    return G
+
+
+def write_nodes_csv(filename, nodes):
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['node_idx', 'stop_id', 'stop_name', 'stop_lon', 'stop_lat'])
+        writer.writerows(zip(
+            range(len(nodes['stop_id'])),
+            nodes['stop_id'],
+            nodes['stop_name'],
+            nodes['stop_lon'],
+            nodes['stop_lat'],
+        ))
+
+
+def write_routes_csv(filename, route_names):
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['route_idx', 'route_short_name'])
+        writer.writerows(enumerate(route_names))
+
+
+def _csv_number(x):
+    """Blank for NaN, no trailing .0 on whole numbers."""
+    if np.isnan(x):
+        return ''
+    return int(x) if float(x).is_integer() else round(float(x), 1)
+
+
+def write_edges_by_route_csv(filename, nodes, edges, route_names):
+    """
+    Write the x_i_j_r edge table straight from the aggregated arrays.
+
+    Run-time columns (seconds, see add_edge_times) follow ``count`` when the
+    edge table has them.
+    """
+    stop_ids = nodes['stop_id']
+    time_columns = [prefix + name for prefix in ('', 'rev_') for name in TIME_COLUMNS]
+    time_columns = [c for c in time_columns if c in edges]
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            'edge_idx',
+            'from_idx', 'to_idx',
+            'route_idx',
+            'from_stop_id', 'to_stop_id',
+            'route_short_name',
+            'count'
+        ] + time_columns)
+        writer.writerows(zip(
+            range(len(edges['count'])),
+            edges['from_idx'], edges['to_idx'],
+            edges['route_idx'],
+            stop_ids[edges['from_idx']], stop_ids[edges['to_idx']],
+            route_names[edges['route_idx']],
+            edges['count'],
+            *([_csv_number(x) for x in edges[c]] for c in time_columns),
+        ))
+
+
+def build_transfer_edges(stops, transfers, nodes):
+    """
+    Map transfers.txt rows onto graph nodes.
+
+    Endpoints are collapsed to parent stations; self-transfers and transfers
+    touching a station outside the graph are dropped. ``cost`` is the
+    min_transfer_time in seconds, or the walking time between the two
+    stations where transfers.txt leaves it blank.
+    """
+    parent_code = stops.columns['parent_code']
+    node_of_stop = nodes['node_of_stop']
+    from_code = transfers['from_code']
+    to_code = transfers['to_code']
+    keep = (from_code >= 0) & (to_code >= 0)
+    keep[keep] = parent_code[from_code[keep]] != parent_code[to_code[keep]]
+    keep[keep] = ((node_of_stop[from_code[keep]] >= 0) &
+                  (node_of_stop[to_code[keep]] >= 0))
+
+    from_idx = node_of_stop[from_code[keep]]
+    to_idx = node_of_stop[to_code[keep]]
+    min_time = transfers['min_transfer_time'][keep]
+    cost = pd.to_numeric(min_time, errors='coerce').astype(np.float64)
+    missing = np.isnan(cost)
+    cost[missing] = np.round(node_walk_seconds(nodes, from_idx[missing], to_idx[missing]))
+
+    transfer_edges = {
+        'from_idx': from_idx,
+        'to_idx': to_idx,
+        'transfer_type': transfers['transfer_type'][keep],
+        'min_transfer_time': min_time,
+        'cost': cost,
+    }
+    print(f"Transfer edges (after mapping to graph nodes): {keep.sum()}")
+    return transfer_edges
+
+
+def write_transfer_edges_csv(filename, nodes, transfer_edges):
+    stop_ids = nodes['stop_id']
+    n_edges = len(transfer_edges['from_idx'])
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            'transfer_edge_id',
+            'from_stop_id', 'to_stop_id',
+            'from_idx', 'to_idx',
+            'transfer_type',
+            'min_transfer_time',
+            'cost'
+        ])
+        # cost: transfer time in seconds (min_transfer_time, else walking time)
+        writer.writerows(zip(
+            range(n_edges),
+            stop_ids[transfer_edges['from_idx']], stop_ids[transfer_edges['to_idx']],
+            transfer_edges['from_idx'], transfer_edges['to_idx'],
+            transfer_edges['transfer_type'],
+            transfer_edges['min_transfer_time'],
+            map(_csv_number, transfer_edges['cost']),
+        ))
+
+
+def export_tables(nodes, edges, route_names, transfer_edges):
+    """
+    The nodes / routes / edges_by_route / transfer_edges tables with the
+    same columns as the CSVs, but typed (coordinates and times as float64,
+    blank min_transfer_time as NaN) for the binary bundle.
+    """
+    stop_ids = nodes['stop_id']
+    time_columns = [prefix + name for prefix in ('', 'rev_') for name in TIME_COLUMNS]
+    edges_by_route = {
+        'edge_idx': np.arange(len(edges['count']), dtype=np.int32),
+        'from_idx': edges['from_idx'],
+        'to_idx': edges['to_idx'],
+        'route_idx': edges['route_idx'],
+        'from_stop_id': stop_ids[edges['from_idx']],
+        'to_stop_id': stop_ids[edges['to_idx']],
+        'route_short_name': route_names[edges['route_idx']],
+        'count': edges['count'],
+    }
+    edges_by_route.update({c: edges[c] for c in time_columns if c in edges})
+    return {
+        'nodes': {
+            'node_idx': np.arange(len(stop_ids), dtype=np.int32),
+            'stop_id': stop_ids,
+            'stop_name': nodes['stop_name'],
+            'stop_lon': nodes['stop_lon'].astype(np.float64),
+            'stop_lat': nodes['stop_lat'].astype(np.float64),
+        },
+        'routes': {
+            'route_idx': np.arange(len(route_names), dtype=np.int32),
+            'route_short_name': route_names,
+        },
+        'edges_by_route': edges_by_route,
+        'transfer_edges': {
+            'transfer_edge_id': np.arange(len(transfer_edges['from_idx']), dtype=np.int32),
+            'from_stop_id': stop_ids[transfer_edges['from_idx']],
+            'to_stop_id': stop_ids[transfer_edges['to_idx']],
+            'from_idx': transfer_edges['from_idx'],
+            'to_idx': transfer_edges['to_idx'],
+            'transfer_type': transfer_edges['transfer_type'],
+            'min_transfer_time': pd.to_numeric(transfer_edges['min_transfer_time'],
+                                               errors='coerce').astype(np.float64),
+            'cost': transfer_edges['cost'],
+        },
+    }
+
+
+def write_stop_routes_csv(filename, csr):
+    """For each stop: which routes stop there? (from the CSRGraph)"""
+    node, route_idx = csr.node_routes()
+    # route_idx follows the sorted route names, so each run is already ordered
+    starts = np.searchsorted(node, np.arange(csr.n_nodes + 1))
+    route_names = csr.route_names[route_idx]
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['stop_id', 'stop_name', 'routes_at_stop'])
+        writer.writerows(
+            (stop_id, stop_name, ','.join(route_names[lo:hi]))
+            for stop_id, stop_name, lo, hi in zip(
+                csr.stop_ids, csr.stop_names, starts[:-1], starts[1:])
+        )
+
+
+def plot_graph(G, filename, dpi=300):
+    """
+    Render the graph on a PlateCarree map.
+
+    cartopy and matplotlib are imported here, not at module level, so building
+    a graph never pays for them unless a map is actually requested.
+    """
+    import cartopy.crs as ccrs
+    import matplotlib
+    matplotlib.use("Agg")   # or "SVG", "PDF", etc.
+    import matplotlib.pyplot as plt
+    import networkx as nx
+
+    # Build pos dict with numeric lon/lat
+    pos = {}
+    for stop_id in G.nodes:
+        try:
+            lon = float(G.nodes[stop_id]['stop_lon'])
+            lat = float(G.nodes[stop_id]['stop_lat'])
+            pos[stop_id] = (lon, lat)
+        except (KeyError, TypeError, ValueError):
+            # Skip nodes without valid numeric coordinates
+            continue
+
+    # lon/lat data is in PlateCarree projection
+    fig = plt.figure(figsize=(20, 20))
+    ax = plt.axes(projection=ccrs.PlateCarree())
+
+    nx.draw_networkx(
+        G,
+        ax=ax,
+        # labels=labels,  # optional: labels clutter the map
+        pos=pos,
+        node_size=2,
+        # transform=data_crs,  # NetworkX doesn't take this; see earlier notes if needed
+    )
+
+    fig.savefig(filename, dpi=dpi)
+    plt.close(fig)
@@ -0,0 +1,356 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar GTFS loader.
+
+Reads only the columns the graph build needs into NumPy arrays and
+dictionary-encodes stop_id / trip_id / route_id to dense int32 codes once,
+instead of building one DictReader dict per CSV row. ROUTES / TRIPS / STOPS
+keep their old ``TABLE[key][column]`` lookups through ColumnTable.
+
+Tables can be read from a feed directory or streamed straight out of the
+zipped feed with open_feed_file.
+
+@author: aw03
+"""
+
+import csv
+import io
+import multiprocessing as mp
+import os
+import zipfile
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+
+ROUTES_COLUMNS = ['route_id', 'agency_id', 'route_short_name', 'route_color']
+TRIPS_COLUMNS = ['route_id', 'trip_id', 'service_id', 'direction_id']
+STOPS_COLUMNS = ['stop_id', 'stop_name', 'stop_lat', 'stop_lon', 'parent_station']
+TRANSFERS_COLUMNS = ['from_stop_id', 'to_stop_id', 'transfer_type', 'min_transfer_time']
+CALENDAR_COLUMNS = ['service_id', 'monday', 'tuesday', 'wednesday', 'thursday',
+                    'friday', 'saturday', 'sunday']
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday']
+STOP_TIMES_COLUMNS = ['trip_id', 'stop_id', 'arrival_time', 'departure_time']
+
+# Read buffer for members streamed out of a zipped feed
+ZIP_BUFFER_SIZE = 1 << 22
+
+
+class ColumnTable(Mapping):
+    """
+    Read-only ``{key: row}`` view over one NumPy array per column.
+
+    Rows are materialized as small dicts only when looked up, so
+    ``STOPS[stop_id]['parent_station']`` keeps working while the table
+    itself costs a handful of arrays. ``code(key)`` / ``codes(keys)`` give
+    the dense int32 row codes used everywhere else in the pipeline.
+    """
+
+    def __init__(self, key, columns):
+        self.key = key
+        self.columns = columns
+        self.index = pd.Index(columns[key])
+
+    def __getitem__(self, key):
+        i = self.index.get_loc(key)
+        return {name: col[i] for name, col in self.columns.items()}
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __iter__(self):
+        return iter(self.columns[self.key])
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def keys_array(self):
+        return self.columns[self.key]
+
+    def code(self, key):
+        return self.index.get_loc(key)
+
+    def codes(self, keys):
+        """Vectorized key -> row code lookup, -1 for unknown keys."""
+        return self.index.get_indexer(keys).astype(np.int32)
+
+
+def _zip_member(archive, name):
+    """Member called ``name``, at the archive root or inside one folder."""
+    for info in archive.infolist():
+        if info.filename == name or os.path.basename(info.filename) == name:
+            return info
+    raise FileNotFoundError(f'{name} not found in {archive.filename}')
+
+
+@contextmanager
+def open_feed_file(feed, name):
+    """
+    Open one GTFS table of ``feed`` in binary mode.
+
+    ``feed`` is either a directory of .txt files or the published .zip
+    archive. Zip members are decompressed on the fly through a large read
+    buffer; nothing is extracted to disk.
+    """
+    if os.path.isdir(feed):
+        with open(os.path.join(feed, name), 'rb') as f:
+            yield f
+        return
+
+    with zipfile.ZipFile(feed) as archive:
+        with archive.open(_zip_member(archive, name)) as member:
+            yield io.BufferedReader(member, buffer_size=ZIP_BUFFER_SIZE)
+
+
+def _read_columns(filename, wanted):
+    """Read the ``wanted`` columns of a small GTFS table as plain strings."""
+    df = pd.read_csv(filename, usecols=lambda c: c in wanted, dtype=str,
+                     keep_default_na=False)
+    for name in wanted:
+        if name not in df:
+            df[name] = ''
+    return {name: df[name].to_numpy(dtype=object) for name in wanted}
+
+
+def load_routes(filename, include_agencies, ignore_route):
+    """Include only routes from agencies we are interested in."""
+    columns = _read_columns(filename, ROUTES_COLUMNS)
+    keep = (np.isin(columns['agency_id'], include_agencies) &
+            ~np.isin(columns['route_id'], ignore_route))
+    routes = ColumnTable('route_id', {k: v[keep] for k, v in columns.items()})
+    print('routes', len(routes))
+    return routes
+
+
+def load_trips(filename, routes):
+    """
+    Load trips from file, only include trips on routes we are interested in.
+
+    ``route_short_name`` and ``color`` are attached as derived columns by
+    indexing the routes table with each trip's route code.
+    """
+    columns = _read_columns(filename, TRIPS_COLUMNS)
+    route_code = routes.codes(columns['route_id'])
+    keep = route_code >= 0
+    columns = {k: v[keep] for k, v in columns.items()}
+    route_code = route_code[keep]
+    columns['route_code'] = route_code
+    columns['route_short_name'] = routes.columns['route_short_name'][route_code]
+    columns['color'] = routes.columns['route_color'][route_code]
+    trips = ColumnTable('trip_id', columns)
+    print('trips', len(trips))
+    return trips
+
+
+def load_stops(filename):
+    """
+    Load stops from file.
+
+    ``parent_code`` holds the row code of each stop's parent station (or of
+    the stop itself when it has none), so collapsing platforms to stations
+    is a single ``take``.
+    """
+    columns = _read_columns(filename, STOPS_COLUMNS)
+    stops = ColumnTable('stop_id', columns)
+    parent_code = stops.codes(columns['parent_station'])
+    own_code = np.arange(len(stops), dtype=np.int32)
+    columns['parent_code'] = np.where(parent_code >= 0, parent_code, own_code)
+    print('stops', len(stops))
+    return stops
+
+
+def load_transfers(filename, stops):
+    """
+    Load transfers from transfers.txt as column arrays.
+
+    Expected columns (standard GTFS):
+      from_stop_id, to_stop_id, transfer_type, min_transfer_time (optional)
+
+    ``from_code`` / ``to_code`` are stop row codes (-1 if the stop is unknown).
+    """
+    transfers = _read_columns(filename, TRANSFERS_COLUMNS)
+    transfers['from_code'] = stops.codes(transfers['from_stop_id'])
+    transfers['to_code'] = stops.codes(transfers['to_stop_id'])
+    print('transfers', len(transfers['from_stop_id']))
+    return transfers
+
+
+def load_calendar(filename):
+    """Load calendar.txt; day columns stay '0' / '1' strings as in the file."""
+    calendar = ColumnTable('service_id', _read_columns(filename, CALENDAR_COLUMNS))
+    print('services', len(calendar))
+    return calendar
+
+
+def weekday_trips(trips, calendar, days=WEEKDAYS):
+    """Boolean mask over ``trips`` for services running on every one of ``days``."""
+    runs = np.ones(len(calendar), dtype=bool)
+    for day in days:
+        runs &= calendar.columns[day] == '1'
+    service = calendar.codes(trips.columns['service_id'])
+    return np.where(service >= 0, runs[service], False)
+
+
+def _encode(values, table):
+    """Map a categorical column onto ``table`` row codes (-1 if unknown)."""
+    values = values.astype('category')
+    lookup = table.codes(values.cat.categories)
+    codes = values.cat.codes.to_numpy()
+    return np.where(codes >= 0, lookup[codes], -1).astype(np.int32)
+
+
+def gtfs_seconds(values):
+    """
+    Seconds after midnight for GTFS 'H:MM:SS' strings, -1 where missing.
+
+    Hours can run past 24 for trips that continue after midnight of their
+    service day, so this is plain arithmetic rather than a time-of-day parse.
+    """
+    values = pd.Series(values, dtype=object).fillna('')
+    parts = values.str.strip().str.split(':', expand=True)
+    if parts.shape[1] != 3:
+        return np.full(len(values), -1, dtype=np.int32)
+    hms = parts.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=float)
+    seconds = hms[:, 0] * 3600 + hms[:, 1] * 60 + hms[:, 2]
+    return np.where(np.isnan(seconds), -1, seconds).astype(np.int32)
+
+
+def _encode_times(values):
+    """Parse a categorical time column once per distinct value."""
+    lookup = gtfs_seconds(values.cat.categories)
+    codes = values.cat.codes.to_numpy()
+    return np.where(codes >= 0, lookup[codes], -1).astype(np.int32)
+
+
+def _parse_stop_times(filename, stops, trips):
+    df = pd.read_csv(filename, usecols=lambda c: c in STOP_TIMES_COLUMNS,
+                     dtype={c: 'category' for c in STOP_TIMES_COLUMNS})
+    stop_times = {
+        'trip': _encode(df['trip_id'], trips),
+        'stop': _encode(df['stop_id'], stops),
+    }
+    for column, name in [('arrival_time', 'arrival'), ('departure_time', 'departure')]:
+        if column in df:
+            stop_times[name] = _encode_times(df[column])
+        else:
+            stop_times[name] = np.full(len(df), -1, dtype=np.int32)
+    return stop_times
+
+
+def load_stop_times(filename, stops, trips):
+    """
+    Load stop_times.txt as int32 columns in file order.
+
+    ``trip`` / ``stop`` are row codes into ``trips`` / ``stops`` (strings are
+    hashed once per unique value; trips outside ``trips`` get -1), and
+    ``arrival`` / ``departure`` are seconds after midnight (-1 if empty).
+    """
+    stop_times = _parse_stop_times(filename, stops, trips)
+    print('stop_times', len(stop_times['trip']))
+    return stop_times
+
+
+def _trip_of(line, trip_col):
+    return next(csv.reader([line.decode('utf-8')]))[trip_col]
+
+
+def trip_aligned_ranges(filename, n_chunks):
+    """
+    Split stop_times.txt into about ``n_chunks`` byte ranges.
+
+    Each cut is moved forward to the first line of the next trip_id, so no
+    trip is ever split between two ranges. Returns (header_bytes, ranges).
+    """
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        trip_col = next(csv.reader([header.decode('utf-8-sig')])).index('trip_id')
+        data_start = f.tell()
+        size = os.fstat(f.fileno()).st_size
+
+        bounds = [data_start]
+        for k in range(1, n_chunks):
+            pos = data_start + (size - data_start) * k // n_chunks
+            if pos <= bounds[-1]:
+                continue
+            f.seek(pos - 1)
+            f.readline()   # finish the line the cut landed in
+            line = f.readline()
+            if not line:
+                break
+            prev_trip = _trip_of(line, trip_col)
+            while True:
+                cut = f.tell()
+                line = f.readline()
+                if not line or _trip_of(line, trip_col) != prev_trip:
+                    break
+            if cut >= size:
+                break
+            bounds.append(cut)
+        bounds.append(size)
+
+    ranges = [(a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+    return header, ranges
+
+
+_WORKER_TABLES = {}
+
+
+def _init_worker(stops, trips):
+    _WORKER_TABLES['stops'] = stops
+    _WORKER_TABLES['trips'] = trips
+
+
+def _load_stop_times_range(args):
+    filename, header, start, end = args
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return _parse_stop_times(io.BytesIO(header + data),
+                             _WORKER_TABLES['stops'], _WORKER_TABLES['trips'])
+
+
+def load_stop_times_parallel(filename, stops, trips, processes=None, chunks_per_process=4):
+    """
+    load_stop_times with parsing spread over a process pool.
+
+    The file is cut into trip-aligned byte ranges, each worker parses and
+    encodes its ranges, and the code arrays are concatenated in file order,
+    so the result is identical to the serial loader. Needs an uncompressed
+    stop_times.txt (ranges are read with seek).
+    """
+    processes = processes or os.cpu_count()
+    header, ranges = trip_aligned_ranges(filename, processes * chunks_per_process)
+    tasks = [(filename, header, start, end) for start, end in ranges]
+    with mp.Pool(processes, initializer=_init_worker, initargs=(stops, trips)) as pool:
+        parts = pool.map(_load_stop_times_range, tasks)
+
+    stop_times = {
+        column: np.concatenate([part[column] for part in parts])
+        for column in parts[0]
+    }
+    print('stop_times', len(stop_times['trip']), 'in', len(ranges), 'chunks')
+    return stop_times
+
+
+def segment_rows(stop_times):
+    """
+    Row index of the first stop_time of every trip segment.
+
+    Mirrors ``groupby(stop_times_csv, trip_id)`` over the file: a segment
+    joins row r and row r + 1 when both belong to the same kept trip.
+    """
+    trip = stop_times['trip']
+    stop = stop_times['stop']
+    same = (trip[1:] == trip[:-1]) & (trip[1:] >= 0)
+    same &= (stop[:-1] >= 0) & (stop[1:] >= 0)
+    return np.flatnonzero(same)
+
+
+def trip_segments(stop_times):
+    """Consecutive (from_stop, to_stop, trip) code triples within each trip."""
+    rows = segment_rows(stop_times)
+    stop = stop_times['stop']
+    return stop[rows], stop[rows + 1], stop_times['trip'][rows]
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+"""
+Trip patterns: one canonical stop sequence per (route, sequence).
+
+Thousands of trips run exactly the same stops, so stop_times is reduced to a
+few hundred patterns with a trip multiplicity. Segments (and anything else
+that only depends on the stop sequence) are then derived once per pattern
+and weighted by ``trip_count``.
+
+Patterns are stored CSR style: the stops of pattern p are
+``stops[offsets[p]:offsets[p + 1]]``.
+
+@author: aw03
+"""
+
+import numpy as np
+
+
+# Odd 64-bit multiplier for the polynomial sequence hash
+_HASH_BASE = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _trip_runs(trip):
+    """Start row and length of each contiguous block of a kept trip."""
+    change = np.flatnonzero(trip[1:] != trip[:-1]) + 1
+    starts = np.concatenate(([0], change))
+    lengths = np.diff(np.concatenate((starts, [len(trip)])))
+    keep = trip[starts] >= 0
+    return starts[keep], lengths[keep]
+
+
+def _run_positions(starts, lengths):
+    """Row index and position-within-run for every row of every run."""
+    run_of_row = np.repeat(np.arange(len(starts)), lengths)
+    run_offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    pos = np.arange(lengths.sum()) - run_offsets[run_of_row]
+    return run_of_row, starts[run_of_row] + pos, pos
+
+
+def trip_patterns(stop_times, trips):
+    """
+    Deduplicate stop_times into trip patterns.
+
+    Every trip's stop sequence is hashed with a vectorized polynomial hash,
+    runs are grouped by (route, length, hash) and each group is checked
+    against its canonical sequence, so a hash collision can never merge two
+    different patterns silently.
+
+    Returns a dict of arrays:
+      offsets, stops   -- CSR stop sequences, one row per pattern
+      route_code       -- routes.txt row code of each pattern
+      trip_count       -- number of trips running the pattern
+      trip_pattern     -- pattern index per trips.txt row (-1 if no stop_times)
+    """
+    trip = stop_times['trip']
+    stop = stop_times['stop']
+    if len(trip) == 0:
+        return {
+            'offsets': np.zeros(1, dtype=np.int64),
+            'stops': np.zeros(0, dtype=np.int32),
+            'route_code': np.zeros(0, dtype=np.int32),
+            'trip_count': np.zeros(0, dtype=np.int64),
+            'trip_pattern': np.full(len(trips), -1, dtype=np.int32),
+        }
+
+    starts, lengths = _trip_runs(trip)
+    run_of_row, rows, pos = _run_positions(starts, lengths)
+
+    powers = np.cumprod(np.full(lengths.max(), _HASH_BASE, dtype=np.uint64))
+    with np.errstate(over='ignore'):
+        terms = (stop[rows].astype(np.uint64) + np.uint64(1)) * powers[pos]
+    run_starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    seq_hash = np.add.reduceat(terms, run_starts)
+
+    run_trip = trip[starts]
+    run_route = trips.columns['route_code'][run_trip]
+    key = np.column_stack((run_route.astype(np.uint64),
+                           lengths.astype(np.uint64), seq_hash))
+    _, canonical, run_pattern = np.unique(key, axis=0, return_index=True,
+                                          return_inverse=True)
+    run_pattern = run_pattern.ravel()
+
+    # Same key must mean same sequence: compare every run with its canonical run
+    canonical_rows = starts[canonical][run_pattern][run_of_row] + pos
+    if np.any(stop[rows] != stop[canonical_rows]):
+        raise ValueError('trip pattern hash collision; sequences differ')
+
+    pattern_lengths = lengths[canonical]
+    offsets = np.concatenate(([0], np.cumsum(pattern_lengths)))
+    _, pattern_rows, _ = _run_positions(starts[canonical], pattern_lengths)
+
+    trip_pattern = np.full(len(trips), -1, dtype=np.int32)
+    trip_pattern[run_trip] = run_pattern
+
+    patterns = {
+        'offsets': offsets,
+        'stops': stop[pattern_rows],
+        'route_code': run_route[canonical].astype(np.int32),
+        'trip_count': np.bincount(run_pattern, minlength=len(canonical)),
+        'trip_pattern': trip_pattern,
+    }
+    print('trip patterns', len(canonical), 'for', len(starts), 'trips')
+    return patterns
+
+
+def pattern_segments(patterns):
+    """
+    Consecutive (from_stop, to_stop, pattern) codes within each pattern.
+
+    Segments touching an unknown stop (code -1) are dropped, as in
+    gtfs_loader.trip_segments. Weight by ``trip_count[pattern]`` to get
+    per-trip counts.
+    """
+    stops = patterns['stops']
+    offsets = patterns['offsets']
+    pattern_of_row = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    same = pattern_of_row[1:] == pattern_of_row[:-1]
+    same &= (stops[:-1] >= 0) & (stops[1:] >= 0)
+    return stops[:-1][same], stops[1:][same], pattern_of_row[1:][same]
+
+
+def patterns_by_route(patterns):
+    """``{route_code: array of pattern indices}`` for every route with trips."""
+    route_code = patterns['route_code']
+    order = np.argsort(route_code, kind='stable')
+    routes, first = np.unique(route_code[order], return_index=True)
+    return dict(zip(routes.tolist(), np.split(order, first[1:])))
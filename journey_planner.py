@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+"""
+Timetable journey planner (RAPTOR) over the weekday GTFS schedule.
+
+build_timetable turns the trip patterns and stop_time columns of a
+build_graph result into flat arrays. Each trip pattern becomes a RAPTOR
+route: a node sequence and a (trips x stops) block of departure / arrival
+seconds with the trips sorted by departure. A pattern with trips that
+overtake each other is split until every route is FIFO. Every route stop
+is one "column"; all columns' departures also sit in one sorted int64 array
+(``column * TIME_SPAN + seconds``), so finding the earliest catchable trip
+at every column is a single np.searchsorted.
+
+A RAPTOR round then is array work over (queries x columns):
+
+  1. earliest catchable trip at each column from the current ready times;
+  2. a running minimum along each route: trips are FIFO, so the earliest
+     trip boarded anywhere upstream is the best one to stay on;
+  3. that trip's arrival times, reduced to the minimum per node;
+  4. footpaths from transfer_edges (cost in seconds).
+
+Round k allows k - 1 transfers. Changing trains within a station takes the
+station's self-transfer min_transfer_time from transfers.txt. Many queries
+(origins and / or departure times) run as rows of the same arrays:
+
+    graph = build_graph('datasets', build_networkx=False)
+    tt = build_timetable(graph)
+    arrival = earliest_arrival(tt, 'A27', '08:05:00')     # seconds, one per node
+    departures, arrivals, pareto = profile(tt, 'A27', '07:00:00', '09:00:00')
+
+    python journey_planner.py datasets A27 08:05 --to 101
+
+@author: aw03
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from departures_index import TIME_SPAN
+from gtfs_loader import gtfs_seconds, weekday_trips
+
+
+MAX_TRANSFERS = 4
+_NOT_REACHED = np.iinfo(np.int64).max // 4
+
+
+def _trip_starts(trip):
+    """First row and length of each contiguous trip block in stop_times."""
+    starts = np.concatenate(([0], np.flatnonzero(trip[1:] != trip[:-1]) + 1))
+    return starts, np.diff(np.concatenate((starts, [len(trip)])))
+
+
+def _fill_times(stop_times, starts, lengths):
+    """Departure / arrival seconds per row, gaps filled from the trip's previous stop."""
+    departure = stop_times['departure'].astype(np.int64)
+    arrival = stop_times['arrival'].astype(np.int64)
+    departure = np.where(departure >= 0, departure, arrival)
+    arrival = np.where(arrival >= 0, arrival, departure)
+    # running max within each trip carries the last known time forward
+    block = np.repeat(np.arange(len(starts), dtype=np.int64), lengths) * TIME_SPAN
+    departure = np.maximum.accumulate(block + departure) - block
+    arrival = np.maximum.accumulate(block + arrival) - block
+    return (np.where(departure >= 0, departure, _NOT_REACHED),
+            np.where(arrival >= 0, arrival, _NOT_REACHED))
+
+
+def _fifo_groups(dep, arr):
+    """Split trips (rows, sorted by first departure) into groups that never overtake."""
+    if np.all(np.diff(dep, axis=0) >= 0) and np.all(np.diff(arr, axis=0) >= 0):
+        return [np.arange(len(dep))]
+    groups = []
+    for trip in range(len(dep)):
+        for group in groups:
+            last = group[-1]
+            if np.all(dep[trip] >= dep[last]) and np.all(arr[trip] >= arr[last]):
+                group.append(trip)
+                break
+        else:
+            groups.append([trip])
+    return [np.array(group) for group in groups]
+
+
+def build_timetable(graph, weekday=True):
+    """
+    Flat RAPTOR arrays for the trips of ``graph`` (a build_graph result with
+    its ``feed``) running on every weekday (all trips with ``weekday`` False).
+    """
+    feed = graph['feed']
+    if feed is None:
+        raise ValueError('the timetable needs the parsed feed; build the graph without cache_dir')
+    stop_times, trips = feed['stop_times'], feed['trips']
+    nodes, patterns = graph['nodes'], graph['patterns']
+    node_of_stop = nodes['node_of_stop']
+    n_nodes = len(nodes['stop_id'])
+
+    trip_ok = patterns['trip_pattern'] >= 0
+    if weekday and feed['calendar'] is not None:
+        trip_ok &= weekday_trips(trips, feed['calendar'])
+    starts, lengths = _trip_starts(stop_times['trip'])
+    departure, arrival = _fill_times(stop_times, starts, lengths)
+
+    run_trip = stop_times['trip'][starts]
+    keep = run_trip >= 0
+    keep[keep] = trip_ok[run_trip[keep]]
+    starts, run_trip = starts[keep], run_trip[keep]
+    run_pattern = patterns['trip_pattern'][run_trip]
+    order = np.lexsort((departure[starts], run_pattern))
+    starts, run_pattern = starts[order], run_pattern[order]
+    pattern_ids, first = np.unique(run_pattern, return_index=True)
+
+    offsets = patterns['offsets']
+    route_nodes, route_dep, route_arr = [], [], []
+    for pattern, trip_starts in zip(pattern_ids, np.split(starts, first[1:])):
+        stops = patterns['stops'][offsets[pattern]:offsets[pattern + 1]]
+        rows = trip_starts[:, None] + np.arange(len(stops))
+        dep, arr = departure[rows], arrival[rows]
+        node = np.where(stops >= 0, node_of_stop[np.maximum(stops, 0)], -1)
+        for group in _fifo_groups(dep, arr):
+            route_nodes.append(np.where(node >= 0, node, n_nodes))
+            route_dep.append(dep[group])
+            route_arr.append(arr[group])
+
+    n_routes = len(route_nodes)
+    length = np.array([len(nodes_) for nodes_ in route_nodes], dtype=np.int64)
+    n_trips = np.array([len(dep) for dep in route_dep], dtype=np.int64)
+    column_route = np.repeat(np.arange(n_routes), length)
+    column_start = np.concatenate(([0], np.cumsum(length)))
+    column_pos = np.arange(column_start[-1]) - column_start[column_route]
+    block_start = np.concatenate(([0], np.cumsum(n_trips * length)))
+
+    # departures of every column, column-major, as one sorted search array
+    column_dep = np.concatenate([dep.T.ravel() for dep in route_dep]) if n_routes else \
+        np.zeros(0, dtype=np.int64)
+    column_trips = np.repeat(n_trips, length)
+    search_start = np.concatenate(([0], np.cumsum(column_trips)))
+    search = (np.repeat(np.arange(column_start[-1], dtype=np.int64), column_trips) * TIME_SPAN +
+              np.minimum(column_dep, TIME_SPAN - 1))
+
+    column_node = np.concatenate(route_nodes) if n_routes else np.zeros(0, dtype=np.int64)
+    by_node = np.argsort(column_node, kind='stable')
+    by_node = by_node[column_node[by_node] < n_nodes]
+    reduce_nodes, reduce_start = np.unique(column_node[by_node], return_index=True)
+
+    # footpaths between stations, grouped by target node for the reduction
+    transfer_edges = graph['transfer_edges']
+    walk_from = np.asarray(transfer_edges['from_idx'], dtype=np.int64)
+    walk_to = np.asarray(transfer_edges['to_idx'], dtype=np.int64)
+    walk_cost = np.nan_to_num(np.asarray(transfer_edges['cost'], dtype=np.float64)).astype(np.int64)
+    walk_order = np.argsort(walk_to, kind='stable')
+    walk_nodes, walk_start = np.unique(walk_to[walk_order], return_index=True)
+
+    # changing trains inside a station: self-transfers in transfers.txt
+    transfers = feed['transfers']
+    from_code, to_code = transfers['from_code'], transfers['to_code']
+    same = (from_code >= 0) & (to_code >= 0)
+    same[same] = node_of_stop[from_code[same]] == node_of_stop[to_code[same]]
+    same[same] = node_of_stop[from_code[same]] >= 0
+    seconds = pd.to_numeric(transfers['min_transfer_time'][same], errors='coerce')
+    seconds = np.nan_to_num(np.asarray(seconds, dtype=np.float64)).astype(np.int64)
+    change = np.full(n_nodes + 1, _NOT_REACHED)
+    np.minimum.at(change, node_of_stop[from_code[same]], seconds)
+    change[change == _NOT_REACHED] = 0
+
+    trips_per_route = n_trips.max() + 1 if n_routes else 1
+    stop_ids = np.asarray(nodes['stop_id']).astype(str)
+    timetable = {
+        'n_nodes': n_nodes,
+        'stop_ids': stop_ids,
+        'stop_order': np.argsort(stop_ids),
+        'column_node': column_node,
+        'column_key': np.arange(column_start[-1], dtype=np.int64) * TIME_SPAN,
+        'column_search_start': search_start[:-1],
+        'column_trips': column_trips,
+        'column_block': block_start[column_route] + column_pos,
+        'column_stride': length[column_route],
+        'column_segment': (n_routes - column_route) * trips_per_route,
+        'search': search,
+        'arrival': np.concatenate([arr.ravel() for arr in route_arr]) if n_routes else
+        np.zeros(0, dtype=np.int64),
+        'column_dep': column_dep,
+        'reduce_columns': by_node,
+        'reduce_nodes': reduce_nodes,
+        'reduce_start': reduce_start,
+        'walk_from': walk_from[walk_order],
+        'walk_cost': walk_cost[walk_order],
+        'walk_nodes': walk_nodes,
+        'walk_start': walk_start,
+        'change': change,
+    }
+    print(f'timetable: {n_routes} routes ({len(pattern_ids)} patterns), '
+          f'{len(search)} departures, {n_nodes} stations')
+    return timetable
+
+
+def _seconds(values):
+    """Seconds after midnight from numbers or 'H:MM[:SS]' strings."""
+    values = np.atleast_1d(values)
+    if values.dtype.kind not in 'iuf':
+        text = [value if value.count(':') == 2 else value + ':00' for value in values.astype(str)]
+        values = gtfs_seconds(text)
+        if np.any(values < 0):
+            raise ValueError(f'cannot read times {text}')
+    return values.astype(np.int64)
+
+
+def _clock(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+def node_index(timetable, stops):
+    """Node indices for station stop_ids (or node indices passed through)."""
+    stops = np.atleast_1d(stops)
+    if stops.dtype.kind in 'iu':
+        return stops.astype(np.int64)
+    stop_ids, order = timetable['stop_ids'], timetable['stop_order']
+    found = order[np.minimum(np.searchsorted(stop_ids, stops.astype(str), sorter=order),
+                             len(order) - 1)]
+    missing = stop_ids[found] != stops.astype(str)
+    if np.any(missing):
+        raise KeyError(f'unknown stations {stops[missing].tolist()}')
+    return found.astype(np.int64)
+
+
+def _trip_round(timetable, ready):
+    """Earliest arrival per reduce_nodes column riding one trip from ``ready``."""
+    threshold = ready[:, timetable['column_node']]
+    key = np.where(threshold < _NOT_REACHED,
+                   timetable['column_key'] + np.minimum(threshold, TIME_SPAN - 1),
+                   timetable['column_key'] + TIME_SPAN)
+    catchable = np.searchsorted(timetable['search'], key) - timetable['column_search_start']
+
+    # trips are FIFO, so the best trip at a stop is the earliest one caught
+    # anywhere upstream: a running minimum, offset per route so that it
+    # restarts at each route's first stop
+    segment = timetable['column_segment']
+    caught = np.minimum.accumulate(segment + catchable, axis=1)
+    boarded = np.empty_like(caught)
+    boarded[:, 0] = segment[0] + timetable['column_trips'][0]
+    boarded[:, 1:] = caught[:, :-1]
+    boarded -= segment
+    riding = boarded < timetable['column_trips']
+    cell = timetable['column_block'] + np.where(riding, boarded, 0) * timetable['column_stride']
+    arrival = np.where(riding, timetable['arrival'][cell], _NOT_REACHED)
+    return np.minimum.reduceat(arrival[:, timetable['reduce_columns']],
+                               timetable['reduce_start'], axis=1)
+
+
+def _walk(timetable, best, ready, arrived):
+    """Relax footpaths from the stations reached at ``arrived``."""
+    if len(timetable['walk_nodes']) == 0:
+        return
+    walked = np.minimum.reduceat(arrived[:, timetable['walk_from']] + timetable['walk_cost'],
+                                 timetable['walk_start'], axis=1)
+    nodes = timetable['walk_nodes']
+    best[:, nodes] = np.minimum(best[:, nodes], walked)
+    ready[:, nodes] = np.minimum(ready[:, nodes], walked)
+
+
+def _raptor(timetable, origins, departs, max_transfers):
+    n_nodes = timetable['n_nodes']
+    best = np.full((len(origins), n_nodes + 1), _NOT_REACHED, dtype=np.int64)
+    best[np.arange(len(origins)), origins] = departs
+    ready = best.copy()
+    _walk(timetable, best, ready, best.copy())
+    nodes = timetable['reduce_nodes']
+    if len(timetable['search']) == 0:
+        return best[:, :n_nodes]
+
+    for _ in range(max_transfers + 1):
+        arrival = _trip_round(timetable, ready)
+        improved = arrival < best[:, nodes]
+        if not improved.any():
+            break
+        best[:, nodes] = np.where(improved, arrival, best[:, nodes])
+        arrived = np.full_like(best, _NOT_REACHED)
+        arrived[:, nodes] = np.where(improved, arrival, _NOT_REACHED)
+        ready = np.minimum(ready, arrived + timetable['change'])
+        _walk(timetable, best, ready, arrived)
+    return best[:, :n_nodes]
+
+
+def earliest_arrivals(timetable, origins, departs, max_transfers=MAX_TRANSFERS, batch_size=256):
+    """
+    Earliest arrival (seconds after midnight, inf if unreachable) at every
+    node for each (origin, departure) query; ``origins`` are stop_ids or node
+    indices, ``departs`` seconds or 'H:MM[:SS]', broadcast against each other.
+    Queries run ``batch_size`` at a time as rows of the same RAPTOR arrays.
+    """
+    origins, departs = np.broadcast_arrays(node_index(timetable, origins), _seconds(departs))
+    best = np.concatenate([_raptor(timetable, origins[start:start + batch_size],
+                                   departs[start:start + batch_size], max_transfers)
+                           for start in range(0, len(origins), batch_size)])
+    return np.where(best < _NOT_REACHED, best, np.inf)
+
+
+def earliest_arrival(timetable, origin, depart, max_transfers=MAX_TRANSFERS):
+    """One-to-all earliest arrival seconds per node, leaving ``origin`` at ``depart``."""
+    return earliest_arrivals(timetable, [origin], [depart], max_transfers)[0]
+
+
+def profile(timetable, origin, start, end, max_transfers=MAX_TRANSFERS):
+    """
+    Profile query: for every train departure from ``origin`` in [start, end]
+    the earliest arrival at every node. Returns (departures, arrivals,
+    pareto) where arrivals is departures x nodes and ``pareto`` marks the
+    entries no later departure arrives at as early.
+    """
+    origin = node_index(timetable, origin)[0]
+    start, end = _seconds([start, end])
+    columns = timetable['column_search_start'][timetable['column_node'] == origin]
+    counts = timetable['column_trips'][timetable['column_node'] == origin]
+    times = timetable['column_dep'][np.repeat(columns, counts) +
+                                    np.arange(counts.sum()) -
+                                    np.repeat(np.cumsum(counts) - counts, counts)]
+    departures = np.unique(times[(times >= start) & (times <= end)])
+    arrivals = earliest_arrivals(timetable, origin, departures, max_transfers)
+    later = np.full_like(arrivals, np.inf)
+    if len(arrivals) > 1:
+        later[:-1] = np.minimum.accumulate(arrivals[::-1], axis=0)[::-1][1:]
+    return departures, arrivals, np.isfinite(arrivals) & (arrivals < later)
+
+
+if __name__ == '__main__':
+    from GTFS_MTA_with_routes import build_graph
+
+    parser = argparse.ArgumentParser(description='Earliest-arrival queries on the GTFS timetable.')
+    parser.add_argument('feed_dir')
+    parser.add_argument('origin', help='origin station stop_id, e.g. A27')
+    parser.add_argument('depart', help='departure time H:MM[:SS]')
+    parser.add_argument('--to', dest='destination', help='destination station stop_id')
+    parser.add_argument('--until', help='profile query: every departure up to this time')
+    parser.add_argument('--max-transfers', type=int, default=MAX_TRANSFERS)
+    args = parser.parse_args()
+
+    graph = build_graph(args.feed_dir, build_networkx=False)
+    start = time.perf_counter()
+    timetable = build_timetable(graph)
+    print(f'timetable built in {time.perf_counter() - start:.2f} s')
+
+    start = time.perf_counter()
+    arrival = earliest_arrival(timetable, args.origin, args.depart, args.max_transfers)
+    print(f'one-to-all query: {1000 * (time.perf_counter() - start):.1f} ms, '
+          f'{np.isfinite(arrival).sum()} of {len(arrival)} stations reached')
+    depart = _seconds(args.depart)[0]
+    if args.destination:
+        target = node_index(timetable, args.destination)[0]
+        if np.isfinite(arrival[target]):
+            print(f'{args.origin} {_clock(depart)} -> {args.destination} '
+                  f'{_clock(arrival[target])} ({(arrival[target] - depart) / 60:.1f} min)')
+        else:
+            print(f'{args.destination} is not reachable from {args.origin} after {_clock(depart)}')
+
+    start = time.perf_counter()
+    all_origins = earliest_arrivals(timetable, np.arange(timetable['n_nodes']), depart,
+                                    args.max_transfers)
+    print(f'all {len(all_origins)} origins at {_clock(depart)}: '
+          f'{time.perf_counter() - start:.2f} s')
+
+    if args.until:
+        start = time.perf_counter()
+        departures, arrivals, pareto = profile(timetable, args.origin, args.depart, args.until,
+                                               args.max_transfers)
+        print(f'profile: {len(departures)} departures in '
+              f'{1000 * (time.perf_counter() - start):.1f} ms')
+        if args.destination:
+            for leave, arrive in zip(departures[pareto[:, target]], arrivals[pareto[:, target], target]):
+                print(f'  {_clock(leave)} -> {_clock(arrive)}')
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Origin-destination demand from station entries / exits (gravity model).
+
+The frequency model only sees a net supply per station. Here the morning
+entries O_i (productions) and evening exits D_j (attractions, the same
+commuters going home) of nodes_with_balanced_integer_net_ridership.csv are
+spread over station pairs with a doubly-constrained gravity model
+
+    T_ij = a_i O_i  b_j D_j  f(c_ij)
+
+where c_ij is the travel time (travel_times.py) and f the deterrence,
+exp(-beta * minutes) or minutes ** -beta. D is scaled to the total of O.
+The balancing factors a, b come from iterative proportional fitting; each
+iteration is two matrix-vector products, so a dense 450 x 450 fit takes
+milliseconds.
+
+For large zone systems the deterrence is built in row chunks (the cost
+matrix can be a memory map) and entries below ``cutoff`` are dropped, so
+the seed and the fitted OD matrix are scipy.sparse CSR matrices and the
+fit scales with the number of kept pairs. ``min_flow`` truncates small
+flows from the fitted matrix (keeping every zone's largest pair) and refits
+on the remaining pairs, so the stored matrix stays sparse and still matches
+both margins:
+
+    stop_ids, entries, exits = load_station_demand()
+    od = gravity_od(entries, exits, travel_seconds, beta=0.1, min_flow=1.0)
+
+    python od_matrix.py --beta 0.1 --min-flow 1 --output od_matrix.npz
+
+@author: aw03
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+GRAPH_DIR = 'generated_graphs'
+NODES_FILE = 'nodes_with_balanced_integer_net_ridership.csv'
+
+DEFAULT_BETA = 0.1   # per minute for 'exp', exponent for 'power'
+DETERRENCE = ('exp', 'power')
+
+
+def load_station_demand(graph_dir=GRAPH_DIR):
+    """stop_ids, morning entries and evening exits per station (0 where missing)."""
+    nodes = pd.read_csv(os.path.join(graph_dir, NODES_FILE), dtype={'stop_id': str})
+    return (nodes['stop_id'].to_numpy(),
+            nodes['ridership_morning'].fillna(0).to_numpy(dtype=np.float64),
+            nodes['ridership_evening'].fillna(0).to_numpy(dtype=np.float64))
+
+
+def deterrence(cost, beta=DEFAULT_BETA, function='exp'):
+    """f(c) for travel times ``cost`` in seconds; 0 where unreachable (inf / nan)."""
+    minutes = np.asarray(cost, dtype=np.float64) / 60.0
+    reachable = np.isfinite(minutes)
+    minutes = np.where(reachable, minutes, 0.0)
+    if function == 'exp':
+        f = np.exp(-beta * minutes)
+    elif function == 'power':
+        f = np.maximum(minutes, 1.0) ** -beta
+    else:
+        raise ValueError(f'unknown deterrence function {function!r}, expected one of {DETERRENCE}')
+    return np.where(reachable, f, 0.0)
+
+
+def deterrence_matrix(cost, beta=DEFAULT_BETA, function='exp', cutoff=0.0, intrazonal=False,
+                      chunk_rows=1024):
+    """
+    Deterrence for a (zones x zones) cost matrix, computed ``chunk_rows`` rows
+    at a time. Dense with ``cutoff`` 0; otherwise a CSR matrix without the
+    entries below ``cutoff``. The diagonal is 0 unless ``intrazonal``.
+    """
+    n = cost.shape[0]
+    blocks = []
+    dense = np.empty(cost.shape) if cutoff <= 0 else None
+    for start in range(0, n, chunk_rows):
+        stop = min(start + chunk_rows, n)
+        block = deterrence(cost[start:stop], beta, function)
+        if not intrazonal:
+            rows = np.arange(stop - start)
+            block[rows, rows + start] = 0.0
+        if dense is not None:
+            dense[start:stop] = block
+        else:
+            block[block < cutoff] = 0.0
+            blocks.append(sp.csr_matrix(block))
+    return dense if dense is not None else sp.vstack(blocks, format='csr')
+
+
+def _inverse(values):
+    return np.divide(1.0, values, out=np.zeros_like(values), where=values > 0)
+
+
+def _scale(seed, row, col):
+    """diag(row) @ seed @ diag(col), keeping seed dense or sparse."""
+    if sp.issparse(seed):
+        return sp.csr_matrix(sp.diags(row) @ seed @ sp.diags(col))
+    return row[:, None] * seed * col[None, :]
+
+
+def balance(seed, productions, attractions, tol=1e-5, max_iter=1000):
+    """
+    Balancing factors of the doubly-constrained model on ``seed`` (dense or
+    sparse): with row = a * O and col = b * D, seed scaled by row and col has
+    row sums O and column sums D. Returns (row, col, iterations, error),
+    error being the largest row-sum deviation relative to the total.
+    """
+    productions = np.asarray(productions, dtype=np.float64)
+    attractions = np.asarray(attractions, dtype=np.float64)
+    total = productions.sum()
+    seed_t = seed.T.tocsr() if sp.issparse(seed) else seed.T
+    col = attractions.copy()
+    sums = seed @ col
+    for iteration in range(1, max_iter + 1):
+        row = productions * _inverse(sums)
+        col = attractions * _inverse(seed_t @ row)
+        sums = seed @ col
+        error = np.abs(row * sums - productions).max() / max(total, 1.0)
+        if error < tol:
+            break
+    return row, col, iteration, error
+
+
+def gravity_od(productions, attractions, cost, beta=DEFAULT_BETA, function='exp', cutoff=0.0,
+               min_flow=0.0, intrazonal=False, tol=1e-5, max_iter=1000, chunk_rows=1024):
+    """
+    Doubly-constrained gravity OD matrix (trips, rows origins, columns
+    destinations) for zone ``productions`` / ``attractions`` and the travel
+    time matrix ``cost`` (seconds, inf if unreachable). Attractions are
+    scaled to the production total. Returns a dense array, or a CSR matrix
+    when ``cutoff`` or ``min_flow`` truncates pairs.
+    """
+    productions = np.asarray(productions, dtype=np.float64)
+    attractions = np.asarray(attractions, dtype=np.float64)
+    attractions = attractions * (productions.sum() / max(attractions.sum(), 1e-300))
+
+    start = time.perf_counter()
+    seed = deterrence_matrix(cost, beta, function, cutoff, intrazonal, chunk_rows)
+    row, col, iterations, error = balance(seed, productions, attractions, tol, max_iter)
+    od = _scale(seed, row, col)
+
+    if min_flow > 0:
+        # a zone whose flows are all below min_flow keeps its largest one,
+        # else its margin could not be met by the refit
+        od = sp.csr_matrix(od).tocoo()
+        row_max = od.max(axis=1).toarray().ravel()
+        col_max = od.max(axis=0).toarray().ravel()
+        keep = (od.data >= min_flow) | (od.data == row_max[od.row]) | (od.data == col_max[od.col])
+        od = sp.csr_matrix((od.data[keep], (od.row[keep], od.col[keep])), shape=od.shape)
+        row, col, more, error = balance(od, productions, attractions, tol, max_iter)
+        od = _scale(od, row, col)
+        iterations += more
+
+    pairs = od.nnz if sp.issparse(od) else np.count_nonzero(od)
+    print(f'Gravity OD: {len(productions)} zones, {pairs} pairs, {iterations} IPF iterations, '
+          f'margin error {error:.2e}, {time.perf_counter() - start:.2f} s')
+    if error >= tol:
+        print('Warning: IPF did not converge (zones with demand but no reachable partner?)')
+    return od
+
+
+def mean_trip_minutes(od, cost):
+    """Trip-weighted mean travel time of ``od`` in minutes."""
+    if sp.issparse(od):
+        od = od.tocoo()
+        seconds = np.asarray(cost[od.row, od.col], dtype=np.float64)
+        return float(od.data @ seconds / od.data.sum() / 60.0)
+    od = np.asarray(od)
+    seconds = np.where(od > 0, np.asarray(cost, dtype=np.float64), 0.0)
+    return float((od * seconds).sum() / od.sum() / 60.0)
+
+
+def save_od(filename, od, stop_ids):
+    """Write the OD matrix as CSR arrays plus the zone stop_ids (.npz)."""
+    od = sp.csr_matrix(od)
+    np.savez_compressed(filename, data=od.data, indices=od.indices, indptr=od.indptr,
+                        shape=np.array(od.shape), stop_ids=np.asarray(stop_ids, dtype=str))
+
+
+def load_od(filename):
+    """(CSR OD matrix, stop_ids) from save_od."""
+    with np.load(filename, allow_pickle=False) as arrays:
+        od = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                           shape=tuple(arrays['shape']))
+        return od, arrays['stop_ids']
+
+
+if __name__ == '__main__':
+    from travel_times import build_travel_times, station_index
+
+    parser = argparse.ArgumentParser(description='Gravity-model OD matrix from station entries / exits.')
+    parser.add_argument('--graph-dir', default=GRAPH_DIR)
+    parser.add_argument('--frequencies',
+                        help='CSV with route_name, trains_per_hour for the travel times')
+    parser.add_argument('--transfer-penalty', type=float, default=0.0, help='seconds per transfer')
+    parser.add_argument('--function', choices=DETERRENCE, default='exp')
+    parser.add_argument('--beta', type=float, default=DEFAULT_BETA)
+    parser.add_argument('--cutoff', type=float, default=0.0,
+                        help='drop station pairs with a smaller deterrence')
+    parser.add_argument('--min-flow', type=float, default=0.0,
+                        help='drop smaller flows and refit the remaining pairs')
+    parser.add_argument('--output', help='write the OD matrix to this .npz')
+    args = parser.parse_args()
+
+    stop_ids, entries, exits = load_station_demand(args.graph_dir)
+    frequencies = (pd.read_csv(args.frequencies, dtype={'route_name': str})
+                   if args.frequencies else None)
+    tt = build_travel_times(args.graph_dir, frequencies, args.transfer_penalty)
+    index = station_index(tt, stop_ids)
+    cost = np.asarray(tt['times'])[np.ix_(index, index)]
+
+    od = gravity_od(entries, exits, cost, args.beta, args.function, args.cutoff, args.min_flow)
+    print(f'{od.sum():.0f} trips, mean trip {mean_trip_minutes(od, cost):.1f} min')
+    if args.output:
+        save_od(args.output, od, stop_ids)
+        print(f'Saved: {args.output}')
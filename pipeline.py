@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory runner for the ridership preprocessing chain.
+
+The three preprocessing scripts run as stages on DataFrames held in memory:
+
+    aggregate   raw hourly ridership -> per-complex morning / evening sums
+    map_gtfs    + GTFS Stop IDs from MTA_Subway_Stations_*.csv
+    nodes       + graph nodes -> nodes_with_ridership.csv,
+                nodes_with_balanced_integer_net_ridership.csv (+ graph.bundle)
+
+Every stage is keyed on a hash of its input files, the keys of the stages
+feeding it and its code: the stage function plus the modules it calls into
+(``Stage.code``), so editing e.g. demand_balancing.py reruns the stage. The
+keys of the last successful run are kept in STATE_FILE. A stage whose key
+is unchanged and whose outputs are on disk is skipped (or, if a later stage
+needs it, loaded from disk), so rerunning on unchanged inputs only hashes
+the inputs. GTFS_MTA_with_routes.py rewrites graph.bundle without the
+BUNDLE_TABLES, so an up-to-date final stage whose tables are missing from
+the bundle is loaded from its CSVs and added back. Intermediate tables are
+only written with ``--persist``:
+
+    python pipeline.py             # run what is out of date
+    python pipeline.py --persist   # also keep the intermediate CSVs
+    python pipeline.py --status    # show which stages would run
+
+@author: aw03
+"""
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+
+import pandas as pd
+
+import aggregate_turnstile_data
+import create_nodes_with_ridership_info
+import demand_balancing
+import map_turnstile_data_to_gtfs_id
+from aggregate_turnstile_data import WINDOWS, stream_ridership
+from create_nodes_with_ridership_info import balance_node_demand, merge_node_ridership
+from graph_bundle import BUNDLE_FILE, read_schema, update_bundle
+from graph_cache import feed_hash
+from map_turnstile_data_to_gtfs_id import attach_gtfs_ids
+
+
+STATE_FILE = '.pipeline_state.json'
+
+FILES = {
+    'morning_raw': os.path.join('datasets', 'MTA_Subway_Hourly_Ridership__Oct_21_2024_Morning.csv'),
+    'evening_raw': os.path.join('datasets', 'MTA_Subway_Hourly_Ridership__Oct_21_2024_Evening.csv'),
+    'stations': os.path.join('datasets', 'MTA_Subway_Stations_20251204.csv'),
+    'nodes': os.path.join('generated_graphs', 'nodes.csv'),
+}
+
+# Tables of the final stage that also go into the graph bundle
+BUNDLE_TABLES = ['nodes_with_balanced_integer_net_ridership']
+
+
+class Stage:
+    """
+    One transform: ``run(**inputs)`` returns {output name: DataFrame}.
+    ``code`` lists the functions / modules ``run`` depends on; their source
+    is part of the stage key.
+    """
+
+    def __init__(self, name, inputs, outputs, run, code=(), final=False):
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs   # output name -> CSV path
+        self.run = run
+        self.code = list(code)
+        self.final = final       # final outputs are always written
+
+    def on_disk(self):
+        return all(os.path.exists(path) for path in self.outputs.values())
+
+    def load(self):
+        return {name: pd.read_csv(path) for name, path in self.outputs.items()}
+
+    def save(self, products):
+        for name, path in self.outputs.items():
+            products[name].to_csv(path, index=False)
+            print(f'Saved: {path}')
+
+
+def aggregate(morning_raw, evening_raw):
+    return {
+        'morning_aggregated': stream_ridership(
+            morning_raw, {'morning': WINDOWS['morning']})['morning'],
+        'evening_aggregated': stream_ridership(
+            evening_raw, {'evening': WINDOWS['evening']})['evening'],
+    }
+
+
+def map_gtfs(morning_aggregated, evening_aggregated, stations):
+    stations = pd.read_csv(stations)
+    return {
+        'morning_with_gtfs': attach_gtfs_ids(morning_aggregated, stations),
+        'evening_with_gtfs': attach_gtfs_ids(evening_aggregated, stations),
+    }
+
+
+def nodes_with_ridership(nodes, morning_with_gtfs, evening_with_gtfs):
+    nodes_merged = merge_node_ridership(pd.read_csv(nodes), morning_with_gtfs,
+                                        evening_with_gtfs)
+    return {
+        'nodes_with_ridership': nodes_merged,
+        'nodes_with_balanced_integer_net_ridership': balance_node_demand(nodes_merged),
+    }
+
+
+STAGES = [
+    Stage('aggregate', ['morning_raw', 'evening_raw'], {
+        'morning_aggregated': os.path.join(
+            'generated_turnstile_data', 'MTA_Subway_Aggregated_Ridership_Oct_21_2024_Morning.csv'),
+        'evening_aggregated': os.path.join(
+            'generated_turnstile_data', 'MTA_Subway_Aggregated_Ridership_Oct_21_2024_Evening.csv'),
+    }, aggregate, code=[aggregate_turnstile_data]),
+    Stage('map_gtfs', ['morning_aggregated', 'evening_aggregated', 'stations'], {
+        'morning_with_gtfs': os.path.join('generated_turnstile_data', 'morning_6to10_with_gtfs.csv'),
+        'evening_with_gtfs': os.path.join('generated_turnstile_data', 'evening_4to8_with_gtfs.csv'),
+    }, map_gtfs, code=[map_turnstile_data_to_gtfs_id]),
+    Stage('nodes', ['nodes', 'morning_with_gtfs', 'evening_with_gtfs'], {
+        'nodes_with_ridership': os.path.join('generated_graphs', 'nodes_with_ridership.csv'),
+        'nodes_with_balanced_integer_net_ridership': os.path.join(
+            'generated_graphs', 'nodes_with_balanced_integer_net_ridership.csv'),
+    }, nodes_with_ridership, code=[create_nodes_with_ridership_info, demand_balancing],
+        final=True),
+]
+
+
+def stage_keys(stages=STAGES, files=FILES):
+    """Hash of every stage's inputs (file contents / upstream keys) and code."""
+    producer = {output: stage for stage in stages for output in stage.outputs}
+    file_hashes = {}
+    keys = {}
+    for stage in stages:
+        h = hashlib.sha256(stage.name.encode())
+        for code in [stage.run] + stage.code:
+            h.update(inspect.getsource(code).encode())
+        for name in stage.inputs:
+            if name in files:
+                if name not in file_hashes:
+                    file_hashes[name] = feed_hash(files[name])
+                h.update(f'{name}={file_hashes[name]}'.encode())
+            else:
+                h.update(f'{name}<-{keys[producer[name].name]}'.encode())
+        keys[stage.name] = h.hexdigest()
+    return keys
+
+
+def _in_bundle(bundle_file, tables=BUNDLE_TABLES):
+    """True if the bundle exists and holds every table in ``tables``."""
+    if not os.path.exists(bundle_file):
+        return False
+    schema, _ = read_schema(bundle_file)
+    return all(name in schema['tables'] for name in tables)
+
+
+def _load_state(state_file):
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file) as f:
+        return json.load(f)
+
+
+def _save_state(state_file, state):
+    with open(state_file, 'w') as f:
+        json.dump(state, f, indent=1)
+
+
+def run_pipeline(persist=False, force=False, state_file=STATE_FILE, bundle_dir='generated_graphs'):
+    """
+    Bring the final outputs up to date; returns the DataFrames computed or
+    loaded on the way (empty when everything was already current).
+    """
+    keys = stage_keys()
+    state = _load_state(state_file)
+    producer = {output: stage for stage in STAGES for output in stage.outputs}
+    products = {}
+    bundle_file = os.path.join(bundle_dir, BUNDLE_FILE)
+
+    def add_to_bundle():
+        update_bundle(bundle_file, {name: products[name] for name in BUNDLE_TABLES})
+        print(f'Added {", ".join(BUNDLE_TABLES)} to {bundle_file}')
+
+    def fresh(stage):
+        return not force and state.get(stage.name) == keys[stage.name]
+
+    def product(name):
+        if name not in products:
+            stage = producer[name]
+            if fresh(stage) and stage.on_disk():
+                print(f'[{stage.name}] up to date, loading outputs')
+                products.update(stage.load())
+            else:
+                execute(stage)
+        return products[name]
+
+    def execute(stage):
+        inputs = {name: FILES[name] if name in FILES else product(name)
+                  for name in stage.inputs}
+        print(f'[{stage.name}] running')
+        products.update(stage.run(**inputs))
+        if stage.final or persist:
+            stage.save(products)
+        if stage.final:
+            add_to_bundle()
+        state[stage.name] = keys[stage.name]
+
+    for stage in STAGES:
+        if not stage.final:
+            continue
+        if not (fresh(stage) and stage.on_disk()):
+            execute(stage)
+        elif not _in_bundle(bundle_file):
+            print(f'[{stage.name}] up to date, restoring its tables in {bundle_file}')
+            products.update(stage.load())
+            add_to_bundle()
+        else:
+            print(f'[{stage.name}] up to date')
+    _save_state(state_file, state)
+    return products
+
+
+def status(state_file=STATE_FILE, bundle_dir='generated_graphs'):
+    keys = stage_keys()
+    state = _load_state(state_file)
+    bundle_file = os.path.join(bundle_dir, BUNDLE_FILE)
+    for stage in STAGES:
+        current = state.get(stage.name) == keys[stage.name]
+        line = (f'{stage.name:<10} {"up to date" if current else "changed":<11} '
+                f'{"outputs on disk" if stage.on_disk() else "outputs not persisted"}')
+        if stage.final and not _in_bundle(bundle_file):
+            line += f', tables missing from {bundle_file}'
+        print(line)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the ridership preprocessing stages.')
+    parser.add_argument('--persist', action='store_true',
+                        help='also write the intermediate CSVs of every stage')
+    parser.add_argument('--force', action='store_true', help='rerun every stage')
+    parser.add_argument('--status', action='store_true', help='only show stage status')
+    args = parser.parse_args()
+
+    if args.status:
+        status()
+    else:
+        run_pipeline(persist=args.persist, force=args.force)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+"""
+Partitioned Parquet store of the hourly subway ridership export.
+
+A one-time ingest turns the raw NYC Open Data export (``wujg-7c2s``) into a
+hive-partitioned dataset ``date=YYYY-MM-DD/hour=H/*.parquet`` holding just
+station_complex_id (dictionary encoded) and ridership. Queries for any date
+range, weekday set and hour window then only open the matching partitions
+and sum per complex, instead of rescanning the whole CSV:
+
+    python ridership_store.py ingest MTA_Subway_Hourly_Ridership.csv
+    python ridership_store.py query --start-date 2024-10-01 --end-date 2024-10-31 \\
+        --start-hour 6 --end-hour 10
+
+Needs pyarrow.
+
+@author: aw03
+"""
+
+import argparse
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+from aggregate_turnstile_data import (TIMESTAMP_FORMAT, WEEKDAYS, WINDOWS,
+                                      read_ridership_chunks)
+
+
+STORE_DIR = 'datasets/ridership_store'
+
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.string()), ('hour', pa.int8())]),
+                               flavor='hive')
+SCHEMA = pa.schema([
+    ('station_complex_id', pa.dictionary(pa.int32(), pa.string())),
+    ('ridership', pa.float64()),
+    ('date', pa.string()),
+    ('hour', pa.int8()),
+])
+
+
+def _ingest_batches(export_file):
+    """Record batches with the timestamp split into date / hour partition keys."""
+    partition_of_timestamp = {}
+    for timestamps, timestamp_codes, stations, station_codes, ridership in \
+            read_ridership_chunks(export_file):
+        new = [t for t in timestamps if t not in partition_of_timestamp]
+        if new:
+            ts = pd.to_datetime(pd.Index(new, dtype=str), format=TIMESTAMP_FORMAT)
+            partition_of_timestamp.update(zip(new, zip(ts.strftime('%Y-%m-%d'), ts.hour)))
+        dates = np.array([partition_of_timestamp[t][0] for t in timestamps], dtype=object)
+        hours = np.array([partition_of_timestamp[t][1] for t in timestamps], dtype=np.int8)
+
+        keep = (timestamp_codes >= 0) & (station_codes >= 0) & ~np.isnan(ridership)
+        ts_codes = timestamp_codes[keep]
+        yield pa.RecordBatch.from_arrays([
+            pa.DictionaryArray.from_arrays(pa.array(station_codes[keep], pa.int32()),
+                                           pa.array(stations, pa.string())),
+            pa.array(ridership[keep]),
+            pa.array(dates[ts_codes], pa.string()),
+            pa.array(hours[ts_codes]),
+        ], schema=SCHEMA)
+
+
+def ingest(export_file, store_dir=STORE_DIR):
+    """
+    Convert a raw hourly ridership CSV into the partitioned store.
+
+    Partitions already in the store are overwritten when the export covers
+    them again, so re-ingesting an updated export is safe.
+    """
+    ds.write_dataset(
+        _ingest_batches(export_file), store_dir, schema=SCHEMA, format='parquet',
+        partitioning=PARTITIONING, existing_data_behavior='delete_matching',
+        basename_template='part-{i}.parquet')
+    print(f'Ingested {export_file} into {store_dir}')
+
+
+def query_ridership(store_dir=STORE_DIR, start_date=None, end_date=None,
+                    weekdays=WEEKDAYS, start_hour=0, end_hour=24):
+    """
+    Ridership per station_complex_id over [start_hour, end_hour) on the
+    ``weekdays`` (Monday = 0) between ``start_date`` and ``end_date``
+    (inclusive). Same columns as aggregate_turnstile_data.py writes.
+
+    The filter only touches partition keys, so non-matching date / hour
+    directories are pruned before any file is opened.
+    """
+    dataset = ds.dataset(store_dir, format='parquet', partitioning=PARTITIONING)
+    hours = ds.field('hour')
+    condition = (hours >= start_hour) & (hours < end_hour)
+    if start_date is not None:
+        condition &= ds.field('date') >= pd.Timestamp(start_date).strftime('%Y-%m-%d')
+    if end_date is not None:
+        condition &= ds.field('date') <= pd.Timestamp(end_date).strftime('%Y-%m-%d')
+    if sorted(weekdays) != list(range(7)):
+        # weekday is not a partition key: resolve it to the stored dates
+        dates = pd.DatetimeIndex(sorted({ds.get_partition_keys(f.partition_expression)['date']
+                                         for f in dataset.get_fragments()}))
+        wanted = dates[np.isin(dates.dayofweek, weekdays)].strftime('%Y-%m-%d')
+        condition &= ds.field('date').isin(list(wanted))
+
+    table = dataset.to_table(columns=['station_complex_id', 'ridership'], filter=condition)
+    table = table.set_column(0, 'station_complex_id',
+                             table.column('station_complex_id').cast(pa.string()))
+    sums = table.group_by('station_complex_id').aggregate([('ridership', 'sum')]).to_pandas()
+
+    ids = sums['station_complex_id']
+    numeric_ids = pd.to_numeric(ids, errors='coerce')
+    if not numeric_ids.isna().any():
+        ids = numeric_ids.astype(np.int64)
+    result = pd.DataFrame({'station_complex_id': ids, 'ridership': sums['ridership_sum']})
+    return result.sort_values('station_complex_id', kind='stable').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Partitioned hourly ridership store.')
+    parser.add_argument('--store', default=STORE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    ingest_cmd = commands.add_parser('ingest', help='convert a raw export into the store')
+    ingest_cmd.add_argument('export')
+    query_cmd = commands.add_parser('query', help='per-complex sums for one window')
+    query_cmd.add_argument('--start-date')
+    query_cmd.add_argument('--end-date')
+    query_cmd.add_argument('--start-hour', type=int, default=WINDOWS['morning'][0])
+    query_cmd.add_argument('--end-hour', type=int, default=WINDOWS['morning'][1])
+    query_cmd.add_argument('--all-days', action='store_true',
+                           help='include weekends (default: Monday to Friday)')
+    query_cmd.add_argument('--output', help='CSV file (default: print)')
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        ingest(args.export, args.store)
+    else:
+        result = query_ridership(args.store, args.start_date, args.end_date,
+                                 range(7) if args.all_days else WEEKDAYS,
+                                 args.start_hour, args.end_hour)
+        if args.output:
+            result.to_csv(args.output, index=False)
+            print(f'Saved {len(result)} complexes to {args.output}')
+        else:
+            print(result.to_csv(index=False), end='')
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Dense days x 24 hours x station complexes ridership tensor.
+
+Sources are raw hourly ridership CSVs and / or the date partitions of the
+ridership_store; each source is aggregated to (date, hour, complex) sums in
+its own worker process, and the parent scatters the partial sums into a
+float32 ``.npy`` that is written and read back as a memory map. The dates
+and station_complex_ids along the axes are kept in ``<name>_index.npz``.
+
+Demand for any day and window is then a slice-and-sum, e.g. the 6-10am
+entries of one day:
+
+    tensor, index = load_tensor('generated_turnstile_data/ridership_tensor.npy')
+    window_ridership(tensor, index_of_date(index, '2024-10-21'), 6, 10)
+
+The export only counts entries (``ridership`` is taps at the station), so the
+tensor has entries only. ``window_demand`` applies the project's convention
+for the exits: AM-peak entries are the trips out, and PM-peak entries are
+the same riders going home, i.e. the exits of the morning trips.
+
+    python ridership_tensor.py export_2023.csv export_2024.csv --processes 4
+    python ridership_tensor.py --store datasets/ridership_store
+
+@author: aw03
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+
+import numpy as np
+import pandas as pd
+
+from aggregate_turnstile_data import TIMESTAMP_FORMAT, WINDOWS, read_ridership_chunks
+
+
+TENSOR_FILE = 'generated_turnstile_data/ridership_tensor.npy'
+
+
+def _index_file(tensor_file):
+    return os.path.splitext(tensor_file)[0] + '_index.npz'
+
+
+def _group_sums(dates, hours, stations, ridership):
+    """Collapse rows to unique (date, hour, station) sums."""
+    date_values, date_code = np.unique(dates, return_inverse=True)
+    station_values, station_code = np.unique(stations, return_inverse=True)
+    key = (date_code.astype(np.int64) * 24 + hours) * len(station_values) + station_code
+    key, inverse = np.unique(key, return_inverse=True)
+    sums = np.bincount(inverse, weights=ridership)
+    return {
+        'dates': date_values,
+        'stations': station_values,
+        'date_code': key // len(station_values) // 24,
+        'hour': key // len(station_values) % 24,
+        'station_code': key % len(station_values),
+        'ridership': sums,
+    }
+
+
+def _aggregate_csv(filename):
+    parts = []
+    for timestamps, timestamp_codes, stations, station_codes, ridership in \
+            read_ridership_chunks(filename):
+        ts = pd.to_datetime(pd.Index(timestamps, dtype=str), format=TIMESTAMP_FORMAT)
+        keep = (timestamp_codes >= 0) & (station_codes >= 0) & ~np.isnan(ridership)
+        codes = timestamp_codes[keep]
+        parts.append((ts.strftime('%Y-%m-%d').to_numpy(dtype=str)[codes],
+                      ts.hour.to_numpy()[codes],
+                      np.asarray(stations, dtype=str)[station_codes[keep]],
+                      ridership[keep]))
+    if not parts:
+        return _group_sums(np.zeros(0, dtype=str), np.zeros(0, dtype=np.int64),
+                           np.zeros(0, dtype=str), np.zeros(0))
+    return _group_sums(*(np.concatenate(column) for column in zip(*parts)))
+
+
+def _aggregate_partition(partition_dir):
+    """One ``date=YYYY-MM-DD`` directory of the ridership_store."""
+    import pyarrow.dataset as ds
+
+    from ridership_store import PARTITIONING
+
+    date = os.path.basename(os.path.normpath(partition_dir)).split('=', 1)[1]
+    table = ds.dataset(os.path.dirname(os.path.normpath(partition_dir)), format='parquet',
+                       partitioning=PARTITIONING).to_table(
+        columns=['hour', 'station_complex_id', 'ridership'],
+        filter=ds.field('date') == date)
+    return _group_sums(np.full(table.num_rows, date),
+                       table.column('hour').to_numpy().astype(np.int64),
+                       table.column('station_complex_id').cast('string').to_numpy(
+                           zero_copy_only=False).astype(str),
+                       table.column('ridership').to_numpy())
+
+
+def _aggregate_source(source):
+    if os.path.isdir(source):
+        return _aggregate_partition(source)
+    return _aggregate_csv(source)
+
+
+def store_partitions(store_dir):
+    """The ``date=...`` partition directories of a ridership_store, in date order."""
+    return sorted(os.path.join(store_dir, name) for name in os.listdir(store_dir)
+                  if name.startswith('date='))
+
+
+def _sorted_ids(ids):
+    """station_complex_ids in numeric order when they are all numeric."""
+    numeric = pd.to_numeric(pd.Index(ids), errors='coerce')
+    if not numeric.isna().any():
+        return np.sort(numeric.to_numpy().astype(np.int64))
+    return np.sort(np.asarray(ids, dtype=str))
+
+
+def build_tensor(sources, tensor_file=TENSOR_FILE, processes=None):
+    """
+    Aggregate ``sources`` (CSV files or store partition directories) over a
+    process pool into a (days, 24, complexes) float32 memmap at ``tensor_file``.
+
+    Days are every date seen in the sources, in order. Returns
+    (tensor, index) like load_tensor.
+    """
+    processes = min(processes or os.cpu_count(), len(sources))
+    if processes > 1:
+        with mp.Pool(processes) as pool:
+            parts = pool.map(_aggregate_source, sources)
+    else:
+        parts = [_aggregate_source(source) for source in sources]
+
+    dates = np.unique(np.concatenate([part['dates'] for part in parts]).astype(str))
+    station_ids = _sorted_ids(np.unique(np.concatenate([part['stations'] for part in parts])))
+    station_keys = station_ids.astype(str)
+    key_order = np.argsort(station_keys)
+
+    tensor = np.lib.format.open_memmap(tensor_file, mode='w+', dtype=np.float32,
+                                       shape=(len(dates), 24, len(station_ids)))
+    for part in parts:
+        day = np.searchsorted(dates, part['dates'])[part['date_code']]
+        station = key_order[np.searchsorted(station_keys[key_order],
+                                            part['stations'])][part['station_code']]
+        np.add.at(tensor, (day, part['hour'], station), part['ridership'])
+    tensor.flush()
+
+    index = {'dates': dates, 'station_complex_id': station_ids}
+    np.savez(_index_file(tensor_file), **index)
+    print(f'ridership tensor {tensor.shape} from {len(sources)} sources -> {tensor_file}')
+    return np.load(tensor_file, mmap_mode='r'), index
+
+
+def load_tensor(tensor_file=TENSOR_FILE):
+    """(read-only memmapped tensor, {'dates', 'station_complex_id'})."""
+    with np.load(_index_file(tensor_file), allow_pickle=False) as arrays:
+        index = {name: arrays[name] for name in arrays.files}
+    return np.load(tensor_file, mmap_mode='r'), index
+
+
+def index_of_date(index, dates):
+    """Tensor day index (or indices) of 'YYYY-MM-DD' ``dates``."""
+    day = np.searchsorted(index['dates'], dates)
+    if np.any(np.asarray(index['dates'])[np.minimum(day, len(index['dates']) - 1)] != dates):
+        raise KeyError(f'dates not in the ridership tensor: {dates}')
+    return day
+
+
+def window_ridership(tensor, day, start_hour, end_hour):
+    """Entries per complex over [start_hour, end_hour) of ``day`` (int or array of days)."""
+    return tensor[day, start_hour:end_hour].sum(axis=-2, dtype=np.float64)
+
+
+def window_demand(tensor, index, day, morning=WINDOWS['morning'], evening=WINDOWS['evening']):
+    """
+    Per-complex morning entries, evening entries (= exits of the morning
+    trips) and their difference for ``day``, one row per station complex.
+    """
+    ridership_morning = window_ridership(tensor, day, *morning)
+    ridership_evening = window_ridership(tensor, day, *evening)
+    return pd.DataFrame({
+        'station_complex_id': index['station_complex_id'],
+        'ridership_morning': ridership_morning,
+        'ridership_evening': ridership_evening,
+        'net_ridership': ridership_morning - ridership_evening,
+    })
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the days x hours x complexes tensor.')
+    parser.add_argument('exports', nargs='*', help='raw hourly ridership CSVs')
+    parser.add_argument('--store', help='ridership_store directory (one task per date)')
+    parser.add_argument('--output', default=TENSOR_FILE)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    sources = list(args.exports)
+    if args.store:
+        sources += store_partitions(args.store)
+    if not sources:
+        parser.error('give at least one export CSV or --store')
+    build_tensor(sources, args.output, args.processes)
@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+Merge stations into station complexes.
+
+Stations are joined when transfers.txt links them or when they share a
+``Complex ID`` in MTA_Subway_Stations_*.csv (Times Sq-42 St, Fulton St, ...).
+Components come from an array-based union-find, then the node, edge and
+transfer tables are re-indexed to one node per complex. Transfers inside a
+complex disappear, which shrinks both the node set and the transfer
+variables handed to the optimizer. ``node_complex`` maps every station node
+back to its complex.
+
+@author: aw03
+"""
+
+import csv
+
+import numpy as np
+import pandas as pd
+
+from gtfs_graph import TIME_COLUMNS
+
+
+STATIONS_FILE = 'datasets/MTA_Subway_Stations_20251204.csv'
+
+
+def _compress(parent):
+    """Point every entry straight at its root (pointer jumping)."""
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            return parent
+        parent = grand
+
+
+def union_find(n, a, b):
+    """
+    Component label of each of ``n`` items joined by the pairs (a[k], b[k]).
+
+    All pairs are linked per round: each root is hooked under the smallest
+    root it is paired with, then paths are compressed, until no pair spans
+    two components. Every label is the smallest index in its component.
+    """
+    parent = np.arange(n)
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    while True:
+        ra = parent[a]
+        rb = parent[b]
+        differ = ra != rb
+        if not differ.any():
+            return parent
+        np.minimum.at(parent, np.maximum(ra, rb)[differ], np.minimum(ra, rb)[differ])
+        parent = _compress(parent)
+
+
+def complex_id_pairs(nodes, stations_file):
+    """Node pairs sharing a ``Complex ID`` in the MTA stations dataset."""
+    stations = pd.read_csv(stations_file, usecols=['GTFS Stop ID', 'Complex ID'],
+                           dtype=str)
+    node_idx = pd.Index(nodes['stop_id']).get_indexer(stations['GTFS Stop ID'])
+    known = node_idx >= 0
+    complex_id = stations['Complex ID'].to_numpy()[known]
+    node_idx = node_idx[known]
+
+    # join every member with the first node listed for its complex
+    _, first, group = np.unique(complex_id, return_index=True, return_inverse=True)
+    return node_idx[first][group], node_idx
+
+
+def station_complexes(nodes, transfer_edges, stations_file=STATIONS_FILE):
+    """Dense complex index per station node, numbered by first member."""
+    n_nodes = len(nodes['stop_id'])
+    complex_a, complex_b = complex_id_pairs(nodes, stations_file)
+    a = np.concatenate((transfer_edges['from_idx'], complex_a))
+    b = np.concatenate((transfer_edges['to_idx'], complex_b))
+    labels = union_find(n_nodes, a, b)
+    roots, node_complex = np.unique(labels, return_inverse=True)
+    print('station complexes', len(roots), 'for', n_nodes, 'stations')
+    return node_complex.astype(np.int32)
+
+
+def merge_nodes(nodes, node_complex):
+    """
+    Complex-level node table.
+
+    The first member station gives the complex its stop_id and name; the
+    coordinates are the mean over the members.
+    """
+    _, first = np.unique(node_complex, return_index=True)
+    n_complexes = len(first)
+    members = np.bincount(node_complex, minlength=n_complexes)
+    lon = np.bincount(node_complex, weights=nodes['stop_lon'].astype(float)) / members
+    lat = np.bincount(node_complex, weights=nodes['stop_lat'].astype(float)) / members
+    return {
+        'stop_code': nodes['stop_code'][first],
+        'stop_id': nodes['stop_id'][first],
+        'stop_name': nodes['stop_name'][first],
+        'stop_lon': np.array([f'{x:.6f}' for x in lon], dtype=object),
+        'stop_lat': np.array([f'{x:.6f}' for x in lat], dtype=object),
+        'node_of_stop': np.where(nodes['node_of_stop'] >= 0,
+                                 node_complex[nodes['node_of_stop']], -1).astype(np.int32),
+    }
+
+
+def merge_edges(edges, node_complex):
+    """
+    Re-index route edges to complexes.
+
+    Rows are re-oriented so from_idx < to_idx (swapping the ``rev_`` time
+    columns along), edges inside one complex are dropped, and rows that now
+    share (from, to, route) are combined: counts add up and the run times
+    come from the row with the most trips.
+    """
+    cu = node_complex[edges['from_idx']]
+    cv = node_complex[edges['to_idx']]
+    flip = cu > cv
+    merged = {
+        'from_idx': np.minimum(cu, cv),
+        'to_idx': np.maximum(cu, cv),
+        'route_code': edges['route_code'],
+        'route_idx': edges['route_idx'],
+        'count': edges['count'],
+    }
+    for name in TIME_COLUMNS:
+        if name in edges:
+            fwd, rev = edges[name], edges['rev_' + name]
+            merged[name] = np.where(flip, rev, fwd)
+            merged['rev_' + name] = np.where(flip, fwd, rev)
+
+    keep = merged['from_idx'] != merged['to_idx']
+    merged = {k: v[keep] for k, v in merged.items()}
+
+    n = len(node_complex)
+    key = (merged['from_idx'].astype(np.int64) * n + merged['to_idx']) * \
+        (int(merged['route_idx'].max(initial=0)) + 1) + merged['route_idx']
+    order = np.lexsort((merged['count'], key))
+    _, inverse = np.unique(key, return_inverse=True)
+    last = np.flatnonzero(np.append(np.diff(key[order]) != 0, True))
+    rows = order[last]
+
+    combined = {k: v[rows] for k, v in merged.items()}
+    combined['count'] = np.bincount(inverse, weights=merged['count']).astype(np.int64)
+    return combined
+
+
+def merge_transfer_edges(transfer_edges, node_complex):
+    """Transfers between different complexes, one row per (from, to) pair."""
+    cu = node_complex[transfer_edges['from_idx']]
+    cv = node_complex[transfer_edges['to_idx']]
+    keep = cu != cv
+    _, first = np.unique(np.column_stack((cu[keep], cv[keep])), axis=0, return_index=True)
+    rows = np.flatnonzero(keep)[np.sort(first)]
+    merged = {k: v[rows] for k, v in transfer_edges.items()}
+    merged['from_idx'] = cu[rows]
+    merged['to_idx'] = cv[rows]
+    return merged
+
+
+def merge_complexes(graph, stations_file=STATIONS_FILE):
+    """
+    Replace the graph's nodes / edges / transfer_edges with complex-level tables.
+
+    The station-level node table is kept as ``station_nodes`` and
+    ``node_complex`` maps each station node_idx to its complex node_idx.
+    ``patterns`` and ``departures`` keep station-level indices.
+    """
+    node_complex = station_complexes(graph['nodes'], graph['transfer_edges'], stations_file)
+    merged = dict(graph)
+    merged['station_nodes'] = graph['nodes']
+    merged['node_complex'] = node_complex
+    merged['nodes'] = merge_nodes(graph['nodes'], node_complex)
+    merged['edges'] = merge_edges(graph['edges'], node_complex)
+    merged['transfer_edges'] = merge_transfer_edges(graph['transfer_edges'], node_complex)
+    print('complex edges', len(merged['edges']['count']),
+          'transfer edges', len(merged['transfer_edges']['from_idx']))
+    return merged
+
+
+def write_node_complexes_csv(filename, station_nodes, node_complex):
+    """Mapping from every GTFS station back to its complex node."""
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['stop_id', 'stop_name', 'station_idx', 'node_idx'])
+        writer.writerows(zip(
+            station_nodes['stop_id'],
+            station_nodes['stop_name'],
+            range(len(node_complex)),
+            node_complex,
+        ))
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+"""
+Shared paths for the tests; the modules live flat in the repository root.
+
+@author: aw03
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+GRAPH_DIR = os.path.join(ROOT, 'generated_graphs')
+DATASETS_DIR = os.path.join(ROOT, 'datasets')
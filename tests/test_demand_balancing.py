@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Row sums of the vectorized balanced integer demand.
+
+@author: aw03
+"""
+
+import numpy as np
+
+from demand_balancing import balanced_integer_demand
+
+
+def test_each_side_sums_to_floor_of_total():
+    rng = np.random.default_rng(0)
+    net = rng.normal(0, 100, (50, 40))
+    net[::7, ::3] = np.nan
+    totals = rng.uniform(100, 5000, 50)
+    supplies = balanced_integer_demand(net, totals)
+
+    assert supplies.dtype == np.int64
+    assert supplies.shape == net.shape
+    np.testing.assert_array_equal(np.clip(supplies, 0, None).sum(axis=1), np.floor(totals))
+    np.testing.assert_array_equal(np.clip(supplies, None, 0).sum(axis=1), -np.floor(totals))
+    np.testing.assert_array_equal(supplies.sum(axis=1), 0)
+    # signs follow the net ridership; NaN stations get nothing
+    assert np.all(supplies[np.nan_to_num(net) > 0] >= 0)
+    assert np.all(supplies[np.nan_to_num(net) < 0] <= 0)
+    assert np.all(supplies[np.isnan(net)] == 0)
+
+
+def test_single_scenario_is_one_row():
+    supplies = balanced_integer_demand([3.0, -1.0, 2.0, -4.0], 10.5)
+    np.testing.assert_array_equal(supplies, [[6, -2, 4, -8]])
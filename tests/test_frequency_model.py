@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""
+The HiGHS port of the frequency LP against the notebook's Gurobi optimum.
+
+@author: aw03
+"""
+
+import pytest
+
+from conftest import DATASETS_DIR, GRAPH_DIR
+from frequency_model import build_frequency_model, load_model_data, solve_frequency_model
+
+NOTEBOOK_OBJECTIVE = 6838332.50   # model.ipynb, Gurobi, default parameters
+
+
+def test_objective_matches_notebook():
+    data = load_model_data(GRAPH_DIR, DATASETS_DIR)
+    solution = solve_frequency_model(build_frequency_model(data))
+    assert solution['status'] == 0
+    assert solution['objective'] == pytest.approx(NOTEBOOK_OBJECTIVE, abs=0.01)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+Point order of the sweep grid (the solver itself needs highspy).
+
+@author: aw03
+"""
+
+import itertools
+
+from frequency_sweep import grid
+
+
+def test_grid_covers_the_product_once():
+    points = grid(lam=[0.0, 0.5, 1.0], beta=[1, 2], T_max=[30000, 43500, 50000])
+    keys = [(p['lam'], p['beta'], p['T_max']) for p in points]
+    assert sorted(keys) == sorted(itertools.product([0.0, 0.5, 1.0], [1, 2],
+                                                    [30000, 43500, 50000]))
+
+
+def test_consecutive_points_differ_by_one_step():
+    axes = {'lam': [0.0, 0.25, 0.5, 0.75], 'gamma': [8, 16, 32], 'T_max': [30000, 43500]}
+    points = grid(**axes)
+    for a, b in zip(points, points[1:]):
+        steps = [abs(axes[name].index(a[name]) - axes[name].index(b[name])) for name in axes]
+        assert sorted(steps) == [0, 0, 1]
+    # the last axis varies fastest
+    assert [p['T_max'] for p in points[:4]] == [30000, 43500, 43500, 30000]
+
+
+def test_single_values_and_scalars():
+    assert grid(lam=0.5, beta=[1.0]) == [{'lam': 0.5, 'beta': 1.0}]
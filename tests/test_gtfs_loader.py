@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Time parsing and trip-aligned stop_times ranges of the columnar loader.
+
+@author: aw03
+"""
+
+import io
+import os
+
+import numpy as np
+import pytest
+
+from gtfs_loader import (_parse_stop_times, gtfs_seconds, load_routes, load_stop_times,
+                         load_stop_times_parallel, load_stops, load_trips, trip_aligned_ranges)
+
+
+def test_gtfs_seconds_past_midnight():
+    seconds = gtfs_seconds(['05:07:09', '23:59:59', '24:00:05', '25:30:00', ' 26:01:00',
+                            '', None, 'bad'])
+    np.testing.assert_array_equal(seconds, [18429, 86399, 86405, 91800, 93660, -1, -1, -1])
+
+
+def test_gtfs_seconds_without_times():
+    np.testing.assert_array_equal(gtfs_seconds(['', '']), [-1, -1])
+
+
+@pytest.fixture
+def feed(tmp_path):
+    """
+    Feed with 60 trips of 1 to 12 stops, times past 24:00, quoted trip_ids
+    with commas and one trip of an excluded route.
+    """
+    with open(tmp_path / 'routes.txt', 'w') as f:
+        f.write('route_id,agency_id,route_short_name,route_color\n'
+                'A,MTA NYCT,A,0039A6\nSI,MTA NYCT,SI,08179C\n')
+    with open(tmp_path / 'stops.txt', 'w') as f:
+        f.write('stop_id,stop_name,stop_lat,stop_lon,parent_station\n')
+        for k in range(12):
+            f.write(f'S{k},Stop {k},40.{k},-73.{k},\n')
+    rng = np.random.default_rng(1)
+    with open(tmp_path / 'trips.txt', 'w') as trips, \
+            open(tmp_path / 'stop_times.txt', 'w') as stop_times:
+        trips.write('route_id,trip_id,service_id,direction_id\n')
+        stop_times.write('trip_id,arrival_time,departure_time,stop_id,stop_sequence\n')
+        for trip in range(60):
+            route = 'SI' if trip == 7 else 'A'
+            trip_id = f'"{route}_{trip:03d},x"' if trip % 9 == 0 else f'{route}_{trip:03d}'
+            trips.write(f'{route},{trip_id},WKD,{trip % 2}\n')
+            start = 23 * 3600 + 120 * trip
+            for stop in range(rng.integers(1, 13)):
+                t = start + 90 * stop
+                clock = f'{t // 3600}:{t // 60 % 60:02d}:{t % 60:02d}'
+                stop_times.write(f'{trip_id},{clock},{clock},S{stop},{stop + 1}\n')
+    return tmp_path
+
+
+def _tables(feed):
+    routes = load_routes(os.path.join(feed, 'routes.txt'), ['MTA NYCT'], ['SI'])
+    trips = load_trips(os.path.join(feed, 'trips.txt'), routes)
+    stops = load_stops(os.path.join(feed, 'stops.txt'))
+    return stops, trips
+
+
+@pytest.mark.parametrize('n_chunks', [1, 2, 3, 7, 25, 500])
+def test_trip_aligned_ranges_match_serial_parse(feed, n_chunks):
+    filename = os.path.join(feed, 'stop_times.txt')
+    stops, trips = _tables(feed)
+    serial = load_stop_times(filename, stops=stops, trips=trips)
+
+    header, ranges = trip_aligned_ranges(filename, n_chunks)
+    with open(filename, 'rb') as f:
+        assert f.readline() == header
+        assert ranges[0][0] == f.tell()
+    assert ranges[-1][1] == os.path.getsize(filename)
+    assert (len(ranges) > 1) == (n_chunks > 1)
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+    parts = []
+    with open(filename, 'rb') as f:
+        for start, end in ranges:
+            f.seek(start)
+            parts.append(_parse_stop_times(io.BytesIO(header + f.read(end - start)), stops, trips))
+    # no trip is split between two ranges
+    seen = [set(part['trip'].tolist()) for part in parts]
+    for k, trips_k in enumerate(seen):
+        assert not trips_k & set().union(*seen[k + 1:]) - {-1}
+    for column in serial:
+        np.testing.assert_array_equal(np.concatenate([part[column] for part in parts]),
+                                      serial[column])
+
+
+def test_parallel_loader_matches_serial(feed):
+    filename = os.path.join(feed, 'stop_times.txt')
+    stops, trips = _tables(feed)
+    serial = load_stop_times(filename, stops=stops, trips=trips)
+    parallel = load_stop_times_parallel(filename, stops=stops, trips=trips, processes=2,
+                                        chunks_per_process=3)
+    for column in serial:
+        np.testing.assert_array_equal(parallel[column], serial[column])
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+RAPTOR on a hand-checked synthetic feed.
+
+Line 1 runs 101 06:00 -> 103 06:05 -> 107 06:10. Line 2 leaves 107 at
+06:11 (arriving 113 06:16) and 06:15 (arriving 113 06:20). Changing trains
+at 107 takes 3 minutes, so the 06:11 train is missed and 101 06:00 reaches
+113 at 06:20:00.
+
+@author: aw03
+"""
+
+import numpy as np
+import pytest
+
+from GTFS_MTA_with_routes import build_graph
+from journey_planner import build_timetable, earliest_arrival, earliest_arrivals, node_index
+
+STOP_TIMES = {
+    ('1', 'T1'): [('101S', '06:00:00'), ('103S', '06:05:00'), ('107S', '06:10:00')],
+    ('2', 'T2a'): [('107S', '06:11:00'), ('113S', '06:16:00')],
+    ('2', 'T2b'): [('107S', '06:15:00'), ('113S', '06:20:00')],
+}
+
+
+def _seconds(clock):
+    h, m, s = map(int, clock.split(':'))
+    return 3600 * h + 60 * m + s
+
+
+@pytest.fixture
+def timetable(tmp_path):
+    files = {
+        'agency.txt': 'agency_id,agency_name\nMTA NYCT,MTA New York City Transit\n',
+        'routes.txt': 'route_id,agency_id,route_short_name,route_color\n'
+                      '1,MTA NYCT,1,EE352E\n2,MTA NYCT,2,EE352E\n',
+        'calendar.txt': 'service_id,monday,tuesday,wednesday,thursday,friday,saturday,sunday\n'
+                        'WKD,1,1,1,1,1,0,0\n',
+        'transfers.txt': 'from_stop_id,to_stop_id,transfer_type,min_transfer_time\n'
+                         '107,107,2,180\n',
+    }
+    stops = ['stop_id,stop_name,stop_lat,stop_lon,parent_station']
+    for k, station in enumerate(['101', '103', '107', '113']):
+        lat = 40.80 + 0.01 * k
+        stops.append(f'{station},Station {station},{lat:.2f},-73.95,')
+        stops += [f'{station}{d},Station {station},{lat:.2f},-73.95,{station}' for d in 'NS']
+    files['stops.txt'] = '\n'.join(stops) + '\n'
+    trips = ['route_id,trip_id,service_id,direction_id']
+    stop_times = ['trip_id,arrival_time,departure_time,stop_id,stop_sequence']
+    for (route, trip), calls in STOP_TIMES.items():
+        trips.append(f'{route},{trip},WKD,1')
+        stop_times += [f'{trip},{clock},{clock},{stop},{k + 1}'
+                       for k, (stop, clock) in enumerate(calls)]
+    files['trips.txt'] = '\n'.join(trips) + '\n'
+    files['stop_times.txt'] = '\n'.join(stop_times) + '\n'
+    for name, text in files.items():
+        (tmp_path / name).write_text(text)
+    return build_timetable(build_graph(str(tmp_path), build_networkx=False))
+
+
+def test_transfer_misses_the_earlier_train(timetable):
+    arrival = earliest_arrival(timetable, '101', '06:00')
+    target, change = node_index(timetable, ['113', '107'])
+    assert arrival[target] == _seconds('06:20:00')
+    assert arrival[change] == _seconds('06:10:00')
+
+
+def test_unreachable_without_transfer_or_train(timetable):
+    target = node_index(timetable, '113')[0]
+    no_transfer = earliest_arrival(timetable, '101', '06:00', max_transfers=0)
+    assert np.isinf(no_transfer[target])
+    too_late = earliest_arrival(timetable, '101', '06:01')
+    assert np.isinf(too_late[target])
+
+
+def test_batched_queries_match_single(timetable):
+    departs = ['06:00', '06:01', '06:10', '06:12']
+    batch = earliest_arrivals(timetable, ['101', '101', '107', '107'], departs)
+    for row, (origin, depart) in enumerate(zip(['101', '101', '107', '107'], departs)):
+        np.testing.assert_array_equal(batch[row], earliest_arrival(timetable, origin, depart))
+    target = node_index(timetable, '113')[0]
+    assert batch[2, target] == _seconds('06:16:00')
+    assert batch[3, target] == _seconds('06:20:00')
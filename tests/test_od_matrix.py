@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+"""
+Margins of the IPF gravity model, dense and sparse.
+
+@author: aw03
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+from od_matrix import balance, deterrence_matrix, gravity_od
+
+
+def _zones(n=60, seed=0):
+    rng = np.random.default_rng(seed)
+    xy = rng.uniform(0, 20, (n, 2))
+    cost = 30.0 * np.hypot(*(xy[:, None, :] - xy[None, :, :]).transpose(2, 0, 1)) + 60.0
+    productions = rng.uniform(0, 1000, n)
+    attractions = rng.uniform(0, 1000, n)
+    return productions, attractions * productions.sum() / attractions.sum(), cost
+
+
+def test_balance_matches_both_margins():
+    productions, attractions, cost = _zones()
+    seed = deterrence_matrix(cost)
+    row, col, iterations, error = balance(seed, productions, attractions)
+    od = row[:, None] * seed * col[None, :]
+
+    # error is the largest row deviation relative to the total
+    assert error < 1e-5
+    atol = 1e-5 * productions.sum()
+    np.testing.assert_allclose(od.sum(axis=1), productions, atol=atol)
+    np.testing.assert_allclose(od.sum(axis=0), attractions, atol=atol)
+
+
+def test_sparse_gravity_od_keeps_margins():
+    productions, attractions, cost = _zones()
+    od = gravity_od(productions, attractions, cost, cutoff=1e-3, min_flow=1.0)
+
+    assert sp.issparse(od)
+    assert od.data.min() > 0
+    atol = 1e-5 * productions.sum()
+    np.testing.assert_allclose(np.asarray(od.sum(axis=1)).ravel(), productions, atol=atol)
+    np.testing.assert_allclose(np.asarray(od.sum(axis=0)).ravel(), attractions, atol=atol)
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Frequency-based transit assignment: evaluate a frequency plan without an LP.
+
+Passengers are routed on the expanded station / entry / platform graph of
+travel_times.py. Boarding a line costs half its headway, and a line
+without trains cannot be boarded. In-vehicle edges get crowding costs
+
+    t0 * (1 + ALPHA * (load / capacity) ** POWER)
+
+where capacity is trains per hour x passengers per train (linecapacity.csv)
+x ``hours``, the period the demand covers. Flows come from all-or-nothing
+assignments, one multi-source Dijkstra over all origins, averaged by
+Frank-Wolfe (exact line search on the Beckmann objective) or the method of
+successive averages until the relative gap is below ``tol`` or for
+``max_iter`` iterations; a run that hits the limit prints a warning and
+returns ``converged`` False. The defaults are a screening setting: a 5%
+gap, which the notebook demand reaches in at most 7 iterations (under a
+second on one core). Loads are then good to a few percent; to rank close
+plans, lower ``tol`` (1e-3 takes about 80 iterations, 10 s, on the
+overloaded one-hour plan) and raise ``max_iter``.
+
+TransitAssignment reads the graph once. Each evaluate() call only changes
+edge costs, so a plan is assessed in a fraction of a second:
+
+    assignment = TransitAssignment()
+    result = assignment.evaluate({'A': 15, 'C': 8, ...}, od)   # or a supply vector s
+    result['loads']              # per (from, to, line): load, capacity, overload
+    result['passenger_time']     # passenger seconds
+
+Demand is an OD matrix (stations x stations in nodes.csv order, dense or
+scipy.sparse, e.g. od_matrix.py) or a net supply vector, which is spread
+over destinations with od_matrix.gravity_od on free-flow travel times.
+
+    python transit_assignment.py --frequencies frequencies.csv --od od_matrix.npz
+
+@author: aw03
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+
+from frequency_model import DATASETS_DIR, DEFAULT_CAPACITY, DEFAULTS, GRAPH_DIR
+from travel_times import DEFAULT_RUN_SECONDS, build_network, frequency_map
+
+
+ALPHA = 0.15          # crowding cost at capacity, relative to the run time
+POWER = 4.0
+NOT_RUNNING = 1e9     # boarding cost of a line without trains
+TOL = 5e-2            # relative gap for screening plans
+MAX_ITER = 10
+
+
+def _line_capacity(route_names, datasets_dir):
+    """Passengers per train for every route name (DEFAULT_CAPACITY if unknown)."""
+    table = pd.read_csv(os.path.join(datasets_dir, 'linecapacity.csv'),
+                        dtype={'route_short_name': str})
+    per_train = dict(zip(table['route_short_name'].str.strip(),
+                         table['total_rush_hour_capacity'].astype(np.float64)))
+    return np.array([per_train.get(name, DEFAULT_CAPACITY) for name in route_names])
+
+
+class TransitAssignment:
+    """The route graph of one graph_dir, assigned for changing frequencies and demand."""
+
+    def __init__(self, graph_dir=GRAPH_DIR, datasets_dir=DATASETS_DIR, transfer_penalty=0.0,
+                 default_run=DEFAULT_RUN_SECONDS, hours=DEFAULTS['delta']):
+        network = build_network(graph_dir, None, transfer_penalty, default_run)
+        graph = network['graph']
+        graph.sort_indices()
+        self.graph = graph
+        self.n = network['n_stations']
+        self.stop_ids = network['stop_ids']
+        self.hours = hours
+        n_nodes = graph.shape[0]
+
+        head = np.repeat(np.arange(n_nodes), np.diff(graph.indptr))
+        tail = graph.indices.astype(np.int64)
+        # edges sorted by (head, tail): edge id of (u, v) by searchsorted on u * n_nodes + v
+        self.edge_key = head * n_nodes + tail
+        self.base = graph.data.copy()
+        platform = 2 * self.n
+        route = network['node_route']
+
+        # route_idx -> position in route_names
+        self.route_names = network['route_names']
+        route_pos = np.full(max(network['route_idx'].max(), route.max()) + 1, -1)
+        route_pos[network['route_idx']] = np.arange(len(self.route_names))
+        self.boarding = np.flatnonzero((head < platform) & (tail >= platform))
+        self.boarding_line = route_pos[route[tail[self.boarding]]]
+        self.riding = np.flatnonzero((head >= platform) & (tail >= platform))
+        self.riding_line = route_pos[route[head[self.riding]]]
+        self.riding_from = network['node_station'][head[self.riding]]
+        self.riding_to = network['node_station'][tail[self.riding]]
+        self.per_train = _line_capacity(self.route_names, datasets_dir)
+
+    def costs(self, frequencies):
+        """Free-flow edge costs and in-vehicle edge capacities for a frequency plan."""
+        tph = frequency_map(frequencies)
+        per_hour = np.array([tph.get(name, 0.0) for name in self.route_names])
+        wait = np.where(per_hour > 0, 3600.0 / (2.0 * np.maximum(per_hour, 1e-12)), NOT_RUNNING)
+        free = self.base.copy()
+        free[self.boarding] += wait[self.boarding_line]
+        capacity = self.per_train[self.riding_line] * per_hour[self.riding_line] * self.hours
+        return free, capacity
+
+    def _shortest(self, cost, origins):
+        self.graph.data = cost
+        return dijkstra(self.graph, indices=self.n + origins, return_predecessors=True)
+
+    def _all_or_nothing(self, cost, origins, demand):
+        """Edge flows with every OD row on its shortest path, and the demand routed."""
+        dist, pred = self._shortest(cost, origins)
+        flow = np.zeros(dist.shape)
+        flow[:, :self.n] = np.where(dist[:, :self.n] < NOT_RUNNING, demand, 0.0)
+        routed = flow.sum()
+
+        # every (origin, node) is one node of a forest; tree depths by pointer
+        # jumping, then flow is pushed to the parent one depth level at a time
+        n_rows, n_nodes = dist.shape
+        node = np.arange(n_rows * n_nodes, dtype=np.int32)
+        reached = pred.ravel() >= 0
+        parent = np.where(reached, (node // n_nodes) * n_nodes + pred.ravel(), node).astype(np.int32)
+        depth = reached.astype(np.int16)
+        ancestor = parent
+        while True:
+            above = ancestor[ancestor]
+            if np.array_equal(above, ancestor):
+                break
+            depth += depth[ancestor]
+            ancestor = above
+        order = np.argsort(depth, kind='stable')
+        level = np.concatenate(([0], np.cumsum(np.bincount(depth))))
+        flow = flow.ravel()
+        for d in range(len(level) - 2, 0, -1):
+            nodes = order[level[d]:level[d + 1]]
+            np.add.at(flow, parent[nodes], flow[nodes])
+
+        tree = node[reached]
+        edge = np.searchsorted(self.edge_key, pred.ravel()[tree] * np.int64(n_nodes) + tree % n_nodes)
+        edge_flow = np.bincount(edge, weights=flow[tree], minlength=len(cost))
+        return edge_flow, routed
+
+    def _congested(self, free, flow, capacity):
+        cost = free.copy()
+        ratio = flow[self.riding] / np.maximum(capacity, 1e-12)
+        cost[self.riding] = free[self.riding] * (1.0 + ALPHA * ratio ** POWER)
+        return cost
+
+    def _line_search(self, free, flow, target, capacity, steps=30):
+        """Step in [0, 1] minimizing the Beckmann objective along flow -> target."""
+        direction = target - flow
+        low, high = 0.0, 1.0
+        for _ in range(steps):
+            step = (low + high) / 2.0
+            if self._congested(free, flow + step * direction, capacity) @ direction > 0:
+                high = step
+            else:
+                low = step
+        return (low + high) / 2.0
+
+    def demand_rows(self, demand, free):
+        """(origin stations, origins x stations demand) from an OD matrix or supply vector."""
+        if sp.issparse(demand) or np.ndim(demand) == 2:
+            od = demand.tocsr() if sp.issparse(demand) else np.asarray(demand, dtype=np.float64)
+        else:
+            from od_matrix import gravity_od
+            supply = np.asarray(demand, dtype=np.float64)
+            dist, _ = self._shortest(free, np.arange(self.n))
+            times = np.where(dist[:, :self.n] < NOT_RUNNING, dist[:, :self.n], np.inf)
+            od = gravity_od(np.maximum(supply, 0.0), np.maximum(-supply, 0.0), times)
+        sums = np.asarray(od.sum(axis=1)).ravel()
+        origins = np.flatnonzero(sums > 0)
+        rows = od[origins]
+        rows = rows.toarray() if sp.issparse(rows) else rows.copy()
+        rows[np.arange(len(origins)), origins] = 0.0
+        return origins, rows
+
+    def evaluate(self, frequencies, demand, method='fw', max_iter=MAX_ITER, tol=TOL):
+        """
+        Assign ``demand`` for ``frequencies`` (route_short_name -> trains per
+        hour, or a frequency_table). ``method`` is 'fw' (Frank-Wolfe) or 'msa'.
+        """
+        if method not in ('fw', 'msa'):
+            raise ValueError(f"unknown method {method!r}, expected 'fw' or 'msa'")
+        start = time.perf_counter()
+        free, capacity = self.costs(frequencies)
+        origins, rows = self.demand_rows(demand, free)
+
+        flow, routed = self._all_or_nothing(free, origins, rows)
+        gap = np.inf
+        for iteration in range(1, max_iter + 1):
+            cost = self._congested(free, flow, capacity)
+            target, routed = self._all_or_nothing(cost, origins, rows)
+            current = cost @ flow
+            gap = (current - cost @ target) / current if current > 0 else 0.0
+            if gap < tol:
+                break
+            step = (self._line_search(free, flow, target, capacity) if method == 'fw'
+                    else 1.0 / (iteration + 1))
+            flow = flow + step * (target - flow)
+
+        converged = gap < tol
+        if not converged:
+            print(f'Warning: assignment did not converge in {max_iter} iterations '
+                  f'(gap {gap:.1e}, tol {tol:.0e})')
+
+        cost = self._congested(free, flow, capacity)
+        load = flow[self.riding]
+        loads = pd.DataFrame({
+            'from_stop_id': self.stop_ids[self.riding_from],
+            'to_stop_id': self.stop_ids[self.riding_to],
+            'route_name': self.route_names[self.riding_line],
+            'load': load,
+            'capacity': capacity,
+            'volume_capacity': load / np.maximum(capacity, 1e-12),
+            'overload': np.maximum(load - capacity, 0.0),
+        })
+        return {
+            'loads': loads,
+            'edge_flow': flow,
+            'passenger_time': float(cost @ flow),
+            'free_flow_time': float(free @ flow),
+            'overload': float(loads['overload'].sum()),
+            'max_volume_capacity': float(loads['volume_capacity'].max()) if len(loads) else 0.0,
+            'unassigned': float(rows.sum() - routed),
+            'iterations': iteration,
+            'gap': float(gap),
+            'converged': bool(converged),
+            'seconds': time.perf_counter() - start,
+        }
+
+
+if __name__ == '__main__':
+    from od_matrix import load_od
+
+    parser = argparse.ArgumentParser(description='Assign demand to a line frequency plan.')
+    parser.add_argument('--graph-dir', default=GRAPH_DIR)
+    parser.add_argument('--datasets-dir', default=DATASETS_DIR)
+    parser.add_argument('--frequencies', required=True,
+                        help='CSV with route_name, trains_per_hour (frequency_model.py --output)')
+    parser.add_argument('--od', help='OD matrix .npz from od_matrix.py (default: the balanced '
+                                     'net supply spread by a gravity model)')
+    parser.add_argument('--hours', type=float, default=DEFAULTS['delta'],
+                        help='period the demand covers, for line capacities')
+    parser.add_argument('--transfer-penalty', type=float, default=0.0, help='seconds per transfer')
+    parser.add_argument('--method', choices=['fw', 'msa'], default='fw')
+    parser.add_argument('--max-iter', type=int, default=MAX_ITER)
+    parser.add_argument('--tol', type=float, default=TOL, help='relative gap')
+    parser.add_argument('--output', help='write the per-edge loads to this CSV')
+    args = parser.parse_args()
+
+    assignment = TransitAssignment(args.graph_dir, args.datasets_dir, args.transfer_penalty,
+                                   hours=args.hours)
+    frequencies = pd.read_csv(args.frequencies, dtype={'route_name': str})
+    if args.od:
+        od, od_stop_ids = load_od(args.od)
+        position = pd.Series(np.arange(assignment.n), index=assignment.stop_ids)
+        index = position.reindex(od_stop_ids).to_numpy()
+        if np.isnan(index).any():
+            raise KeyError('OD matrix stations missing from the graph')
+        index = index.astype(np.int64)
+        od = od.tocoo()
+        demand = sp.csr_matrix((od.data, (index[od.row], index[od.col])),
+                               shape=(assignment.n, assignment.n))
+    else:
+        nodes = pd.read_csv(os.path.join(args.graph_dir,
+                                         'nodes_with_balanced_integer_net_ridership.csv'),
+                            dtype={'stop_id': str})
+        demand = pd.Series(nodes['balanced_net_ridership_int'].fillna(0).to_numpy(dtype=float),
+                           index=nodes['stop_id']).reindex(assignment.stop_ids).fillna(0).to_numpy()
+
+    result = assignment.evaluate(frequencies, demand, args.method, args.max_iter, args.tol)
+    print(f"{args.method}: {result['iterations']} iterations, gap {result['gap']:.1e}, "
+          f"{result['seconds']:.2f} s")
+    print(f"passenger time {result['passenger_time'] / 3600:.0f} h "
+          f"(free flow {result['free_flow_time'] / 3600:.0f} h), "
+          f"overload {result['overload']:.0f}, max load / capacity "
+          f"{result['max_volume_capacity']:.2f}, unassigned {result['unassigned']:.0f}")
+    loads = result['loads'].sort_values('volume_capacity', ascending=False)
+    print(loads.head(10).to_string(index=False))
+    if args.output:
+        result['loads'].to_csv(args.output, index=False)
+        print(f'Saved: {args.output}')
@@ -0,0 +1,335 @@
+# -*- coding: utf-8 -*-
+"""
+All-pairs station travel times on the route graph, cached as memory maps.
+
+The generated_graphs tables are expanded into a weighted sparse digraph
+with one node per station, one entry node per station and one platform
+node per (station, line):
+
+    platform -> platform   in-vehicle time (edges_by_route time_median /
+                           rev_time_median, DEFAULT_RUN_SECONDS if missing)
+    entry    -> platform   wait: half the headway of the line, when
+                           ``frequencies`` (trains per hour) are given
+    station  -> platform   wait + ``transfer_penalty`` (changing lines)
+    platform -> station    0 (alighting)
+    entry    -> station    0
+    station  -> station    transfer_edges cost
+
+A trip starts at the origin's entry node, so only boardings after the first
+pay the transfer penalty, and ends at the destination's station node. Lines
+missing from ``frequencies`` (or at 0 trains per hour) cannot be boarded.
+
+Multi-source Dijkstra (scipy.sparse.csgraph) runs over chunks of origins in
+a process pool; every worker writes its rows straight into
+
+    <key>_times.npy   float32 (stations, stations) seconds, inf if unreachable
+    <key>_pred.npy    int32 (stations, graph nodes) shortest-path predecessors
+
+under CACHE_DIR. The key hashes the graph tables and the options, so later
+calls with the same inputs only memory-map the files:
+
+    tt = build_travel_times(frequencies={'A': 15, 'C': 8, ...})
+    travel_time(tt, 'A27', '101'), shortest_path(tt, 'A27', '101')
+
+    python travel_times.py --frequencies frequencies.csv --query A27 101
+
+@author: aw03
+"""
+
+import argparse
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.csgraph import dijkstra
+
+from graph_cache import feed_hash
+
+
+GRAPH_DIR = 'generated_graphs'
+CACHE_DIR = '.travel_time_cache'
+CACHE_VERSION = 1
+
+DEFAULT_RUN_SECONDS = 120.0   # in-vehicle time of an edge without scheduled times
+GRAPH_TABLES = ['nodes.csv', 'routes.csv', 'edges_by_route.csv', 'transfer_edges.csv']
+
+
+def _column(table, name, default):
+    if name not in table:
+        return np.full(len(table), default, dtype=np.float64)
+    return pd.to_numeric(table[name], errors='coerce').fillna(default).to_numpy(dtype=np.float64)
+
+
+def frequency_map(frequencies):
+    """{route_short_name: trains per hour} from a dict or a frequency_table()."""
+    if isinstance(frequencies, pd.DataFrame):
+        frequencies = dict(zip(frequencies['route_name'], frequencies['trains_per_hour']))
+    return {str(name).strip(): float(tph) for name, tph in frequencies.items()}
+
+
+def build_network(graph_dir=GRAPH_DIR, frequencies=None, transfer_penalty=0.0,
+                  default_run=DEFAULT_RUN_SECONDS):
+    """
+    Expanded station / entry / platform graph (see module docstring).
+    Returns a dict with the CSR 'graph', 'n_stations', 'entry' (offset of the
+    entry nodes), per-node 'node_station' and 'node_route' (-1 off platform),
+    and the station 'stop_ids' / 'stop_names' and 'route_names'.
+    """
+    nodes = pd.read_csv(os.path.join(graph_dir, 'nodes.csv'), dtype={'stop_id': str})
+    routes = pd.read_csv(os.path.join(graph_dir, 'routes.csv'), dtype={'route_short_name': str})
+    edges = pd.read_csv(os.path.join(graph_dir, 'edges_by_route.csv'))
+    transfers = pd.read_csv(os.path.join(graph_dir, 'transfer_edges.csv'))
+
+    node_idx = nodes['node_idx'].to_numpy(dtype=np.int64)
+    order = np.argsort(node_idx)
+    n = len(node_idx)
+
+    def station(ids):
+        return order[np.searchsorted(node_idx, ids, sorter=order)]
+
+    route_names = pd.Series(routes['route_short_name'].str.strip().to_numpy(),
+                            index=routes['route_idx'].to_numpy(dtype=np.int64))
+    src = station(edges['from_idx'].to_numpy(dtype=np.int64))
+    dst = station(edges['to_idx'].to_numpy(dtype=np.int64))
+    route = edges['route_idx'].to_numpy(dtype=np.int64)
+    run = _column(edges, 'time_median', default_run)
+    rev_run = _column(edges, 'rev_time_median', np.nan)
+    rev_run = np.where(np.isnan(rev_run), run, rev_run)
+
+    # one platform node per (station, route) served
+    stops = np.unique(np.concatenate([np.column_stack([src, route]), np.column_stack([dst, route])]),
+                      axis=0)
+    platform_base = 2 * n
+    radix = route.max() + 1 if len(route) else 1
+    keys = stops[:, 0] * radix + stops[:, 1]
+
+    def platform(stations, routes_):
+        return platform_base + np.searchsorted(keys, stations * radix + routes_)
+
+    # boarding is only possible on lines that run
+    wait = np.zeros(len(stops))
+    runs = np.ones(len(stops), dtype=bool)
+    if frequencies is not None:
+        tph = frequency_map(frequencies)
+        stop_names = route_names.reindex(stops[:, 1]).to_numpy()
+        per_hour = np.array([tph.get(name, 0.0) for name in stop_names])
+        missing = sorted(set(route_names.reindex(np.unique(route)).tolist()) - set(tph))
+        if missing:
+            print(f'No frequency for {", ".join(map(str, missing))}: not boardable')
+        runs = per_hour > 0
+        wait[runs] = 3600.0 / (2.0 * per_hour[runs])
+
+    platforms = platform_base + np.arange(len(stops))
+    boarding = np.flatnonzero(runs)
+    transfer_cost = _column(transfers, 'cost', np.nan)
+    if 'min_transfer_time' in transfers:
+        transfer_cost = np.where(np.isnan(transfer_cost),
+                                 _column(transfers, 'min_transfer_time', 0.0), transfer_cost)
+    transfer_cost = np.nan_to_num(transfer_cost)
+
+    heads = [platform(src, route), platform(dst, route),
+             n + stops[boarding, 0], stops[boarding, 0],
+             platforms, n + np.arange(n),
+             station(transfers['from_idx'].to_numpy(dtype=np.int64))]
+    tails = [platform(dst, route), platform(src, route),
+             platforms[boarding], platforms[boarding],
+             stops[:, 0], np.arange(n),
+             station(transfers['to_idx'].to_numpy(dtype=np.int64))]
+    weights = [run, rev_run,
+               wait[boarding], wait[boarding] + transfer_penalty,
+               np.zeros(len(stops)), np.zeros(n),
+               transfer_cost]
+    head, tail, weight = (np.concatenate(parts) for parts in (heads, tails, weights))
+
+    # parallel edges would be summed by the sparse constructor: keep the cheapest
+    first = np.lexsort((weight, tail, head))
+    head, tail, weight = head[first], tail[first], weight[first]
+    keep = np.ones(len(head), dtype=bool)
+    keep[1:] = (head[1:] != head[:-1]) | (tail[1:] != tail[:-1])
+    n_nodes = platform_base + len(stops)
+    graph = sp.csr_matrix((weight[keep], (head[keep], tail[keep])), shape=(n_nodes, n_nodes))
+
+    return {
+        'graph': graph,
+        'n_stations': n,
+        'entry': n,
+        'node_station': np.concatenate([np.arange(n), np.arange(n), stops[:, 0]]),
+        'node_route': np.concatenate([np.full(2 * n, -1), stops[:, 1]]),
+        'stop_ids': nodes['stop_id'].to_numpy(dtype=str),
+        'stop_names': nodes['stop_name'].astype(str).to_numpy(dtype=str),
+        'route_idx': route_names.index.to_numpy(),
+        'route_names': route_names.to_numpy(dtype=str),
+    }
+
+
+_worker = {}
+
+
+def _init_worker(graph, entry, times_file, pred_file):
+    _worker.update(graph=graph, entry=entry,
+                   times=np.load(times_file, mmap_mode='r+'),
+                   pred=np.load(pred_file, mmap_mode='r+'))
+
+
+def _dijkstra_rows(origins):
+    times, pred = _worker['times'], _worker['pred']
+    dist, predecessors = dijkstra(_worker['graph'], indices=_worker['entry'] + origins,
+                                  return_predecessors=True)
+    times[origins] = dist[:, :times.shape[1]]
+    pred[origins] = predecessors
+    times.flush()
+    pred.flush()
+    return len(origins)
+
+
+def cache_key(graph_dir=GRAPH_DIR, frequencies=None, transfer_penalty=0.0,
+              default_run=DEFAULT_RUN_SECONDS):
+    h = hashlib.sha256()
+    for name in GRAPH_TABLES:
+        h.update(feed_hash(os.path.join(graph_dir, name)).encode())
+    options = {
+        'version': CACHE_VERSION,
+        'frequencies': sorted(frequency_map(frequencies).items()) if frequencies is not None else None,
+        'transfer_penalty': float(transfer_penalty),
+        'default_run': float(default_run),
+    }
+    h.update(json.dumps(options, sort_keys=True).encode())
+    return h.hexdigest()[:32]
+
+
+def _files(cache_dir, key):
+    prefix = os.path.join(cache_dir, key)
+    return prefix + '_times.npy', prefix + '_pred.npy', prefix + '_index.npz'
+
+
+def build_travel_times(graph_dir=GRAPH_DIR, frequencies=None, transfer_penalty=0.0,
+                       default_run=DEFAULT_RUN_SECONDS, cache_dir=CACHE_DIR, processes=None,
+                       chunk_size=64):
+    """
+    Travel-time and predecessor matrices for the options, computed once and
+    memory-mapped from ``cache_dir`` afterwards. Returns load_travel_times'
+    dict.
+    """
+    key = cache_key(graph_dir, frequencies, transfer_penalty, default_run)
+    times_file, pred_file, index_file = _files(cache_dir, key)
+    if os.path.exists(index_file):
+        return load_travel_times(cache_dir, key)
+
+    start = time.perf_counter()
+    network = build_network(graph_dir, frequencies, transfer_penalty, default_run)
+    n, n_nodes = network['n_stations'], network['graph'].shape[0]
+    os.makedirs(cache_dir, exist_ok=True)
+    np.lib.format.open_memmap(times_file, mode='w+', dtype=np.float32, shape=(n, n)).flush()
+    np.lib.format.open_memmap(pred_file, mode='w+', dtype=np.int32, shape=(n, n_nodes)).flush()
+
+    chunks = [chunk for chunk in np.array_split(np.arange(n), max(1, -(-n // chunk_size)))
+              if len(chunk)]
+    init_args = (network['graph'], network['entry'], times_file, pred_file)
+    processes = min(processes or os.cpu_count(), len(chunks))
+    if processes > 1:
+        with mp.Pool(processes, _init_worker, init_args) as pool:
+            pool.map(_dijkstra_rows, chunks)
+    else:
+        _init_worker(*init_args)
+        for chunk in chunks:
+            _dijkstra_rows(chunk)
+        _worker.clear()
+
+    # the index is written last and marks the entry as complete
+    np.savez(index_file, **{name: network[name] for name in
+                            ['node_station', 'node_route', 'stop_ids', 'stop_names',
+                             'route_idx', 'route_names']},
+             entry=network['entry'])
+    print(f'Travel times for {n} stations ({n_nodes} graph nodes) in '
+          f'{time.perf_counter() - start:.2f} s -> {times_file}')
+    return load_travel_times(cache_dir, key)
+
+
+def load_travel_times(cache_dir, key):
+    """Memory-mapped 'times' / 'pred' plus the node index arrays."""
+    times_file, pred_file, index_file = _files(cache_dir, key)
+    with np.load(index_file, allow_pickle=False) as arrays:
+        tt = {name: arrays[name] for name in arrays.files}
+    tt['entry'] = int(tt['entry'])
+    tt['times'] = np.load(times_file, mmap_mode='r')
+    tt['pred'] = np.load(pred_file, mmap_mode='r')
+    return tt
+
+
+def station_index(tt, stop_ids):
+    """Matrix row / column of GTFS stop_id(s)."""
+    stop_ids = np.asarray(stop_ids, dtype=str)
+    order = np.argsort(tt['stop_ids'])
+    position = np.searchsorted(tt['stop_ids'], stop_ids, sorter=order)
+    found = order[np.minimum(position, len(order) - 1)]
+    if np.any(tt['stop_ids'][found] != stop_ids):
+        raise KeyError(f'unknown stop_id in {stop_ids}')
+    return found
+
+
+def travel_time(tt, origins, destinations):
+    """Seconds from origin to destination stop_id(s) (broadcasting), inf if unreachable."""
+    return tt['times'][station_index(tt, origins), station_index(tt, destinations)]
+
+
+def shortest_path(tt, origin, destination):
+    """
+    Legs of the fastest trip as (from stop_id, to stop_id, route_short_name);
+    the route is '' for walking transfers. Empty if unreachable.
+    """
+    o, d = station_index(tt, [origin, destination])
+    if not np.isfinite(tt['times'][o, d]):
+        return []
+    pred = tt['pred'][o]
+    nodes = [d]
+    while nodes[-1] != tt['entry'] + o:
+        nodes.append(int(pred[nodes[-1]]))
+    nodes = nodes[::-1]
+
+    station, route = tt['node_station'], tt['node_route']
+    names = dict(zip(tt['route_idx'].tolist(), tt['route_names'].tolist()))
+    legs = []
+    riding = False
+    for a, b in zip(nodes[:-1], nodes[1:]):
+        if station[a] == station[b]:        # boarding / alighting
+            riding = False
+            continue
+        stop_a, stop_b = tt['stop_ids'][station[a]], tt['stop_ids'][station[b]]
+        if route[b] < 0:
+            legs.append((stop_a, stop_b, ''))
+        elif riding:
+            legs[-1] = (legs[-1][0], stop_b, legs[-1][2])
+        else:
+            legs.append((stop_a, stop_b, names[route[b]]))
+            riding = True
+    return legs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='All-pairs station travel times.')
+    parser.add_argument('--graph-dir', default=GRAPH_DIR)
+    parser.add_argument('--frequencies',
+                        help='CSV with route_name, trains_per_hour (frequency_model.py --output)')
+    parser.add_argument('--transfer-penalty', type=float, default=0.0, help='seconds per transfer')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--query', nargs=2, metavar=('FROM', 'TO'), help='two GTFS stop_ids')
+    args = parser.parse_args()
+
+    frequencies = (pd.read_csv(args.frequencies, dtype={'route_name': str})
+                   if args.frequencies else None)
+    tt = build_travel_times(args.graph_dir, frequencies, args.transfer_penalty,
+                            cache_dir=args.cache_dir, processes=args.processes)
+    reachable = np.isfinite(tt['times'])
+    print(f'{reachable.mean():.1%} of station pairs reachable, median '
+          f'{np.median(tt["times"][reachable]) / 60:.1f} min')
+    if args.query:
+        seconds = travel_time(tt, *args.query)
+        print(f'{args.query[0]} -> {args.query[1]}: {seconds / 60:.1f} min')
+        for from_stop, to_stop, route in shortest_path(tt, *args.query):
+            print(f'  {from_stop:<6} -> {to_stop:<6} {route or "walk"}')
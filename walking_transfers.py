@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Out-of-system walking transfers between nearby stations.
+
+transfers.txt only lists in-system connections. Station pairs within a
+walking radius are found with a KD-tree over the node coordinates (as points
+on the unit sphere, so the chord radius is exact at any latitude), which is
+O(n log n) rather than an all-pairs scan and stays fast on regional feeds
+with tens of thousands of stops. Walking times come from a vectorized
+haversine distance and are merged into ``transfer_edges`` in both directions,
+with the time as the transfer ``cost``.
+
+Needs scipy (imported on first use).
+
+@author: aw03
+"""
+
+import numpy as np
+
+
+EARTH_RADIUS_M = 6371008.8
+
+WALK_RADIUS_M = 400
+WALK_SPEED_MPS = 1.2
+# Street distance over straight-line distance
+DETOUR_FACTOR = 1.3
+
+# GTFS transfer_type for transfers that need min_transfer_time
+WALK_TRANSFER_TYPE = '2'
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters; arguments are degree arrays."""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(x, dtype=np.float64))
+                              for x in (lat1, lon1, lat2, lon2))
+    a = (np.sin((lat2 - lat1) / 2) ** 2 +
+         np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def walk_seconds(distance_m, speed=WALK_SPEED_MPS, detour=DETOUR_FACTOR):
+    return distance_m * detour / speed
+
+
+def node_walk_seconds(nodes, from_idx, to_idx):
+    """Walking time between pairs of graph nodes."""
+    lat = nodes['stop_lat'].astype(np.float64)
+    lon = nodes['stop_lon'].astype(np.float64)
+    return walk_seconds(haversine_m(lat[from_idx], lon[from_idx], lat[to_idx], lon[to_idx]))
+
+
+def _unit_vectors(lat, lon):
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    return np.column_stack((np.cos(lat) * np.cos(lon),
+                            np.cos(lat) * np.sin(lon),
+                            np.sin(lat)))
+
+
+def nearby_pairs(nodes, radius_m=WALK_RADIUS_M):
+    """Node pairs (i < j) at most ``radius_m`` apart, via a KD-tree."""
+    from scipy.spatial import cKDTree
+
+    lat = nodes['stop_lat'].astype(np.float64)
+    lon = nodes['stop_lon'].astype(np.float64)
+    tree = cKDTree(_unit_vectors(lat, lon))
+    chord = 2 * np.sin(radius_m / (2 * EARTH_RADIUS_M))
+    pairs = tree.query_pairs(chord, output_type='ndarray')
+    pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+    return pairs[:, 0].astype(np.int32), pairs[:, 1].astype(np.int32)
+
+
+def walking_transfer_edges(nodes, transfer_edges, radius_m=WALK_RADIUS_M,
+                           speed=WALK_SPEED_MPS, detour=DETOUR_FACTOR):
+    """
+    Walking transfers for nearby node pairs not already in ``transfer_edges``.
+
+    Rows come in both directions with transfer_type 2 and the rounded walking
+    time as min_transfer_time and cost.
+    """
+    i, j = nearby_pairs(nodes, radius_m)
+
+    # transfers.txt wins wherever it links the pair in either direction
+    n_nodes = len(nodes['stop_id'])
+    lo = np.minimum(transfer_edges['from_idx'], transfer_edges['to_idx']).astype(np.int64)
+    hi = np.maximum(transfer_edges['from_idx'], transfer_edges['to_idx']).astype(np.int64)
+    new = ~np.isin(i.astype(np.int64) * n_nodes + j, lo * n_nodes + hi)
+    i, j = i[new], j[new]
+
+    lat = nodes['stop_lat'].astype(np.float64)
+    lon = nodes['stop_lon'].astype(np.float64)
+    seconds = np.round(walk_seconds(haversine_m(lat[i], lon[i], lat[j], lon[j]),
+                                    speed, detour))
+    seconds = np.concatenate((seconds, seconds))
+    walking = {
+        'from_idx': np.concatenate((i, j)),
+        'to_idx': np.concatenate((j, i)),
+        'transfer_type': np.full(len(seconds), WALK_TRANSFER_TYPE, dtype=object),
+        'min_transfer_time': seconds.astype(np.int64).astype(str).astype(object),
+        'cost': seconds,
+    }
+    print('walking transfers', len(seconds), 'within', radius_m, 'm')
+    return walking
+
+
+def add_walking_transfers(nodes, transfer_edges, radius_m=WALK_RADIUS_M,
+                          speed=WALK_SPEED_MPS, detour=DETOUR_FACTOR):
+    """``transfer_edges`` with the walking transfers appended."""
+    walking = walking_transfer_edges(nodes, transfer_edges, radius_m, speed, detour)
+    return {name: np.concatenate((values, walking[name]))
+            for name, values in transfer_edges.items()}